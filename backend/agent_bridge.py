@@ -0,0 +1,78 @@
+"""
+Bridge from /api/detect-component to the live agent session
+When an upload names the LiveKit room it belongs to (the `room` returned by
+/api/get-token), the compact components[]/recommendations[] part of the
+result is sent to that room over the LiveKit data channel (SendData, topic
+DETECTION_TOPIC). The room's VideoAgent picks it up and adds it to its
+context, so it does not have to re-derive the components from video frames
+with its own vision tokens.
+
+Publishing happens in the background after the response is rendered; a
+failed publish is logged and counted, never surfaced to the uploader.
+"""
+import asyncio
+import json
+import os
+import time
+
+from livekit.api import LiveKitAPI, SendDataRequest, DataPacket
+
+from metrics import REGISTRY
+from retries import retry_async
+
+DETECTION_TOPIC = "component-detection"
+BRIDGE_ENABLED = os.getenv("AGENT_BRIDGE_ENABLED", "1") == "1"
+BRIDGE_TIMEOUT = float(os.getenv("AGENT_BRIDGE_TIMEOUT", "5"))
+
+AGENT_BRIDGE_PUBLISHES = REGISTRY.counter(
+    "agent_bridge_publishes_total", "Detection results sent to agent rooms by outcome", ("outcome",),
+)
+
+_pending = set()
+
+
+def compact_payload(result):
+    """The part of a detection result the agent needs, without the image or prose analysis"""
+    structured = result.get("structured_data") or {}
+    return {
+        "type": "detection",
+        "ts": time.time(),
+        "summary": structured.get("summary", ""),
+        "components": [
+            {key: component.get(key) for key in ("id", "name", "type", "position", "upgrade_category")}
+            for component in structured.get("components", [])
+        ],
+        "recommendations": [
+            {key: recommendation.get(key) for key in ("component", "action", "next_steps")}
+            for recommendation in structured.get("recommendations", [])
+        ],
+    }
+
+
+async def publish(client, room, result):
+    """Send result to room; client is the process-wide LiveKitAPI or None for a one-off one"""
+    request = SendDataRequest(
+        room=room,
+        data=json.dumps(compact_payload(result), separators=(",", ":")).encode(),
+        kind=DataPacket.Kind.RELIABLE,
+        topic=DETECTION_TOPIC,
+    )
+    try:
+        if client is None:
+            async with LiveKitAPI() as one_off:
+                await asyncio.wait_for(one_off.room.send_data(request), BRIDGE_TIMEOUT)
+        else:
+            await retry_async(lambda: client.room.send_data(request), attempts=2, timeout=BRIDGE_TIMEOUT)
+        AGENT_BRIDGE_PUBLISHES.inc(outcome="ok")
+    except Exception as e:
+        AGENT_BRIDGE_PUBLISHES.inc(outcome="error")
+        print(f"⚠️ Failed to send detection to room {room}: {e}")
+
+
+def publish_in_background(client, room, result):
+    if not BRIDGE_ENABLED or not room:
+        return
+    task = asyncio.create_task(publish(client, room, result))
+    # Keep a reference until done so the task is not garbage collected mid-flight
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
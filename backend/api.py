@@ -1,24 +1,38 @@
 from contextlib import asynccontextmanager
+import asyncio
+from datetime import date
 import os
 from uuid import uuid4
-import base64
+import time
+from typing import Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Query, File, UploadFile
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from livekit.api import LiveKitAPI, ListRoomsRequest, AccessToken, VideoGrants, CreateRoomRequest
 from pydantic import BaseModel
+import aiohttp
 import uvicorn
 
-try:
-    from livekit.plugins import google
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-
 from component_detector import detector
+from detection_pipeline import (
+    run_detection, get_vision_model, QuotaExceededError,
+    cache_key, get_cached, put_cached, claim_or_wait, release, DETECT_TILED, get_router,
+)
+import model_router
+import usage_ledger
+from tracing import get_tracer
+from retries import retry_async
+from room_pool import RoomPool
+from uploads import receive_image, memory_budget, UploadRejected, UPLOAD_REJECTIONS, UPLOAD_BUDGET_WAIT
+from deadline import from_request as deadline_from_request, DeadlineExceeded
+from schemas import DetectionResponse, JobSubmitted, JobResponse
+import jobs
+import live_detect
+from agent_bridge import publish_in_background
+from serialization import render, MSGPACK_TYPES
+from metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE, DETECT_REQUEST_SECONDS, detect_stage
 
 load_dotenv()
 
@@ -26,28 +40,90 @@ load_dotenv()
 api_key = os.environ.get('LIVEKIT_API_KEY')
 api_secret = os.environ.get('LIVEKIT_API_SECRET')
 livekit_url = os.environ.get('LIVEKIT_URL')
-gemini_api_key = os.environ.get('GOOGLE_API_KEY')
 
-# Configure Gemini if available
-if GEMINI_AVAILABLE and gemini_api_key:
-    genai.configure(api_key=gemini_api_key)
-    # Use Gemini 2.0 Flash for best quota: 15 RPM, 1M tokens/min, 200 requests/day
+# One LiveKitAPI client per worker process, sharing a keep-alive connection
+# pool, instead of a new HTTP session + TLS handshake per token request.
+# LIVEKIT_POOLED=0 restores the per-call client (useful for benchmarking).
+livekit_client = None
+room_pool = None
+LIVEKIT_CALL_TIMEOUT = float(os.getenv("LIVEKIT_CALL_TIMEOUT", "5"))
+LIVEKIT_RETRIES = int(os.getenv("LIVEKIT_RETRIES", "3"))
+
+
+async def create_room(request: CreateRoomRequest):
+    if livekit_client is None:
+        async with LiveKitAPI() as client:
+            return await client.room.create_room(request)
+    # CreateRoom is idempotent on the room name, so retrying is safe
+    return await retry_async(
+        lambda: livekit_client.room.create_room(request),
+        attempts=LIVEKIT_RETRIES,
+        timeout=LIVEKIT_CALL_TIMEOUT,
+    )
+
+
+def new_room_request(empty_timeout: int = 0) -> CreateRoomRequest:
+    return CreateRoomRequest(
+        name=f"test-room-{uuid4().hex}",
+        departure_timeout=60,
+        empty_timeout=empty_timeout,
+    )
+
+
+def create_room_pool() -> RoomPool:
+    room_ttl = int(os.getenv("ROOM_POOL_EMPTY_TIMEOUT", "300"))
+
+    async def create_pooled_room():
+        room = await create_room(new_room_request(empty_timeout=room_ttl))
+        return room.name
+
+    return RoomPool(
+        create_pooled_room,
+        min_size=int(os.getenv("ROOM_POOL_MIN", "2")),
+        max_size=int(os.getenv("ROOM_POOL_MAX", "50")),
+        lead_time=float(os.getenv("ROOM_POOL_LEAD_TIME", "30")),
+        room_ttl=room_ttl,
+        retire_margin=float(os.getenv("ROOM_POOL_RETIRE_MARGIN", "60")),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global livekit_client, room_pool
+    if os.getenv("API_EAGER_LOAD", "0") == "1":
+        get_vision_model()
+        detector.gemini_model
+    session = None
+    if api_key and api_secret and os.getenv("LIVEKIT_POOLED", "1") == "1":
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=int(os.getenv("LIVEKIT_POOL_SIZE", "100")),
+                keepalive_timeout=float(os.getenv("LIVEKIT_KEEPALIVE", "60")),
+                ttl_dns_cache=300,
+            ),
+            timeout=aiohttp.ClientTimeout(total=LIVEKIT_CALL_TIMEOUT, connect=min(2.0, LIVEKIT_CALL_TIMEOUT)),
+        )
+        livekit_client = LiveKitAPI(session=session)
+    if api_key and api_secret and os.getenv("ROOM_POOL_ENABLED", "1") == "1":
+        room_pool = create_room_pool()
+        room_pool.start(interval=float(os.getenv("ROOM_POOL_REFILL_INTERVAL", "5")))
+    if jobs.JOBS_ENABLED:
+        jobs.start_pool()
     try:
-        vision_model = genai.GenerativeModel('gemini-2.5-flash')
-        print("✅ Using Gemini 2.0 Flash (200 requests/day, 1M tokens/min)")
-    except Exception as e:
-        print(f"⚠️ Failed to load Gemini 2.0 Flash, trying alternatives: {e}")
-        try:
-            # Fallback to 2.5 Flash (10 RPM, 250 requests/day)
-            vision_model = genai.GenerativeModel('gemini-2.5-flash')
-            print("✅ Using Gemini 2.5 Flash (250 requests/day)")
-        except Exception as e2:
-            print(f"⚠️ Gemini model load error: {e2}")
-            vision_model = None
-else:
-    vision_model = None
+        yield
+    finally:
+        await jobs.stop_pool()
+        if room_pool is not None:
+            await room_pool.stop()
+            room_pool = None
+        if livekit_client is not None:
+            await livekit_client.aclose()
+            # LiveKitAPI leaves a caller-provided session open
+            await session.close()
+            livekit_client = None
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -63,14 +139,10 @@ async def get_token(participant: str):
     if not api_key or not api_secret:
         raise HTTPException(status_code=500, detail="LiveKit API credentials not configured")
 
-    room_name = ""
-    async with LiveKitAPI() as client:
-        room = await client.room.create_room(
-            CreateRoomRequest(
-                name=f"test-room-{uuid4().hex}",
-                departure_timeout=60,
-            ),
-        )
+    # Serve a pre-created room when available; create one on demand otherwise
+    room_name = room_pool.acquire() if room_pool is not None else None
+    if room_name is None:
+        room = await create_room(new_room_request())
         room_name = room.name
     
     token = AccessToken(api_key, api_secret) \
@@ -85,119 +157,94 @@ async def get_token(participant: str):
     
     return {
         "token": token.to_jwt(),
-        "url": livekit_url
+        "url": livekit_url,
+        # Pass back as ?room= on /api/detect-component to share results with this room's agent
+        "room": room_name,
     }
 
-@app.post("/api/detect-component")
-async def detect_component(image: UploadFile = File(...)):
-    """Analyze uploaded image to detect hardware components using Gemini Vision AI"""
+@app.post(
+    "/api/detect-component",
+    response_model=None,
+    responses={200: {"model": DetectionResponse, "content": {MSGPACK_TYPES[0]: {}}}},
+)
+async def detect_component(request: Request):
+    """
+    Analyze uploaded image to detect hardware components using Gemini Vision AI.
+    Expects multipart/form-data with an `image` file field; the body is streamed
+    and validated in uploads.py rather than read into memory by FastAPI.
+
+    The whole request runs against one deadline (X-Deadline-Ms header or
+    ?deadline_ms=, else DETECT_DEADLINE_MS); optional stages that would
+    overrun it are skipped and listed in the response's skipped_stages.
+
+    With ?room=<name from /api/get-token> the components and
+    recommendations are also sent to that room's agent session.
+    ?tiled=1 detects large photos tile by tile for small parts (more Gemini calls).
+    ?priority=low|normal|high (or an X-Priority header) steers which Gemini
+    tier model_router picks; the response's model_used says which one ran.
+    """
+    deadline = deadline_from_request(request)
+    room = request.query_params.get("room")
+    tiled = request.query_params.get("tiled", "1" if DETECT_TILED else "0") == "1"
+    priority = model_router.parse_priority(request.query_params.get("priority") or request.headers.get("x-priority"))
+    usage_ledger.set_context("detect-component", usage_ledger.client_id(request))
+    trace = get_tracer().start_trace(name="detect_component")
+    request_start = time.perf_counter()
+    status = "ok"
+    upload = None
     try:
-        # Read image file
-        image_data = await image.read()
-        
-        # Step 1: Gemini Detection with Bounding Boxes
+        # Stream the upload to a spooled file, rejecting oversized/non-image files early
+        span = trace.span(name="upload")
         try:
-            gemini_result = detector.detect_components(image_data)
-        except Exception as e:
-            error_msg = str(e)
-            # Check if it's a quota error
-            if "quota" in error_msg.lower() or "429" in error_msg:
-                return JSONResponse(
-                    status_code=429,
-                    content={
-                        "error": "API Quota Exceeded",
-                        "message": "You've reached the daily limit for Gemini API requests. Please wait or upgrade your API plan.",
-                        "details": "Free tier: 50 requests/day. Consider using gemini-1.5-flash or upgrading.",
-                        "retry_after": "Please try again in a few hours or tomorrow."
-                    }
-                )
-            raise
-        
-        if gemini_result.get("error"):
-            error_detail = gemini_result["error"]
-            if "quota" in error_detail.lower() or "429" in str(error_detail):
-                return JSONResponse(
-                    status_code=429,
-                    content={
-                        "error": "API Quota Exceeded",
-                        "message": "Daily API limit reached. Please try again later.",
-                        "details": error_detail
-                    }
-                )
-            raise HTTPException(status_code=500, detail=error_detail)
-        
-        detections = gemini_result.get("detections", [])
-        annotated_image = gemini_result.get("annotated_image")
-        
-        # Generate description
-        detection_description = detector.generate_description(detections)
-        
-        # Step 2: Detailed Gemini Analysis (optional, skip if quota issue)
-        detailed_analysis = ""
-        if GEMINI_AVAILABLE and gemini_api_key and vision_model:
-            try:
-                import PIL.Image
-                import io
-                pil_image = PIL.Image.open(io.BytesIO(image_data))
-                
-                # Create enhanced prompt with detections
-                detected_components = ", ".join([d['class'] for d in detections]) if detections else "none"
-                
-                prompt = f"""You are a hardware upgrade expert assistant. 
-
-I detected these components: {detected_components}
-
-Now provide detailed information:
-1. Confirm component identifications
-2. Specify exact types/form factors (DDR4/DDR5, M.2 2280, SO-DIMM, etc.)
-3. Any visible model numbers or brand names
-4. Compatibility notes and upgrade recommendations
-5. Condition assessment
-
-Keep response clear and helpful."""
-
-                response = vision_model.generate_content([prompt, pil_image])
-                detailed_analysis = response.text
-            except Exception as e:
-                error_msg = str(e)
-                print(f"Detailed analysis error: {error_msg}")
-                if "quota" in error_msg.lower() or "429" in error_msg:
-                    detailed_analysis = "⚠️ Detailed analysis unavailable due to API quota limits. Basic component detection still works!"
-                else:
-                    detailed_analysis = f"Detailed analysis unavailable: {str(e)}"
-        
-        # Combine detection + detailed analysis
-        combined_analysis = f"🔍 {detection_description}\n\n📋 Detailed Analysis:\n{detailed_analysis}" if detailed_analysis else detection_description
-        
-        # Generate structured instructions for the agent
+            with detect_stage("upload_read"):
+                upload = await receive_image(request)
+            span.update(metadata={"filename": upload.filename, "bytes": upload.size})
+        finally:
+            span.end()
+
+        # Identical uploads (from any worker) are answered from the shared cache
+        key = cache_key(upload.digest, tiled, priority)
+        cached = get_cached(key)
+        if cached is not None:
+            status = "cached"
+            publish_in_background(livekit_client, room, cached)
+            return await render(request, cached, DetectionResponse)
+        claimed, cached = await claim_or_wait(key, timeout=deadline.remaining())
+        if cached is not None:
+            status = "cached"
+            publish_in_background(livekit_client, room, cached)
+            return await render(request, cached, DetectionResponse)
+
         try:
-            structured_data = detector.generate_structured_instructions(detections)
-        except Exception as e:
-            print(f"Structured data generation error: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            structured_data = {
-                "summary": "Error generating structured data",
-                "components": [],
-                "recommendations": []
-            }
-        
-        # Convert annotated image to base64
-        annotated_base64 = ""
-        if annotated_image:
-            annotated_base64 = base64.b64encode(annotated_image).decode('utf-8')
-        
-        return {
-            "analysis": combined_analysis,
-            "detections": detections,
-            "annotated_image": f"data:image/jpeg;base64,{annotated_base64}" if annotated_base64 else None,
-            "total_components": len(detections),
-            "component_detected": len(detections) > 0,
-            "model_used": "gemini-2.0-flash",  # YOLO temporarily disabled
-            "structured_data": structured_data  # NEW: Structured array with recommendations
-        }
-    
+            # Decoded pixels count against the per-process memory budget
+            async with memory_budget.reserve(upload.decoded_bytes, timeout=min(UPLOAD_BUDGET_WAIT, deadline.remaining())):
+                result = await run_detection(upload.image, trace, deadline, tiled=tiled, priority=priority)
+        finally:
+            if claimed:
+                release(key)
+        # Rendering validates the payload, so nothing is cached or published that fails it
+        response = await render(request, result, DetectionResponse)
+        # Degraded answers are not cached; the next upload may get the full result
+        if result["degraded"]:
+            status = "degraded"
+        else:
+            put_cached(key, result)
+        publish_in_background(livekit_client, room, result)
+        return response
+
+    except UploadRejected as e:
+        status = "rejected"
+        UPLOAD_REJECTIONS.inc(reason=e.reason)
+        return JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+    except QuotaExceededError as e:
+        status = "quota"
+        return JSONResponse(status_code=429, content=e.content)
+    except DeadlineExceeded as e:
+        status = "deadline"
+        return JSONResponse(status_code=504, content={"detail": str(e)})
     except Exception as e:
+        status = "error"
+        trace.finish(level="ERROR")
         print(f"API Error: {str(e)}")
         import traceback
         traceback.print_exc()
@@ -205,25 +252,92 @@ Keep response clear and helpful."""
             status_code=500,
             detail=f"Error analyzing image: {str(e)}"
         )
+    finally:
+        if upload is not None:
+            await upload.close()
+        DETECT_REQUEST_SECONDS.observe(time.perf_counter() - request_start, status=status)
+        trace.finish()
+
+@app.post("/api/jobs/detect", status_code=202, response_model=JobSubmitted)
+async def submit_detect_job(request: Request, callback_url: Optional[str] = None):
+    """
+    Queue an image (multipart `image` field, same limits as /api/detect-component)
+    for background detection. Poll the returned status_url, or pass
+    ?callback_url= to have the finished job POSTed there.
+    """
+    if not jobs.JOBS_ENABLED:
+        # No workers in this deployment: a queued job would never run
+        raise HTTPException(status_code=503, detail="Detection jobs are disabled (JOBS_ENABLED=0)")
+    if callback_url:
+        try:
+            await jobs.check_callback_url(callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    upload = None
+    try:
+        upload = await receive_image(request)
+        job_id = await jobs.submit(upload, callback_url)
+    except UploadRejected as e:
+        UPLOAD_REJECTIONS.inc(reason=e.reason)
+        return JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+    finally:
+        if upload is not None:
+            await upload.close()
+    return JSONResponse(status_code=202, content={
+        "id": job_id,
+        "status": jobs.get_job_store().get(job_id)["status"],
+        "status_url": f"/api/jobs/{job_id}",
+    })
+
+@app.get("/api/jobs/{job_id}", response_model=None, responses={200: {"model": JobResponse}})
+async def get_job(job_id: str, request: Request):
+    """Status of a detection job, with its result once done"""
+    job = jobs.get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return await render(request, jobs.public_view(job), JobResponse)
+
+@app.websocket("/ws/detect")
+async def ws_detect(websocket: WebSocket):
+    """Live detection on a stream of camera frames; see live_detect.py for the protocol"""
+    await live_detect.serve(websocket)
+
+@app.get("/api/usage")
+async def usage(day: Optional[str] = Query(None, description="Quota day as YYYY-MM-DD (default: today)")):
+    """Token and cost totals for a quota day, per model, endpoint and client"""
+    try:
+        quota_day = date.fromisoformat(day) if day else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="day must be YYYY-MM-DD")
+    return await asyncio.to_thread(usage_ledger.rollup, quota_day)
+
+@app.get("/api/usage/forecast")
+async def usage_forecast():
+    """When today's token and per-model request budgets run out at the current rate"""
+    return await asyncio.to_thread(usage_ledger.forecast)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of API stage timings and error counters"""
+    return Response(content=REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 @app.get("/api/model-info")
 async def model_info():
-    """Get information about the loaded detection model"""
-    model_info_data = {
-        "yolo_loaded": False,  # YOLO temporarily disabled
-        "gemini_loaded": detector.gemini_model is not None if hasattr(detector, 'gemini_model') else False,
-    }
-    
-    model_name = "Gemini 2.0 Flash (YOLO disabled)"
-    
+    """Which Gemini models detection and analysis use, and the router's current view of them"""
+    api_key_configured = detector.api_key is not None
     return {
         "model_type": "Gemini Vision Detection",
-        "model_name": model_name,
         "yolo_model": "Temporarily disabled (commented out)",
-        "gemini_model": "gemini-2.0-flash" if model_info_data["gemini_loaded"] else "Not loaded",
-        "models_loaded": model_info_data,
-        "api_key_configured": detector.api_key is not None if hasattr(detector, 'api_key') else False,
-        "quota_info": "Gemini 2.0 Flash: 200 requests/day, 15 RPM, 1M tokens/min",
+        "api_key_configured": api_key_configured,
+        "routing_enabled": model_router.MODEL_ROUTING,
+        "tiers": model_router.TIERS,
+        "calls": {
+            call: {
+                "default_model": default,
+                "models": get_router(call).status(),
+            }
+            for call, default in model_router.DEFAULT_MODELS.items()
+        },
         "capabilities": [
             "Text-based component detection (YOLO disabled)",
             "Component description generation",
@@ -233,4 +347,7 @@ async def model_info():
     }
 
 if __name__ == "__main__":
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
+    # API_WORKERS > 1 runs several processes; they share detection results and
+    # Gemini rate limits through shared_state (auto-reload only with one worker)
+    workers = int(os.getenv("API_WORKERS", "1"))
+    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=workers == 1, workers=workers)
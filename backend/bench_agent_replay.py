@@ -0,0 +1,298 @@
+"""
+Offline replay benchmark for the VideoAgent voice/vision pipeline
+Feeds recorded (or synthetic) audio and screen-share frames through
+VideoAgent's stt_node, llm_node and tts_node, read_video_stream and
+current_frames without a LiveKit room. STT, LLM and TTS are scripted
+stand-ins with fixed latencies, so everything above those latencies is
+time spent in our own code: context copying, frame selection, image
+encoding and tracing.
+
+For each concurrency level it reports per-turn overhead percentiles plus
+CPU and RSS per concurrent session, as JSON.
+
+    python bench_agent_replay.py --sessions 1,4,16 --turns 5
+    python bench_agent_replay.py --audio question.wav --frames ./screens --trace
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+import wave
+from pathlib import Path
+from types import SimpleNamespace
+
+from livekit import rtc
+from livekit.agents import ChatContext, ModelSettings, llm, stt
+from livekit.plugins import silero
+
+from metrics import percentiles
+
+SAMPLE_RATE = 48000
+FRAME_MS = 20
+
+
+def load_audio(path=None, seconds=2.0):
+    """20 ms mono AudioFrames from a 16-bit PCM WAV, or silence of the given length"""
+    if path:
+        with wave.open(path, "rb") as wav:
+            rate, channels = wav.getframerate(), wav.getnchannels()
+            pcm = wav.readframes(wav.getnframes())
+    else:
+        rate, channels = SAMPLE_RATE, 1
+        pcm = bytes(int(rate * seconds) * 2)
+    step = rate * FRAME_MS // 1000 * channels * 2
+    return [
+        rtc.AudioFrame(pcm[i:i + step], rate, channels, len(pcm[i:i + step]) // (2 * channels))
+        for i in range(0, len(pcm) - step + 1, step)
+    ]
+
+
+def load_frames(directory=None, size="1280x720", count=4):
+    """RGBA VideoFrames from screenshots in a directory, or synthetic ones"""
+    if directory:
+        from PIL import Image
+
+        frames = []
+        for path in sorted(Path(directory).iterdir()):
+            if path.suffix.lower() not in (".png", ".jpg", ".jpeg"):
+                continue
+            image = Image.open(path).convert("RGBA")
+            frames.append(rtc.VideoFrame(image.width, image.height, rtc.VideoBufferType.RGBA, image.tobytes()))
+        if not frames:
+            raise SystemExit(f"No .png/.jpg frames in {directory}")
+        return frames
+    width, height = (int(v) for v in size.split("x"))
+    return [
+        rtc.VideoFrame(width, height, rtc.VideoBufferType.RGBA, os.urandom(width * height * 4))
+        for _ in range(count)
+    ]
+
+
+class ScriptedSTT(stt.STT):
+    """Placeholder provider object for Agent(stt=...); ScriptedNodes produces the events"""
+
+    def __init__(self):
+        super().__init__(capabilities=stt.STTCapabilities(streaming=True, interim_results=True))
+
+    async def _recognize_impl(self, *args, **kwargs):
+        raise NotImplementedError("replay drives stt_node through ScriptedNodes")
+
+
+class ScriptedLLM(llm.LLM):
+    """Placeholder provider object for Agent(llm=...); ScriptedNodes produces the chunks"""
+
+    def chat(self, *args, **kwargs):
+        raise NotImplementedError("replay drives llm_node through ScriptedNodes")
+
+
+class ScriptedNodes:
+    """
+    Stand-in for Agent.default with scripted provider latencies. Records
+    when each provider call starts and emits, so the harness can separate
+    provider time from the time spent in VideoAgent's wrappers.
+    """
+
+    def __init__(self, stt_latency, llm_ttft, llm_tokens, llm_token_interval, tts_ttfb, tts_frames):
+        self.stt_latency = stt_latency
+        self.llm_ttft = llm_ttft
+        self.llm_tokens = llm_tokens
+        self.llm_token_interval = llm_token_interval
+        self.tts_ttfb = tts_ttfb
+        self.tts_frames = tts_frames
+        self.marks = {}
+
+    async def stt_node(self, agent, audio, model_settings):
+        async for _ in audio:
+            pass
+        await asyncio.sleep(self.stt_latency)
+        self.marks["stt_final"] = time.perf_counter()
+        yield stt.SpeechEvent(
+            type=stt.SpeechEventType.FINAL_TRANSCRIPT,
+            alternatives=[stt.SpeechData(language="en", text="How do I replace the RAM in this laptop?")],
+        )
+
+    async def llm_node(self, agent, chat_ctx, tools, model_settings):
+        self.marks["llm_called"] = time.perf_counter()
+        await asyncio.sleep(self.llm_ttft)
+        for i in range(self.llm_tokens):
+            if i:
+                await asyncio.sleep(self.llm_token_interval)
+            yield llm.ChatChunk(id=f"replay-{i}", delta=llm.ChoiceDelta(role="assistant", content="step "))
+
+    async def tts_node(self, agent, text, model_settings):
+        async for _ in text:
+            pass
+        await asyncio.sleep(self.tts_ttfb)
+        self.marks["tts_first_frame"] = time.perf_counter()
+        silence = bytes(SAMPLE_RATE * FRAME_MS // 1000 * 2)
+        for _ in range(self.tts_frames):
+            yield rtc.AudioFrame(silence, SAMPLE_RATE, 1, len(silence) // 2)
+
+    def scripted_seconds(self):
+        return (self.stt_latency + self.llm_ttft + self.llm_token_interval * max(self.llm_tokens - 1, 0)
+                + self.tts_ttfb)
+
+
+class ReplayVideoStream:
+    """Async iterator of frame events at a fixed rate, shaped like rtc.VideoStream"""
+
+    def __init__(self, frames, fps):
+        self.frames = frames
+        self.interval = 1.0 / fps
+        self._closed = False
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        i = 0
+        while not self._closed:
+            yield SimpleNamespace(frame=self.frames[i % len(self.frames)])
+            i += 1
+            await asyncio.sleep(self.interval)
+
+    async def aclose(self):
+        self._closed = True
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+async def run_session(args, vad, audio, frames, samples):
+    from video_agent import VideoAgent
+
+    nodes = ScriptedNodes(args.stt_latency, args.llm_ttft, args.llm_tokens, args.llm_token_interval,
+                          args.tts_ttfb, args.tts_frames)
+    agent = VideoAgent(
+        instructions="Replay benchmark",
+        room=None,
+        llm=ScriptedLLM(),
+        stt=ScriptedSTT(),
+        vad=vad,
+        prewarmed=True,
+    )
+    agent.upstream_nodes = nodes
+    video_task = asyncio.create_task(agent.read_video_stream(ReplayVideoStream(frames, args.fps)))
+    chat_ctx = ChatContext()
+    settings = ModelSettings()
+    try:
+        for _ in range(args.turns):
+            # The user talks while screen frames keep arriving
+            await asyncio.sleep(args.speech_seconds)
+            turn_start = time.perf_counter()
+            agent.on_user_state_change(SimpleNamespace(old_state="speaking", new_state="listening",
+                                                       created_at=time.time()))
+
+            transcript = ""
+            async for event in agent.stt_node(_aiter(audio), settings):
+                transcript = event.alternatives[0].text
+                stt_overhead = time.perf_counter() - nodes.marks["stt_final"]
+            message = chat_ctx.add_message(role="user", content=transcript)
+            await agent.on_user_turn_completed(chat_ctx, message)
+
+            llm_entered = time.perf_counter()
+            reply = []
+
+            async def text_stream():
+                async for chunk in agent.llm_node(chat_ctx, [], settings):
+                    if chunk.delta and chunk.delta.content:
+                        reply.append(chunk.delta.content)
+                        yield chunk.delta.content
+
+            first_audio = None
+            async for _ in agent.tts_node(text_stream(), settings):
+                if first_audio is None:
+                    first_audio = time.perf_counter()
+            chat_ctx.add_message(role="assistant", content="".join(reply))
+            agent.latency.finish_turn()
+
+            samples.append({
+                "turn_ms": (first_audio - turn_start) * 1000,
+                "overhead_ms": (first_audio - turn_start - nodes.scripted_seconds()) * 1000,
+                "stt_overhead_ms": stt_overhead * 1000,
+                "llm_prep_ms": (nodes.marks["llm_called"] - llm_entered) * 1000,
+                "tts_overhead_ms": (first_audio - nodes.marks["tts_first_frame"]) * 1000,
+            })
+    finally:
+        await agent.close_video_stream()
+        await video_task
+        agent.finish_current_trace()
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_level(args, sessions, vad, audio, frames):
+    samples = []
+    rss_before = rss_mb()
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(args, vad, audio, frames, samples) for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_before
+    keys = ("turn_ms", "overhead_ms", "stt_overhead_ms", "llm_prep_ms", "tts_overhead_ms")
+    return {
+        "sessions": sessions,
+        "turns": len(samples),
+        "elapsed_s": round(elapsed, 3),
+        **{key: {k: round(v, 2) for k, v in percentiles([s[key] for s in samples], (50, 95, 99)).items()}
+           for key in keys},
+        "cpu_s_per_session": round(cpu / sessions, 4),
+        "cpu_percent_per_session": round(100 * cpu / elapsed / sessions, 2),
+        "rss_mb_per_session": round(max(rss_mb() - rss_before, 0.0) / sessions, 2),
+    }
+
+
+async def main_async(args):
+    vad = silero.VAD.load()
+    audio = load_audio(args.audio)
+    frames = load_frames(args.frames, args.frame_size)
+    report = {"config": vars(args), "baseline_rss_mb": round(rss_mb(), 1), "levels": []}
+    for sessions in (int(n) for n in args.sessions.split(",")):
+        report["levels"].append(await run_level(args, sessions, vad, audio, frames))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay audio and frames through VideoAgent with scripted providers")
+    parser.add_argument("--sessions", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--audio", help="16-bit PCM WAV with one user utterance (default: 2 s of silence)")
+    parser.add_argument("--frames", help="directory of screenshots (default: synthetic RGBA frames)")
+    parser.add_argument("--frame-size", default="1280x720", help="synthetic frame size, WxH")
+    parser.add_argument("--fps", type=float, default=5.0, help="screen-share frame rate fed to read_video_stream")
+    parser.add_argument("--speech-seconds", type=float, default=3.0, help="wait between turns")
+    parser.add_argument("--stt-latency", type=float, default=0.2)
+    parser.add_argument("--llm-ttft", type=float, default=0.4)
+    parser.add_argument("--llm-tokens", type=int, default=20)
+    parser.add_argument("--llm-token-interval", type=float, default=0.01)
+    parser.add_argument("--tts-ttfb", type=float, default=0.15)
+    parser.add_argument("--tts-frames", type=int, default=50)
+    parser.add_argument("--trace", action="store_true", help="export traces to a local collector stub")
+    args = parser.parse_args()
+
+    collector = None
+    if args.trace:
+        from stub_servers import TraceCollector
+
+        collector = TraceCollector().start()
+        os.environ["TRACE_EXPORT_URL"] = collector.url
+    try:
+        report = asyncio.run(main_async(args))
+    finally:
+        if collector:
+            collector.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
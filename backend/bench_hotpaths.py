@@ -0,0 +1,201 @@
+"""
+Microbenchmarks for the detection and knowledge hot paths
+Runs offline: Gemini answers come from bench_gemini_responses.json
+(synthetic answers written in the formats the prompts ask for, not captured
+from the API) and pathological inputs are built from them, so no API key or
+network is needed. Covers:
+  - ComponentDetector._parse_detailed_response
+  - _create_visual_annotation plus JPEG encode (render_annotation)
+  - generate_structured_instructions and generate_description
+  - KnowledgeManager loading and format_knowledge
+Median times are compared against the "hotpaths" section of
+bench_thresholds.json. Limits are relative to the machine they were
+recorded on: a fixed pure-Python calibration loop is timed alongside, and on
+a slower machine every limit is scaled by how much slower the loop ran.
+Limits below MIN_LIMIT_MS are raised to it, since timer and scheduling noise
+dominate there.
+
+    python bench_hotpaths.py                   # measure and check, exit 1 on regression
+    python bench_hotpaths.py --filter parse    # only cases whose name contains "parse"
+    python bench_hotpaths.py --record          # store current medians (with headroom) as thresholds
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from component_detector import detector
+from knowledge_manager import KnowledgeManager
+from metrics import percentiles
+
+BACKEND_DIR = Path(__file__).parent
+THRESHOLDS_FILE = BACKEND_DIR / "bench_thresholds.json"
+RESPONSES_FILE = BACKEND_DIR / "bench_gemini_responses.json"
+# --record stores medians times this, so normal run-to-run noise is not a regression
+RECORD_HEADROOM = 2.0
+# No limit is checked tighter than this; sub-millisecond medians are mostly noise
+MIN_LIMIT_MS = 1.0
+
+
+def load_responses():
+    data = json.loads(RESPONSES_FILE.read_text(encoding="utf-8"))
+    # "_provenance" and other underscore keys are notes, not responses
+    responses = {name: text for name, text in data.items() if not name.startswith("_")}
+    laptop = responses["laptop_bottom_panel"]
+    # Pathological inputs: huge component lists, no structure at all, one
+    # enormous line, and a response that is nothing but separators
+    responses["many_components"] = "\n---\n".join([laptop.strip()] * 100)
+    responses["huge_unstructured"] = (responses["unstructured_refusal"] + "\n") * 2000
+    responses["long_line"] = laptop.replace("DETAILS: ", "DETAILS: " + "x" * 200_000, 1)
+    responses["separators_only"] = "---\n" * 20_000
+    return responses
+
+
+def board_image(width, height, noisy=False):
+    """Stand-in photo: a smooth gradient, or incompressible noise for the worst case JPEG encode"""
+    if noisy:
+        gray = Image.effect_noise((width, height), 64)
+    else:
+        gray = Image.linear_gradient("L").resize((width, height))
+    return Image.merge("RGB", (gray, gray.transpose(Image.FLIP_LEFT_RIGHT), gray.transpose(Image.FLIP_TOP_BOTTOM)))
+
+
+def tiled_detections(detections, count, width, height):
+    """count detections with pixel bboxes spread over the image, as tiled detection returns them"""
+    found = []
+    for i in range(count):
+        det = dict(detections[i % len(detections)])
+        x, y = (i * 97) % (width - 200), (i * 53) % (height - 200)
+        det.pop("box", None)
+        det["bbox"] = [x, y, x + 150, y + 120]
+        found.append(det)
+    return found
+
+
+def build_cases(iterations):
+    """name -> (fn, iterations); the slow cases run fewer times"""
+    responses = load_responses()
+    parsed = {name: detector._parse_detailed_response(text) for name, text in responses.items()}
+    heavy = max(iterations // 10, 3)
+    cases = {}
+
+    for name, text in responses.items():
+        cases[f"parse/{name}"] = (lambda text=text: detector._parse_detailed_response(text), iterations)
+
+    images = {
+        "720p": board_image(1280, 720),
+        "12mp": board_image(4032, 3024),
+        "12mp_noise": board_image(4032, 3024, noisy=True),
+    }
+    for image_name, image in images.items():
+        detections = parsed["laptop_bottom_panel"]
+        cases[f"annotate_jpeg/{image_name}"] = (
+            lambda image=image, detections=detections: detector.render_annotation(image, detections), heavy,
+        )
+    boxed = tiled_detections(parsed["tiled_tile"], 40, 4032, 3024)
+    cases["annotate_jpeg/12mp_40_boxes"] = (lambda: detector.render_annotation(images["12mp"], boxed), heavy)
+
+    for name in ("laptop_bottom_panel", "desktop_motherboard_markdown", "many_components"):
+        detections = parsed[name]
+        cases[f"structured/{name}"] = (
+            lambda detections=detections: detector.generate_structured_instructions(detections), iterations,
+        )
+        cases[f"description/{name}"] = (lambda detections=detections: detector.generate_description(detections), iterations)
+
+    knowledge = KnowledgeManager()
+    cases["knowledge/load"] = (KnowledgeManager, heavy)
+    cases["knowledge/format_all"] = (knowledge.format_knowledge, iterations)
+    cases["knowledge/format_step_engine"] = (
+        lambda: knowledge.format_knowledge(exclude=("dashboard", "export")), iterations,
+    )
+    return cases
+
+
+def calibration_workload():
+    """Fixed CPU work independent of the code under test (string building, regex, sorting)"""
+    text = " ".join(f"component-{i} slot {i % 7}" for i in range(2000))
+    return sorted(re.findall(r"component-(\d+)", text), key=int)
+
+
+def timed(fn, iterations):
+    fn()  # warm up (font loading, regex compilation, lazy imports)
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    stats = percentiles(samples, (50, 95))
+    return {"median_ms": round(stats["p50"], 3), "p95_ms": round(stats["p95"], 3), "iterations": iterations}
+
+
+def run(iterations, name_filter=None):
+    results = {}
+    for name, (fn, count) in build_cases(iterations).items():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = timed(fn, count)
+    return results
+
+
+def check(results, thresholds, scale=1.0):
+    """Return a list of human-readable regressions (empty when within budget)"""
+    failures = []
+    for name, limit in thresholds.items():
+        limit = round(max(limit * scale, MIN_LIMIT_MS), 3)
+        result = results.get(name)
+        if result is not None and result["median_ms"] > limit:
+            failures.append(f"{name}: median {result['median_ms']:.3f} ms > {limit} ms")
+    return failures
+
+
+def machine_scale(calibration_ms):
+    """How much slower this machine is than the one the thresholds were recorded on (never below 1)"""
+    if not THRESHOLDS_FILE.exists():
+        return 1.0
+    recorded = json.loads(THRESHOLDS_FILE.read_text()).get("calibration_ms", {}).get("hotpaths")
+    return max(calibration_ms / recorded, 1.0) if recorded else 1.0
+
+
+def load_thresholds(section):
+    if not THRESHOLDS_FILE.exists():
+        return {}
+    return json.loads(THRESHOLDS_FILE.read_text()).get(section, {})
+
+
+def record_thresholds(section, results, calibration_ms):
+    data = json.loads(THRESHOLDS_FILE.read_text()) if THRESHOLDS_FILE.exists() else {}
+    stored = data.setdefault(section, {})
+    for name, result in results.items():
+        stored[name] = round(max(result["median_ms"] * RECORD_HEADROOM, 0.01), 3)
+    data.setdefault("calibration_ms", {})[section] = calibration_ms
+    THRESHOLDS_FILE.write_text(json.dumps(data, indent=2) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--filter", help="only run cases whose name contains this")
+    parser.add_argument("--record", action="store_true", help="write the measured medians to bench_thresholds.json")
+    args = parser.parse_args()
+
+    calibration_ms = timed(calibration_workload, args.iterations)["median_ms"]
+    results = run(args.iterations, args.filter)
+    scale = 1.0
+    if args.record:
+        record_thresholds("hotpaths", results, calibration_ms)
+        failures = []
+    else:
+        scale = machine_scale(calibration_ms)
+        failures = check(results, load_thresholds("hotpaths"), scale)
+    print(json.dumps({
+        "hotpaths": results, "calibration_ms": calibration_ms, "threshold_scale": round(scale, 2), "regressions": failures,
+    }, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
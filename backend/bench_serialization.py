@@ -0,0 +1,109 @@
+"""
+Serialization benchmark for /api/detect-component responses
+Encodes a representative detection payload with FastAPI's default path
+(jsonable_encoder + json.dumps), pydantic's model_dump_json, the orjson path
+used by serialization.render and MessagePack. Each encoding is measured
+uncompressed and with gzip/brotli. Reports median/p95 encode time and bytes
+on the wire as JSON.
+
+    python bench_serialization.py --iterations 200
+    python bench_serialization.py --image annotated.jpg --components 8
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from component_detector import detector
+from metrics import percentiles
+from schemas import DetectionResponse
+import serialization
+
+
+def build_payload(image_bytes, components):
+    names = ["RAM", "SSD", "Battery", "WiFi Card", "Fan", "Heatsink", "CMOS Battery", "Screw"]
+    detections = [
+        {
+            "class": random.choice(names),
+            "type": "DDR4 SO-DIMM 8GB 3200MHz",
+            "position": random.choice(["top-left", "center", "bottom-right"]),
+            "size": "Medium",
+            "details": "Visible label with part number and manufacturer logo",
+            "confidence": 0.9,
+        }
+        for _ in range(components)
+    ]
+    analysis = "🔍 " + detector.generate_description(detections) + "\n\n📋 Detailed Analysis:\n" + (
+        "The module appears to be a standard laptop memory stick seated in the lower slot. " * 25
+    )
+    return {
+        "analysis": analysis,
+        "detections": detections,
+        "annotated_image": "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode(),
+        "total_components": len(detections),
+        "component_detected": True,
+        "model_used": "gemini-2.0-flash",
+        "structured_data": detector.generate_structured_instructions(detections),
+        "skipped_stages": [],
+        "degraded": False,
+    }
+
+
+def encoders():
+    found = {
+        "fastapi_default": lambda p: json.dumps(jsonable_encoder(p)).encode(),
+        "pydantic_dump_json": lambda p: DetectionResponse.model_validate(p).model_dump_json(by_alias=True).encode(),
+        "render_json": lambda p: serialization.dump_json(DetectionResponse.model_validate(p).model_dump(by_alias=True)),
+    }
+    if serialization.msgpack is not None:
+        found["render_msgpack"] = lambda p: serialization.dump_msgpack(
+            DetectionResponse.model_validate(p).model_dump(by_alias=True)
+        )
+    return found
+
+
+def timed(fn, arg, iterations):
+    samples = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = fn(arg)
+        samples.append((time.perf_counter() - start) * 1000)
+    stats = percentiles(samples, (50, 95))
+    return result, {"median_ms": round(stats["p50"], 3), "p95_ms": round(stats["p95"], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detection response serialization")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--image", help="JPEG used as the annotated image (default: 300 KB of random bytes)")
+    parser.add_argument("--components", type=int, default=5)
+    args = parser.parse_args()
+
+    image = open(args.image, "rb").read() if args.image else os.urandom(300 * 1024)
+    payload = build_payload(image, args.components)
+    codings = ["identity", "gzip"] + (["br"] if serialization.brotli is not None else [])
+
+    results = {
+        "orjson_available": serialization.orjson is not None,
+        "msgpack_available": serialization.msgpack is not None,
+        "brotli_available": serialization.brotli is not None,
+        "encoders": {},
+    }
+    for name, encode in encoders().items():
+        body, encode_stats = timed(encode, payload, args.iterations)
+        entry = {"encode": encode_stats, "bytes": {"identity": len(body)}, "compress": {}}
+        for coding in codings[1:]:
+            compressed, stats = timed(lambda b: serialization.compress(b, coding), body, max(args.iterations // 5, 5))
+            entry["bytes"][coding] = len(compressed)
+            entry["compress"][coding] = stats
+        results["encoders"][name] = entry
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Startup-time budget for the API and agent processes
+Measures, in fresh interpreters:
+  - import time of api.py and video_agent.py
+  - RSS after import
+  - time from spawning uvicorn to the first successful HTTP response
+and compares them against bench_thresholds.json ("startup" section).
+
+    python bench_startup.py            # measure and check, exit 1 on regression
+    python bench_startup.py --runs 5   # median of 5 runs per measurement
+"""
+import argparse
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent
+THRESHOLDS_FILE = BACKEND_DIR / "bench_thresholds.json"
+
+IMPORT_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"import_s": elapsed, "rss_mb": rss_kb / 1024}}))
+"""
+
+
+def measure_import(module):
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE.format(module=module)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=120,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "import failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_request(path="/metrics", timeout=60.0):
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(proc.stderr.read().decode(errors="replace").strip().splitlines()[-1])
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError(f"no response within {timeout:.0f}s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def run(runs):
+    results = {}
+    for module in ("api", "video_agent"):
+        try:
+            samples = [measure_import(module) for _ in range(runs)]
+            results[f"{module}_import_s"] = statistics.median(s["import_s"] for s in samples)
+            results[f"{module}_rss_mb"] = statistics.median(s["rss_mb"] for s in samples)
+        except Exception as e:
+            results[f"{module}_error"] = str(e)
+    try:
+        results["api_first_request_s"] = statistics.median(measure_first_request() for _ in range(runs))
+    except Exception as e:
+        results["api_first_request_error"] = str(e)
+    return results
+
+
+def check(results, thresholds):
+    """Return a list of human-readable regressions (empty when within budget)"""
+    failures = []
+    for key, limit in thresholds.items():
+        value = results.get(key)
+        if value is not None and value > limit:
+            failures.append(f"{key}: {value:.3f} > {limit}")
+    return failures
+
+
+def load_thresholds(section):
+    if not THRESHOLDS_FILE.exists():
+        return {}
+    return json.loads(THRESHOLDS_FILE.read_text()).get(section, {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    failures = check(results, load_thresholds("startup"))
+    print(json.dumps({"startup": results, "regressions": failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
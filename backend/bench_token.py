@@ -0,0 +1,54 @@
+"""
+Token endpoint benchmark against a local LiveKit stand-in
+Runs /api/get-token under concurrency twice - with the per-call LiveKitAPI
+client (LIVEKIT_POOLED=0) and with the pooled lifespan client - and prints
+throughput and p50/p95/p99 latency for each as JSON.
+
+    python bench_token.py --concurrency 50 --requests 2000 --upstream-latency 0.02
+"""
+import argparse
+import asyncio
+import json
+
+from loadgen import ApiServer, drive, summarize
+from stub_servers import LiveKitStub
+
+
+async def _get_token(session, base_url, i):
+    async with session.get(f"{base_url}/api/get-token", params={"participant": f"bench-{i}"}) as response:
+        body = await response.read()
+        return response.status, len(body)
+
+
+def run_mode(stub_url, pooled, concurrency, total, extra_env=None):
+    env = {
+        "LIVEKIT_URL": stub_url,
+        "LIVEKIT_API_KEY": "bench-key",
+        "LIVEKIT_API_SECRET": "bench-secret-bench-secret-bench-secret",
+        "LIVEKIT_POOLED": "1" if pooled else "0",
+        **(extra_env or {}),
+    }
+    with ApiServer(env=env) as server:
+        samples, elapsed = asyncio.run(
+            drive(lambda session, i: _get_token(session, server.url, i), concurrency, total)
+        )
+    return summarize(samples, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /api/get-token against a LiveKit stub")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--upstream-latency", type=float, default=0.01, help="seconds per stub RoomService call")
+    args = parser.parse_args()
+
+    with LiveKitStub(latency=args.upstream_latency) as stub:
+        results = {
+            "per_call_client": run_mode(stub.url, False, args.concurrency, args.requests),
+            "pooled_client": run_mode(stub.url, True, args.concurrency, args.requests),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,22 @@
 Component Detection Service using YOLO11n from RepairMate + Gemini Vision AI
 Provides bounding boxes and detailed component identification
 """
+import asyncio
 import os
+import threading
 from pathlib import Path
-import cv2
-import numpy as np
+from typing import Optional
 from PIL import Image, ImageDraw, ImageFont
 import io
 import re
 
+from metrics import detect_stage
+from deadline import Deadline
+from gemini_client import GeminiClient
+from model_router import DEFAULT_MODELS
+import usage_ledger
+import tiling
+
 # Temporarily disable YOLO
 # try:
 #     from ultralytics import YOLO
@@ -19,18 +27,51 @@ import re
 #     print("Warning: ultralytics not installed. Install with: pip install ultralytics")
 YOLO_AVAILABLE = False  # Disabled for now
 
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    print("Warning: google-generativeai not installed. Install with: pip install google-generativeai")
+# google.generativeai (grpc, protobuf) is imported on first use, not at import time,
+# so processes that never run detection start fast.
+genai = None
+GEMINI_AVAILABLE = None
+
+
+def load_genai():
+    """Import google.generativeai once; returns the module or None if not installed"""
+    global genai, GEMINI_AVAILABLE
+    if GEMINI_AVAILABLE is None:
+        try:
+            import google.generativeai as _genai
+            genai = _genai
+            GEMINI_AVAILABLE = True
+        except ImportError:
+            GEMINI_AVAILABLE = False
+            print("Warning: google-generativeai not installed. Install with: pip install google-generativeai")
+    return genai
+
+
+def configure_genai(api_key):
+    """
+    Point google.generativeai at Gemini, or at a stand-in server when
+    GEMINI_API_ENDPOINT is set (e.g. http://127.0.0.1:8100 for load tests).
+    """
+    endpoint = os.environ.get('GEMINI_API_ENDPOINT')
+    if endpoint:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+    else:
+        genai.configure(api_key=api_key)
+
+
+DETECTION_PROMPT = """List all hardware components visible. For each:
+COMPONENT: [name]
+TYPE: [details]
+POSITION: [location]"""
+
 
 class ComponentDetector:
     def __init__(self):
         self.yolo_model = None
-        self.gemini_model = None
-        self.api_key = os.environ.get('GOOGLE_API_KEY')
+        self._gemini_model = None
+        self._gemini_loaded = False
+        self._gemini_client = None
+        self._load_lock = threading.Lock()
         
         # YOLO model loading temporarily disabled
         # if YOLO_AVAILABLE:
@@ -52,28 +93,58 @@ class ComponentDetector:
         #             except Exception as e:
         #                 print(f"❌ Failed to load YOLO model from alt path: {e}")
         
+    @property
+    def api_key(self):
+        # Read on access: the API process loads .env after importing this module
+        return os.environ.get('GOOGLE_API_KEY')
+
+    @property
+    def gemini_model(self):
+        """Gemini model, created on first use"""
+        if not self._gemini_loaded:
+            with self._load_lock:
+                if not self._gemini_loaded:
+                    self._gemini_model = self._load_gemini()
+                    self._gemini_loaded = True
+        return self._gemini_model
+
+    @property
+    def gemini_client(self):
+        """Async client around gemini_model with timeout, retries and hedging"""
+        if self._gemini_client is None and self.gemini_model is not None:
+            self._gemini_client = GeminiClient(self.gemini_model, "detection")
+        return self._gemini_client
+
+    def _load_gemini(self):
         # Load Gemini for detailed analysis
-        if GEMINI_AVAILABLE and self.api_key:
-            genai.configure(api_key=self.api_key)
-            try:
-                self.gemini_model = genai.GenerativeModel('gemini-2.0-flash')
-                print(f"✅ Loaded Gemini 2.0 Flash for detailed analysis")
-            except Exception as e:
-                print(f"⚠️ Failed to load Gemini: {e}")
+        if load_genai() is None or not self.api_key:
+            return None
+        configure_genai(self.api_key)
+        try:
+            model = genai.GenerativeModel(DEFAULT_MODELS["detection"])
+            print(f"✅ Loaded {DEFAULT_MODELS['detection']} for component detection")
+            return model
+        except Exception as e:
+            print(f"⚠️ Failed to load Gemini: {e}")
+            return None
     
-    def detect_components(self, image_data: bytes, conf_threshold: float = 0.25):
+    def detect_components(self, image_data: bytes = None, conf_threshold: float = 0.25, pil_image: Optional[Image.Image] = None):
         """
         Analyze hardware components using Gemini Vision AI (YOLO temporarily disabled)
         
         Args:
             image_data: Image file bytes
             conf_threshold: Confidence threshold (not used in Gemini-only mode)
+            pil_image: Already opened image (e.g. from the upload spool); used instead of image_data
         
         Returns:
             dict with detection results and annotated image
         """
-        # Convert bytes to PIL Image
-        pil_image = Image.open(io.BytesIO(image_data))
+        # Convert bytes to PIL Image (decoded once; later steps reuse it)
+        with detect_stage("decode"):
+            if pil_image is None:
+                pil_image = Image.open(io.BytesIO(image_data))
+            pil_image.load()
         
         # Use Gemini-only detection (YOLO disabled for now)
         print("🔍 Using Gemini-only detection (YOLO disabled)")
@@ -215,31 +286,96 @@ class ComponentDetector:
             }
         
         try:
-            prompt = """List all hardware components visible. For each:
-COMPONENT: [name]
-TYPE: [details]
-POSITION: [location]"""
-            
-            response = self.gemini_model.generate_content([prompt, pil_image])
-            detections = self._parse_detailed_response(response.text)
-            annotated_image = self._create_visual_annotation(pil_image, detections, response.text)
-            
-            img_byte_arr = io.BytesIO()
-            annotated_image.save(img_byte_arr, format='JPEG', quality=95)
-            
+            with detect_stage("gemini_detection"):
+                response = self.gemini_model.generate_content([DETECTION_PROMPT, pil_image])
+            usage_ledger.record_gemini(DEFAULT_MODELS["detection"], response)
+            return self._finish_detection(pil_image, response.text)
+        except Exception as e:
             return {
-                "detections": detections,
-                "annotated_image": img_byte_arr.getvalue(),
-                "model_used": "gemini-2.0-flash",
-                "total_components": len(detections)
+                "error": str(e),
+                "detections": [],
+                "annotated_image": None
+            }
+
+    async def detect_components_async(self, image_data: bytes = None, pil_image: Optional[Image.Image] = None, client=None,
+                                      timeout: float = None, annotate: bool = True, tiled: bool = False,
+                                      deadline: Deadline = None):
+        """
+        Same result as detect_components, without blocking the event loop:
+        the Gemini call goes through an async GeminiClient (timeout, retries,
+        hedging) and decode/annotation run on a worker thread.
+
+        timeout bounds the Gemini call (asyncio.TimeoutError is raised, not
+        returned as an error); annotate=False leaves annotated_image None so
+        the caller can render it later with render_annotation().
+        tiled=True runs large images through tiling.detect_tiled (overlapping
+        tiles detected concurrently, merged with NMS); the result then also
+        has tile_count and merge_ms. The tiles share deadline (one is made
+        from timeout when not given), so later tiles get only the time left.
+        """
+        if pil_image is None:
+            pil_image = Image.open(io.BytesIO(image_data))
+        with detect_stage("decode"):
+            await asyncio.to_thread(pil_image.load)
+
+        client = client or self.gemini_client
+        if client is None:
+            return {
+                "error": "No detection models available",
+                "detections": [],
+                "annotated_image": None
             }
+        try:
+            if tiled and tiling.should_tile(*pil_image.size):
+                if deadline is None and timeout is not None:
+                    deadline = Deadline(timeout)
+                result = await tiling.detect_tiled(self, pil_image, client, deadline=deadline)
+                detections = result["detections"]
+                annotated = await asyncio.to_thread(self.render_annotation, pil_image, detections) if annotate else None
+                return {
+                    "detections": detections,
+                    "annotated_image": annotated,
+                    "model_used": client.model_name or DEFAULT_MODELS["detection"],
+                    "total_components": len(detections),
+                    "tile_count": result["tile_count"],
+                    "merge_ms": result["merge_ms"],
+                }
+            with detect_stage("gemini_detection"):
+                response = await client.generate([DETECTION_PROMPT, pil_image], timeout=timeout)
+            return await asyncio.to_thread(
+                self._finish_detection, pil_image, response.text, annotate, client.model_name or None,
+            )
+        except asyncio.TimeoutError:
+            raise
         except Exception as e:
             return {
                 "error": str(e),
                 "detections": [],
                 "annotated_image": None
             }
+
+    def _finish_detection(self, pil_image, response_text, annotate=True, model_used=None):
+        """Parse Gemini's answer and draw the annotated JPEG"""
+        with detect_stage("parse"):
+            detections = [tiling.to_pixels(d, (0, 0) + pil_image.size) for d in self._parse_detailed_response(response_text)]
+
+        return {
+            "detections": detections,
+            "annotated_image": self.render_annotation(pil_image, detections, response_text) if annotate else None,
+            "model_used": model_used or DEFAULT_MODELS["detection"],
+            "total_components": len(detections)
+        }
     
+    def render_annotation(self, pil_image, detections: list, full_text: str = ""):
+        """Annotated copy of the image as JPEG bytes"""
+        with detect_stage("annotate"):
+            annotated_image = self._create_visual_annotation(pil_image, detections, full_text)
+
+        with detect_stage("jpeg_encode"):
+            img_byte_arr = io.BytesIO()
+            annotated_image.save(img_byte_arr, format='JPEG', quality=95)
+        return img_byte_arr.getvalue()
+
     def _parse_detailed_response(self, response_text: str):
         """Parse Gemini's detailed component descriptions"""
         detections = []
@@ -289,6 +425,13 @@ POSITION: [location]"""
                 else:
                     component_info['details'] = ''
                 
+                # Optional bounding box, [ymin, xmin, ymax, xmax] on a 0-1000 scale
+                box_match = re.search(
+                    r'BOX:\s*\[?\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)', block, re.IGNORECASE,
+                )
+                if box_match:
+                    component_info['box'] = [float(v) for v in box_match.groups()]
+
                 # Assign confidence based on detail level
                 component_info['confidence'] = 0.9 if component_info['details'] else 0.7
                 
@@ -325,6 +468,11 @@ POSITION: [location]"""
             fill=(0, 0, 0, 200)
         )
         
+        # Outline components that came with a bounding box (tiled detection)
+        for det in detections:
+            if det.get('bbox'):
+                draw.rectangle(det['bbox'], outline=self._get_color_for_class(det['class']), width=3)
+
         # Add title
         title = f"🔍 Detected {len(detections)} Component{'s' if len(detections) != 1 else ''}"
         draw.text((15, height - overlay_height + 10), title, fill='white', font=title_font)
@@ -526,5 +674,5 @@ POSITION: [location]"""
         
         return None
 
-# Global detector instance
+# Global detector instance (cheap: the Gemini model is created on first use)
 detector = ComponentDetector()
@@ -0,0 +1,83 @@
+"""
+Per-request deadline budgets for /api/detect-component
+A request gets one deadline (client header/query or config) that every stage
+draws from. Detection is required; the detailed analysis and the annotated
+image are optional and only start when the time left covers their recent
+p95 duration, so a slow Gemini call degrades the answer instead of
+pushing the request past its deadline.
+
+    X-Deadline-Ms: 8000          (request header)
+    ?deadline_ms=8000            (query parameter)
+    DETECT_DEADLINE_MS=25000     (default when the client sends neither)
+"""
+import os
+import time
+from collections import deque
+
+from metrics import REGISTRY, percentiles
+
+DETECT_DEADLINE_MS = int(os.getenv("DETECT_DEADLINE_MS", "25000"))
+DETECT_DEADLINE_MIN_MS = int(os.getenv("DETECT_DEADLINE_MIN_MS", "1000"))
+DETECT_DEADLINE_MAX_MS = int(os.getenv("DETECT_DEADLINE_MAX_MS", "60000"))
+# Kept back from every stage timeout for building and sending the response
+SAFETY_MARGIN = 0.1
+
+# Used until enough samples have been seen to estimate p95 per stage
+STAGE_DEFAULTS = {
+    "analysis": float(os.getenv("DETECT_ANALYSIS_ESTIMATE", "4.0")),
+    "annotation": float(os.getenv("DETECT_ANNOTATION_ESTIMATE", "0.5")),
+}
+MIN_SAMPLES = 10
+
+DETECT_STAGES_SKIPPED = REGISTRY.counter(
+    "detect_stages_skipped_total", "Optional detection stages skipped to meet the request deadline", ("stage",),
+)
+
+
+class DeadlineExceeded(Exception):
+    """A required stage could not finish before the request deadline"""
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left for stage work, after the safety margin"""
+        return max(0.0, self.expires_at - time.monotonic() - SAFETY_MARGIN)
+
+    def allows(self, stage):
+        """True if the time left covers the stage's estimated (p95) duration"""
+        return self.remaining() >= stage_estimates.estimate(stage)
+
+
+def from_request(request):
+    """Deadline from X-Deadline-Ms / ?deadline_ms, clamped to the configured range"""
+    value = request.headers.get("x-deadline-ms") or request.query_params.get("deadline_ms")
+    try:
+        ms = int(value) if value else DETECT_DEADLINE_MS
+    except ValueError:
+        ms = DETECT_DEADLINE_MS
+    ms = min(max(ms, DETECT_DEADLINE_MIN_MS), DETECT_DEADLINE_MAX_MS)
+    return Deadline(ms / 1000)
+
+
+class StageEstimates:
+    """Recent durations per optional stage, for deciding whether it still fits"""
+
+    def __init__(self, defaults, window=200):
+        self.defaults = defaults
+        self._samples = {stage: deque(maxlen=window) for stage in defaults}
+
+    def observe(self, stage, seconds):
+        self._samples[stage].append(seconds)
+
+    def estimate(self, stage):
+        samples = self._samples[stage]
+        if len(samples) < MIN_SAMPLES:
+            return self.defaults[stage]
+        return percentiles(list(samples), (95,))["p95"]
+
+
+stage_estimates = StageEstimates(STAGE_DEFAULTS)
@@ -0,0 +1,396 @@
+"""
+Component detection pipeline shared by the API endpoints
+Runs Gemini detection, the optional detailed analysis, structured data
+generation and annotation encoding for one image, and returns the response
+payload. Results, Gemini rate-limit counters and in-flight markers are kept
+in the shared store so several API worker processes cooperate.
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+
+from component_detector import detector, load_genai, configure_genai
+from gemini_client import GeminiClient
+from deadline import Deadline, DeadlineExceeded, DETECT_DEADLINE_MS, DETECT_STAGES_SKIPPED, stage_estimates
+from metrics import GEMINI_QUOTA_FAILURES, detect_stage, REGISTRY
+from shared_state import get_store, QuotaLimiter
+import model_router
+import tiling
+
+DETECT_CACHE_TTL = int(os.getenv("DETECT_CACHE_TTL", "3600"))
+INFLIGHT_TTL = float(os.getenv("DETECT_INFLIGHT_TTL", "60"))
+# Per-model requests-per-minute shared by all workers and calls (0 disables
+# the limit). GEMINI_RPM_DETECTION / GEMINI_RPM_ANALYSIS override
+# GEMINI_MODEL_RPM for the default detection / analysis model.
+GEMINI_RPM = dict(model_router.MODEL_RPM)
+for _call in ("analysis", "detection"):
+    if os.getenv(f"GEMINI_RPM_{_call.upper()}"):
+        GEMINI_RPM[model_router.DEFAULT_MODELS[_call]] = int(os.getenv(f"GEMINI_RPM_{_call.upper()}"))
+GEMINI_RPM_DETECTION = GEMINI_RPM.get(model_router.DEFAULT_MODELS["detection"], 0)
+GEMINI_RPM_ANALYSIS = GEMINI_RPM.get(model_router.DEFAULT_MODELS["analysis"], 0)
+GEMINI_LIMIT_WAIT = float(os.getenv("GEMINI_LIMIT_WAIT", "10"))
+# Tile large images by default (requests can still pass ?tiled=0/1)
+DETECT_TILED = os.getenv("DETECT_TILED", "0") == "1"
+
+DETECT_CACHE_REQUESTS = REGISTRY.counter(
+    "detect_cache_requests_total", "Detection cache lookups by outcome", ("result",),
+)
+
+ANALYSIS_PROMPT = """You are a hardware upgrade expert assistant.
+
+I detected these components: {detected_components}
+
+Now provide detailed information:
+1. Confirm component identifications
+2. Specify exact types/form factors (DDR4/DDR5, M.2 2280, SO-DIMM, etc.)
+3. Any visible model numbers or brand names
+4. Compatibility notes and upgrade recommendations
+5. Condition assessment
+
+Keep response clear and helpful."""
+
+
+class QuotaExceededError(Exception):
+    """Gemini (or the local limiter) refused the detection call; content is the 429 body"""
+
+    def __init__(self, content):
+        super().__init__(content.get("message", "quota exceeded"))
+        self.content = content
+
+
+def is_quota_error(message):
+    return "quota" in message.lower() or "429" in message
+
+
+# Gemini models by name, created on first use (or in the API startup hook with
+# API_EAGER_LOAD=1) so importing this module stays fast.
+_models = {}
+
+
+def get_model(model_name):
+    """GenerativeModel for model_name; None without google.generativeai or an API key"""
+    if model_name not in _models:
+        genai = load_genai()
+        gemini_api_key = os.environ.get('GOOGLE_API_KEY')
+        if genai is None or not gemini_api_key:
+            return None
+        configure_genai(gemini_api_key)
+        try:
+            _models[model_name] = genai.GenerativeModel(model_name)
+            print(f"✅ Loaded {model_name}")
+        except Exception as e:
+            print(f"⚠️ Gemini model load error ({model_name}): {e}")
+            return None
+    return _models[model_name]
+
+
+def get_vision_model():
+    """Default model for the detailed analysis step"""
+    return get_model(model_router.DEFAULT_MODELS["analysis"])
+
+
+_limiters = {}
+
+
+def get_limiter(name, model=None):
+    """
+    Shared RPM limiter for a model (the call's default model when None).
+    Upstream quotas are per model, so detection and analysis calls routed
+    to the same model share one budget.
+    """
+    model = model or model_router.DEFAULT_MODELS[name]
+    if model not in _limiters:
+        _limiters[model] = QuotaLimiter(get_store(), f"gemini:{model}", GEMINI_RPM.get(model, 0))
+    return _limiters[model]
+
+
+_clients = {}
+
+
+def get_client(name, model=None):
+    """Async GeminiClient for "detection" or "analysis"; hedges count against that model's limiter"""
+    model = model or model_router.DEFAULT_MODELS[name]
+    if (name, model) not in _clients:
+        if name == "detection" and model == model_router.DEFAULT_MODELS[name]:
+            gemini_model = detector.gemini_model
+        else:
+            gemini_model = get_model(model)
+        if gemini_model is None:
+            return None
+        _clients[(name, model)] = GeminiClient(gemini_model, name, limiter=get_limiter(name, model))
+    return _clients[(name, model)]
+
+
+_routers = {}
+
+
+def get_router(name):
+    if name not in _routers:
+        _routers[name] = model_router.ModelRouter(
+            name, lambda model: get_limiter(name, model), lambda model: _clients.get((name, model)),
+        )
+    return _routers[name]
+
+
+def cache_key(digest, tiled=False, priority="normal"):
+    """
+    Cache key for an upload, from the hex sha256 of its bytes. Tiled results
+    and other priorities (which route to other models) are cached apart.
+    """
+    prefix = "detect:tiled:" if tiled else "detect:"
+    if priority != "normal":
+        prefix += f"{priority}:"
+    return prefix + digest
+
+
+def get_cached(key):
+    try:
+        value = get_store().get(key)
+    except Exception as e:
+        print(f"⚠️ Detection cache read failed: {e}")
+        return None
+    DETECT_CACHE_REQUESTS.inc(result="hit" if value is not None else "miss")
+    return json.loads(value) if value is not None else None
+
+
+def put_cached(key, result):
+    try:
+        store = get_store()
+        store.set(key, json.dumps(result), ttl=DETECT_CACHE_TTL)
+        # Expired rows are only dropped on purge; do it on a small share of writes
+        if random.random() < 0.01:
+            store.purge_expired()
+    except Exception as e:
+        print(f"⚠️ Detection cache write failed: {e}")
+
+
+async def claim_or_wait(key, timeout=None):
+    """
+    Mark key as in flight for this worker. If another worker already holds it,
+    wait for its cached result instead of calling Gemini again.
+    Returns (claimed, cached_result).
+    """
+    store = get_store()
+    try:
+        if store.add(f"inflight:{key}", str(os.getpid()), ttl=INFLIGHT_TTL):
+            return True, None
+    except Exception as e:
+        print(f"⚠️ In-flight marker unavailable: {e}")
+        return False, None
+    deadline = time.monotonic() + (timeout if timeout is not None else INFLIGHT_TTL)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.25)
+        cached = get_cached(key)
+        if cached is not None:
+            return False, cached
+        if store.add(f"inflight:{key}", str(os.getpid()), ttl=INFLIGHT_TTL):
+            return True, None
+    return False, None
+
+
+def release(key):
+    try:
+        get_store().delete(f"inflight:{key}")
+    except Exception:
+        pass
+
+
+async def run_detection(pil_image, trace, deadline=None, acquire_quota=True, tiled=False, priority="normal"):
+    """
+    Full detection pipeline for one opened image; raises QuotaExceededError on
+    quota rejections. The image is decoded once and shared by both Gemini calls.
+
+    All stages share one Deadline. Detection is required (DeadlineExceeded if
+    it cannot finish); the detailed analysis and annotated image are skipped
+    when the time left does not cover them, and listed in skipped_stages.
+    Results with skipped stages or a failed analysis are marked degraded and
+    must not be cached.
+    acquire_quota=False is for callers that already took a detection slot
+    from the shared limiter (the job workers pace themselves on it).
+    tiled=True detects large images tile by tile (see tiling.py); every
+    tile counts against the detection limiter.
+    The Gemini model for each call is picked by model_router from quota,
+    latency, image complexity and priority ("low", "normal", "high");
+    callers with acquire_quota=False get the default detection model.
+    """
+    deadline = deadline or Deadline(DETECT_DEADLINE_MS / 1000)
+    skipped_stages = []
+    calls = tiling.call_count(*pil_image.size) if tiled else 1
+    if 0 < GEMINI_RPM_DETECTION < calls:
+        print(f"⚠️ Tiled detection needs {calls} calls, over the {GEMINI_RPM_DETECTION}/min budget; using one call")
+        tiled, calls = False, 1
+
+    with detect_stage("route"):
+        score = await asyncio.to_thread(model_router.complexity, pil_image) if model_router.MODEL_ROUTING else None
+    detection_model, detection_reason = (
+        get_router("detection").route(score, priority) if acquire_quota
+        else (model_router.DEFAULT_MODELS["detection"], "job")
+    )
+
+    # Step 1: Gemini Detection with Bounding Boxes
+    if acquire_quota and not await get_limiter("detection", detection_model).acquire(
+            cost=calls, timeout=min(GEMINI_LIMIT_WAIT, deadline.remaining())):
+        GEMINI_QUOTA_FAILURES.inc(call="detection_local")
+        raise QuotaExceededError({
+            "error": "Rate Limited",
+            "message": "Too many detection requests right now. Please retry in a minute.",
+            "details": f"Local limit: {get_limiter('detection', detection_model).per_minute} {detection_model} detection calls per minute across all workers.",
+        })
+    span = trace.span(name="detection", metadata={
+        "width": pil_image.width, "height": pil_image.height, "model": detection_model, "route": detection_reason,
+    })
+    try:
+        gemini_result = await detector.detect_components_async(
+            pil_image=pil_image, client=get_client("detection", detection_model), timeout=deadline.remaining(),
+            annotate=False, tiled=tiled, deadline=deadline,
+        )
+    except asyncio.TimeoutError:
+        span.update(level="ERROR")
+        raise DeadlineExceeded(f"Component detection did not finish within the {deadline.seconds:.1f}s deadline")
+    except Exception as e:
+        span.update(level="ERROR")
+        error_msg = str(e)
+        # Check if it's a quota error
+        if is_quota_error(error_msg):
+            GEMINI_QUOTA_FAILURES.inc(call="detection")
+            raise QuotaExceededError({
+                "error": "API Quota Exceeded",
+                "message": "You've reached the daily limit for Gemini API requests. Please wait or upgrade your API plan.",
+                "details": f"Upstream quota for {detection_model} is used up. Lower-priority requests fall back to cheaper tiers (GEMINI_MODEL_TIERS).",
+                "retry_after": "Please try again in a few hours or tomorrow."
+            })
+        raise
+    finally:
+        span.end()
+
+    if gemini_result.get("error"):
+        trace.finish(level="ERROR")
+        error_detail = gemini_result["error"]
+        if is_quota_error(str(error_detail)):
+            GEMINI_QUOTA_FAILURES.inc(call="detection")
+            raise QuotaExceededError({
+                "error": "API Quota Exceeded",
+                "message": "Daily API limit reached. Please try again later.",
+                "details": error_detail
+            })
+        raise RuntimeError(error_detail)
+
+    detections = gemini_result.get("detections", [])
+
+    # Generate description
+    detection_description = detector.generate_description(detections)
+
+    # Step 2: Detailed Gemini Analysis (optional, skip if quota issue or out of time)
+    analysis_model, analysis_reason = get_router("analysis").route(score, priority)
+    analysis_used = []
+    # Analysis answered with a warning instead of a result (budget, quota, error)
+    analysis_failed = []
+
+    async def analyse():
+        analysis_client = get_client("analysis", analysis_model)
+        if analysis_client is None:
+            return ""
+        if not deadline.allows("analysis"):
+            skipped_stages.append("detailed_analysis")
+            return ""
+        if not get_limiter("analysis", analysis_model).try_acquire():
+            GEMINI_QUOTA_FAILURES.inc(call="analysis_local")
+            analysis_failed.append(True)
+            return "⚠️ Detailed analysis skipped: the per-minute analysis budget is used up. Basic component detection still works!"
+        span = trace.span(name="detailed_analysis", metadata={"model": analysis_model, "route": analysis_reason})
+        start = time.perf_counter()
+        try:
+            # Create enhanced prompt with detections
+            detected_components = ", ".join([d['class'] for d in detections]) if detections else "none"
+            prompt = ANALYSIS_PROMPT.format(detected_components=detected_components)
+
+            with detect_stage("gemini_analysis"):
+                response = await analysis_client.generate([prompt, pil_image], timeout=deadline.remaining())
+            analysis_used.append(analysis_model)
+            return response.text
+        except asyncio.TimeoutError:
+            span.update(level="WARNING")
+            skipped_stages.append("detailed_analysis")
+            return ""
+        except Exception as e:
+            span.update(level="ERROR")
+            error_msg = str(e)
+            print(f"Detailed analysis error: {error_msg}")
+            analysis_failed.append(True)
+            if is_quota_error(error_msg):
+                GEMINI_QUOTA_FAILURES.inc(call="analysis")
+                return "⚠️ Detailed analysis unavailable due to API quota limits. Basic component detection still works!"
+            return f"Detailed analysis unavailable: {str(e)}"
+        finally:
+            # Timed-out calls are recorded too, so a slow upstream raises the estimate
+            stage_estimates.observe("analysis", time.perf_counter() - start)
+            span.end()
+
+    # Step 3: Annotated image, drawn on a thread while the analysis call is in flight
+    async def annotate():
+        if not deadline.allows("annotation"):
+            skipped_stages.append("annotated_image")
+            return None
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(
+                asyncio.to_thread(detector.render_annotation, pil_image, detections), deadline.remaining(),
+            )
+        except asyncio.TimeoutError:
+            skipped_stages.append("annotated_image")
+            return None
+        finally:
+            stage_estimates.observe("annotation", time.perf_counter() - start)
+
+    detailed_analysis, annotated_image = await asyncio.gather(analyse(), annotate())
+    for stage in skipped_stages:
+        DETECT_STAGES_SKIPPED.inc(stage=stage)
+
+    # Combine detection + detailed analysis
+    combined_analysis = f"🔍 {detection_description}\n\n📋 Detailed Analysis:\n{detailed_analysis}" if detailed_analysis else detection_description
+
+    # Generate structured instructions for the agent
+    try:
+        with detect_stage("structured_data"):
+            structured_data = detector.generate_structured_instructions(detections)
+    except Exception as e:
+        print(f"Structured data generation error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        structured_data = {
+            "summary": "Error generating structured data",
+            "components": [],
+            "recommendations": []
+        }
+
+    # Convert annotated image to base64
+    annotated_base64 = ""
+    if annotated_image:
+        with detect_stage("base64"):
+            annotated_base64 = base64.b64encode(annotated_image).decode('utf-8')
+
+    return {
+        "analysis": combined_analysis,
+        "detections": detections,
+        "annotated_image": f"data:image/jpeg;base64,{annotated_base64}" if annotated_base64 else None,
+        "total_components": len(detections),
+        "component_detected": len(detections) > 0,
+        "model_used": gemini_result.get("model_used", detection_model),  # YOLO temporarily disabled
+        # None when the detailed analysis did not run or failed
+        "analysis_model": analysis_used[0] if analysis_used else None,
+        "routing": {
+            "priority": priority,
+            "complexity": score,
+            "detection": detection_reason,
+            "analysis": analysis_reason,
+        },
+        "structured_data": structured_data,  # NEW: Structured array with recommendations
+        # Optional stages dropped to stay within the request deadline
+        "skipped_stages": skipped_stages,
+        "degraded": bool(skipped_stages or analysis_failed),
+        "tile_count": gemini_result.get("tile_count", 1),
+        "merge_ms": gemini_result.get("merge_ms"),
+    }
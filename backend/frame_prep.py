@@ -0,0 +1,183 @@
+"""
+Frame preparation for the agent's vision context
+llm_node used to attach every selected frame whole at high detail; on a 4K
+screen share that is thousands of image tokens per turn, mostly spent on
+pixels nobody asked about. FramePreparer instead:
+
+- crops the most recent frame to a region of interest, taken from recent
+  detection positions when there are any, otherwise from the area that
+  changed since the previous frame, and sends it at high detail (capped at
+  FRAME_MAX_SIDE)
+- sends the context frames (first/middle) at low detail as thumbnails no
+  larger than CONTEXT_FRAME_SIDE
+- estimates image tokens for what was sent and for the old whole-frame
+  behaviour, so the savings show up in voice_turn_image_tokens
+
+Token estimates follow the providers' published rules (Gemini: 258 tokens
+per 768px tile, or one tile up to 384px; OpenAI: 85 base + 170 per 512px
+tile at high detail, 85 at low). They are estimates, not billing data.
+"""
+import math
+import os
+import time
+
+from livekit import rtc
+from livekit.agents.llm import ImageContent
+from PIL import Image, ImageChops
+
+FRAME_ROI = os.getenv("FRAME_ROI", "1") == "1"
+FRAME_MAX_SIDE = int(os.getenv("FRAME_MAX_SIDE", "1536"))
+CONTEXT_FRAME_SIDE = int(os.getenv("CONTEXT_FRAME_SIDE", "384"))
+ROI_MIN_SIDE = int(os.getenv("ROI_MIN_SIDE", "512"))
+ROI_MAX_FRACTION = float(os.getenv("ROI_MAX_FRACTION", "0.6"))
+ROI_MARGIN = float(os.getenv("ROI_MARGIN", "0.1"))
+ROI_CHANGE_THRESHOLD = int(os.getenv("ROI_CHANGE_THRESHOLD", "24"))
+ROI_DETECTION_TTL = float(os.getenv("ROI_DETECTION_TTL", "30"))
+# Grid the change detection runs on; one cell is 1/64 of the frame width
+CHANGE_GRID = (64, 36)
+
+
+def estimate_image_tokens(width, height, detail="high", provider="google"):
+    if provider == "google":
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def fit(width, height, max_side):
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def grayscale(frame):
+    """Small grayscale image of a frame; I420 frames use the Y plane directly"""
+    if frame.type == rtc.VideoBufferType.I420:
+        image = Image.frombuffer("L", (frame.width, frame.height), bytes(frame.data[:frame.width * frame.height]))
+    else:
+        rgba = frame.convert(rtc.VideoBufferType.RGBA)
+        image = Image.frombuffer("RGBA", (rgba.width, rgba.height), bytes(rgba.data)).convert("L")
+    return image.resize(CHANGE_GRID)
+
+
+def change_region(frame, previous):
+    """Normalized (x0, y0, x1, y1) box around what changed since previous, or None"""
+    if previous is None or (previous.width, previous.height) != (frame.width, frame.height):
+        return None
+    diff = ImageChops.difference(grayscale(frame), grayscale(previous))
+    bbox = diff.point(lambda v: 255 if v > ROI_CHANGE_THRESHOLD else 0).getbbox()
+    if bbox is None:
+        return None
+    cols, rows = CHANGE_GRID
+    return bbox[0] / cols, bbox[1] / rows, bbox[2] / cols, bbox[3] / rows
+
+
+def position_region(position):
+    """Normalized box for a detection position such as "top-left" or "bottom right corner" """
+    position = (position or "").lower()
+    col = 0 if "left" in position else 2 if "right" in position else 1
+    row = 0 if ("top" in position or "upper" in position) else 2 if ("bottom" in position or "lower" in position) else 1
+    # Each position covers its third of the frame plus half a cell around it
+    x0, y0 = max(0.0, col / 3 - 1 / 6), max(0.0, row / 3 - 1 / 6)
+    return x0, y0, min(1.0, (col + 1) / 3 + 1 / 6), min(1.0, (row + 1) / 3 + 1 / 6)
+
+
+def union(boxes):
+    return (
+        min(b[0] for b in boxes), min(b[1] for b in boxes),
+        max(b[2] for b in boxes), max(b[3] for b in boxes),
+    )
+
+
+def crop_box(region, width, height):
+    """Pixel crop for a normalized region with margin and minimum size, or None for the whole frame"""
+    x0, y0, x1, y1 = region
+    x0, y0 = max(0.0, x0 - ROI_MARGIN), max(0.0, y0 - ROI_MARGIN)
+    x1, y1 = min(1.0, x1 + ROI_MARGIN), min(1.0, y1 + ROI_MARGIN)
+    if (x1 - x0) * (y1 - y0) > ROI_MAX_FRACTION:
+        return None
+    left, top, right, bottom = int(x0 * width), int(y0 * height), math.ceil(x1 * width), math.ceil(y1 * height)
+    # Grow small regions around their centre so the model keeps some context
+    for lo, hi, limit in ((0, 2, width), (1, 3, height)):
+        box = [left, top, right, bottom]
+        side = min(ROI_MIN_SIDE, limit)
+        if box[hi] - box[lo] < side:
+            centre = (box[lo] + box[hi]) // 2
+            box[lo] = min(max(0, centre - side // 2), limit - side)
+            box[hi] = box[lo] + side
+        left, top, right, bottom = box
+    return left, top, right, bottom
+
+
+def crop(frame, box):
+    rgba = frame.convert(rtc.VideoBufferType.RGBA) if frame.type != rtc.VideoBufferType.RGBA else frame
+    image = Image.frombuffer("RGBA", (rgba.width, rgba.height), bytes(rgba.data)).crop(box)
+    return rtc.VideoFrame(image.width, image.height, rtc.VideoBufferType.RGBA, image.tobytes())
+
+
+class FramePreparer:
+    """Per-session frame preparation; keeps the last frame sent and recent detection regions"""
+
+    def __init__(self, provider="google"):
+        self.provider = provider
+        self.previous = None
+        self._detection_regions = []
+        self._detections_at = 0.0
+
+    def set_detections(self, detections):
+        """Use the positions of freshly detected components as regions of interest"""
+        self._detection_regions = [position_region(d.get("position")) for d in detections]
+        self._detections_at = time.monotonic()
+
+    def region_of_interest(self, frame, previous):
+        if self._detection_regions and time.monotonic() - self._detections_at < ROI_DETECTION_TTL:
+            return union(self._detection_regions), "detections"
+        region = change_region(frame, previous)
+        return (region, "change") if region is not None else (None, None)
+
+    def prepare(self, frames, previous=None):
+        """
+        ImageContent for (position, frame) pairs as returned by
+        VideoAgent.current_frames (most recent last). previous is the frame
+        captured just before the most recent one; the change region is
+        measured against it, or against the last frame sent if there is none.
+        Returns ([(position, ImageContent)], stats).
+        """
+        stats = {"image_tokens": 0, "baseline_tokens": 0, "roi": None}
+        if not frames:
+            return [], stats
+        latest = frames[-1][1]
+        if previous is None or previous is latest:
+            previous = self.previous
+        self.previous = latest
+
+        prepared = []
+        for position, frame in frames:
+            stats["baseline_tokens"] += estimate_image_tokens(frame.width, frame.height, "high", self.provider)
+            if frame is not latest:
+                width, height = fit(frame.width, frame.height, CONTEXT_FRAME_SIDE)
+                content = ImageContent(
+                    image=frame, inference_detail="low", inference_width=width, inference_height=height,
+                )
+                stats["image_tokens"] += estimate_image_tokens(width, height, "low", self.provider)
+                prepared.append((position, content))
+                continue
+            if FRAME_ROI:
+                region, source = self.region_of_interest(frame, previous)
+                box = crop_box(region, frame.width, frame.height) if region is not None else None
+                if box is not None:
+                    frame = crop(frame, box)
+                    stats["roi"] = {"source": source, "box": list(box)}
+            width, height = fit(frame.width, frame.height, FRAME_MAX_SIDE)
+            content = ImageContent(
+                image=frame, inference_detail="high", inference_width=width, inference_height=height,
+            )
+            stats["image_tokens"] += estimate_image_tokens(width, height, "high", self.provider)
+            prepared.append((position, content))
+        return prepared, stats
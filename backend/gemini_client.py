@@ -0,0 +1,178 @@
+"""
+Async Gemini calls for the detection pipeline
+Wraps a google.generativeai GenerativeModel with a per-call timeout,
+retries with jittered backoff for transient errors, and optional hedging:
+when a call has not answered after the recent p95 latency, a duplicate is
+sent and whichever finishes first wins. Hedges are capped to a share of
+calls, and hedges and retries are charged to the same shared RPM limiter as
+normal calls (a retry the limiter refuses is not sent).
+
+Calls go through generate_content_async, which reuses the process-wide
+gRPC channel google.generativeai keeps per client. With GEMINI_API_ENDPOINT
+(REST transport, e.g. the load-test stand-in) the library has no asyncio
+client, so calls run on the default thread pool over its pooled HTTP session.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+from metrics import REGISTRY, percentiles
+from retries import retry_async, is_transient_error
+import usage_ledger
+
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+GEMINI_ATTEMPTS = int(os.getenv("GEMINI_ATTEMPTS", "3"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "1") == "1"
+GEMINI_HEDGE_QUANTILE = int(os.getenv("GEMINI_HEDGE_QUANTILE", "95"))
+# At most this share of calls may send a duplicate request
+GEMINI_HEDGE_MAX_RATIO = float(os.getenv("GEMINI_HEDGE_MAX_RATIO", "0.1"))
+# Hedging starts once this many latencies have been observed
+HEDGE_MIN_SAMPLES = 20
+
+GEMINI_CALL_SECONDS = REGISTRY.histogram(
+    "gemini_call_seconds", "Latency of individual Gemini requests", ("call",),
+)
+GEMINI_ATTEMPTS_TOTAL = REGISTRY.counter(
+    "gemini_attempts_total", "Gemini requests by outcome (including retries and hedges)", ("call", "outcome"),
+)
+GEMINI_HEDGES = REGISTRY.counter(
+    "gemini_hedges_total", "Hedged Gemini calls: won/lost by the duplicate, or skipped for budget", ("call", "result"),
+)
+
+
+def is_retryable(error):
+    """Transient errors, except quota rejections: retrying those only burns more quota"""
+    if getattr(error, "code", None) == 429 or type(error).__name__ == "ResourceExhausted":
+        return False
+    return is_transient_error(error)
+
+
+class GeminiClient:
+    """
+    Args:
+        model: google.generativeai GenerativeModel
+        call: label for metrics ("detection", "analysis")
+        limiter: optional QuotaLimiter that must admit every hedged or retried request
+    """
+
+    def __init__(self, model, call, limiter=None, timeout=GEMINI_TIMEOUT, attempts=GEMINI_ATTEMPTS,
+                 hedge=GEMINI_HEDGE, hedge_quantile=GEMINI_HEDGE_QUANTILE, hedge_max_ratio=GEMINI_HEDGE_MAX_RATIO):
+        self.model = model
+        # "models/gemini-2.0-flash" -> "gemini-2.0-flash", reported as model_used
+        self.model_name = getattr(model, "model_name", "").rpartition("/")[2]
+        self.call = call
+        self.limiter = limiter
+        self.timeout = timeout
+        self.attempts = attempts
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_max_ratio = hedge_max_ratio
+        self.native_async = not os.getenv("GEMINI_API_ENDPOINT")
+        self._latencies = deque(maxlen=200)
+        self.last_answer = 0.0  # time.monotonic() of the latest successful request
+        self._calls = 0
+        self._hedges = 0
+
+    def latency(self, quantile):
+        """Recent latency at quantile (e.g. 90), or None until enough samples exist"""
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentiles(list(self._latencies), (quantile,))[f"p{quantile}"]
+
+    def hedge_delay(self):
+        """Recent p95 (by default) latency, or None until enough samples exist"""
+        if not self.hedge:
+            return None
+        return self.latency(self.hedge_quantile)
+
+    def _hedge_allowed(self):
+        if self._hedges + 1 > self.hedge_max_ratio * self._calls:
+            return False
+        return self.limiter is None or self.limiter.try_acquire()
+
+    def _should_retry(self, error):
+        # The first attempt was paid for by the caller; every retry takes its own slot
+        return is_retryable(error) and (self.limiter is None or self.limiter.try_acquire())
+
+    def _record_abandoned(self, call):
+        if not call.cancelled() and call.exception() is None:
+            usage_ledger.record_gemini(self.model_name or self.call, call.result())
+
+    async def _request(self, contents, timeout):
+        start = time.perf_counter()
+        try:
+            if self.native_async:
+                response = await self.model.generate_content_async(contents, request_options={"timeout": timeout})
+            else:
+                call = asyncio.ensure_future(asyncio.to_thread(
+                    self.model.generate_content, contents, request_options={"timeout": timeout},
+                ))
+                try:
+                    response = await asyncio.shield(call)
+                except asyncio.CancelledError:
+                    # The thread cannot be stopped and the call is billed when it
+                    # answers (e.g. a losing hedge); record it then
+                    call.add_done_callback(self._record_abandoned)
+                    raise
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            GEMINI_ATTEMPTS_TOTAL.inc(call=self.call, outcome="error")
+            raise
+        elapsed = time.perf_counter() - start
+        self._latencies.append(elapsed)
+        self.last_answer = time.monotonic()
+        usage_ledger.record_gemini(self.model_name or self.call, response)
+        GEMINI_CALL_SECONDS.observe(elapsed, call=self.call)
+        GEMINI_ATTEMPTS_TOTAL.inc(call=self.call, outcome="ok")
+        return response
+
+    async def _hedged(self, contents, timeout):
+        self._calls += 1
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self._request(contents, timeout))
+        if delay is None or delay >= timeout:
+            return await primary
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+            if not self._hedge_allowed():
+                GEMINI_HEDGES.inc(call=self.call, result="skipped")
+                return await primary
+            self._hedges += 1
+            hedge = asyncio.ensure_future(self._request(contents, timeout - delay))
+            tasks.add(hedge)
+            # First successful answer wins; an error only counts once both have failed
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        GEMINI_HEDGES.inc(call=self.call, result="won" if task is hedge else "lost")
+                        return task.result()
+            raise primary.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def generate(self, contents, timeout=None):
+        """
+        generate_content with timeout, retries and hedging.
+        timeout bounds the whole call including retries (defaults to the
+        client timeout); each attempt gets what is left of it.
+        """
+        budget = timeout if timeout is not None else self.timeout
+        deadline = time.monotonic() + budget
+
+        async def attempt():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"Gemini {self.call} call exceeded {budget:.1f}s")
+            return await asyncio.wait_for(self._hedged(contents, remaining), remaining)
+
+        return await retry_async(attempt, attempts=self.attempts, base_delay=0.25, max_delay=4.0,
+                                 retry_on=self._should_retry)
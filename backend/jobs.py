@@ -0,0 +1,447 @@
+"""
+Asynchronous detection jobs
+POST /api/jobs/detect stores the upload and returns a job ID at once; a
+pool of background workers in each API process runs the detection pipeline
+and clients poll GET /api/jobs/{id} or receive the result on a callback URL.
+
+Jobs live in a WAL-mode SQLite file next to the uploaded images, so they
+survive restarts. Workers claim jobs with a lease; a job whose lease runs
+out (its worker crashed or the process restarted) is picked up again.
+Every job takes a slot from the shared Gemini detection limiter before it
+runs, so the pool drains at the rate the upstream quota allows, in step
+with interactive requests. The lease is renewed while the worker waits for
+that slot and while the job runs; a job that gets no slot within
+JOBS_PACE_WAIT goes back to the queue.
+
+    JOBS_DIR=backend/.jobs   JOBS_CONCURRENCY=2   JOBS_ENABLED=1
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+import aiohttp
+from PIL import Image
+
+from deadline import Deadline, DeadlineExceeded
+from detection_pipeline import (
+    run_detection, get_limiter, QuotaExceededError, cache_key, get_cached, put_cached,
+    GEMINI_RPM_DETECTION,
+)
+from metrics import REGISTRY
+from retries import retry_async
+from tracing import get_tracer
+import usage_ledger
+
+logger = logging.getLogger("jobs")
+
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1") == "1"
+JOBS_DIR = Path(os.getenv("JOBS_DIR", str(Path(__file__).parent / ".jobs")))
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "2"))
+JOBS_LEASE = float(os.getenv("JOBS_LEASE", "300"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+JOBS_DEADLINE = float(os.getenv("JOBS_DEADLINE", "120"))
+# Longest a claimed job waits for a detection slot before it is handed back
+JOBS_PACE_WAIT = float(os.getenv("JOBS_PACE_WAIT", "120"))
+JOBS_RETENTION = float(os.getenv("JOBS_RETENTION", str(24 * 3600)))
+JOBS_POLL_INTERVAL = 1.0
+CALLBACK_TIMEOUT = float(os.getenv("JOBS_CALLBACK_TIMEOUT", "10"))
+# Comma-separated hosts callbacks may go to; empty allows any host with a public address
+CALLBACK_HOSTS = {h.strip().lower() for h in os.getenv("JOBS_CALLBACK_HOSTS", "").split(",") if h.strip()}
+
+JOBS_TOTAL = REGISTRY.counter("jobs_total", "Detection jobs by final status", ("status",))
+JOBS_QUEUE_DEPTH = REGISTRY.gauge("jobs_queue_depth", "Detection jobs waiting to run")
+JOB_RUN_SECONDS = REGISTRY.histogram("job_run_seconds", "Time from claiming a job to its result")
+JOB_CALLBACKS = REGISTRY.counter("job_callbacks_total", "Job result callbacks by outcome", ("outcome",))
+
+
+class JobStore:
+    """Job rows in SQLite; one connection per thread, like shared_state.SQLiteStore"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, image_path TEXT, digest TEXT, callback_url TEXT,"
+            " result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, callback_status TEXT,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, not_before REAL NOT NULL DEFAULT 0,"
+            " lease_expires REAL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, image_path, digest, callback_url=None, status="queued", result=None):
+        job_id = uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, status, image_path, digest, callback_url, result, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, status, str(image_path) if image_path else None, digest, callback_url,
+             json.dumps(result) if result is not None else None, now, now),
+        )
+        return job_id
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, lease):
+        """Atomically take the oldest runnable job (or one with an expired lease)"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND not_before <= ?)"
+                " OR (status = 'running' AND lease_expires < ?) ORDER BY created_at LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_expires = ?,"
+                    " updated_at = ? WHERE id = ?",
+                    (now + lease, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        return job
+
+    def finish(self, job_id, status, result=None, error=None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, lease_expires = NULL, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+
+    def renew(self, job_id, lease):
+        """Extend a running job's lease; False if the job is no longer running"""
+        now = time.time()
+        cursor = self._conn().execute(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+            (now + lease, now, job_id),
+        )
+        return cursor.rowcount == 1
+
+    def release(self, job_id):
+        """Hand a claimed job back without counting the attempt"""
+        self._conn().execute(
+            "UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_expires = NULL, updated_at = ?"
+            " WHERE id = ? AND status = 'running'",
+            (time.time(), job_id),
+        )
+
+    def requeue(self, job_id, delay=0.0, error=None):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'queued', not_before = ?, error = ?, lease_expires = NULL, updated_at = ?"
+            " WHERE id = ?",
+            (now + delay, error, now, job_id),
+        )
+
+    def set_callback_status(self, job_id, callback_status):
+        self._conn().execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (callback_status, job_id))
+
+    def queue_depth(self):
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def purge(self, older_than):
+        """Delete finished jobs last updated before older_than (epoch seconds)"""
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (older_than,),
+        )
+
+
+_store = None
+
+
+def get_job_store():
+    global _store
+    if _store is None:
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        _store = JobStore(os.getenv("JOBS_DB") or JOBS_DIR / "jobs.db")
+    return _store
+
+
+def public_view(job):
+    """The fields GET /api/jobs/{id} returns"""
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "result": json.loads(job["result"]) if job["result"] else None,
+        "error": job["error"],
+        "callback_status": job["callback_status"],
+    }
+
+
+async def submit(upload, callback_url=None):
+    """Persist a validated ImageUpload as a job; answered from the cache when possible"""
+    store = get_job_store()
+    cached = get_cached(cache_key(upload.digest))
+    if cached is not None:
+        job_id = store.create(None, upload.digest, callback_url, status="done", result=cached)
+        JOBS_TOTAL.inc(status="done")
+        if callback_url:
+            callback_in_background(store.get(job_id))
+        return job_id
+
+    image_path = JOBS_DIR / f"{uuid4().hex}.img"
+    await upload.upload.seek(0)
+    with open(image_path, "wb") as f:
+        await asyncio.to_thread(shutil.copyfileobj, upload.upload.file, f, 1024 * 1024)
+    job_id = store.create(image_path, upload.digest, callback_url)
+    JOBS_QUEUE_DEPTH.set(store.queue_depth())
+    if pool is not None:
+        pool.wake()
+    return job_id
+
+
+async def check_callback_url(url):
+    """
+    Raise ValueError unless url is an http(s) URL whose host is in
+    JOBS_CALLBACK_HOSTS or, without an allowlist, resolves only to public
+    addresses (no loopback, private, link-local or metadata endpoints).
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if CALLBACK_HOSTS:
+        if host not in CALLBACK_HOSTS:
+            raise ValueError(f"callback host {host} is not in JOBS_CALLBACK_HOSTS")
+        return
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port or 443, type=socket.SOCK_STREAM)
+    except OSError:
+        raise ValueError(f"callback host {host} does not resolve")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global:
+            raise ValueError(f"callback host {host} resolves to a non-public address")
+
+
+_callback_session = None
+_pending_callbacks = set()
+
+
+def callback_in_background(job):
+    task = asyncio.create_task(send_callback(job))
+    # Keep a reference until done so the task is not garbage collected mid-flight
+    _pending_callbacks.add(task)
+    task.add_done_callback(_pending_callbacks.discard)
+
+
+async def send_callback(job):
+    """POST the job view to its callback URL, retrying transient failures"""
+    global _callback_session
+    if _callback_session is None or _callback_session.closed:
+        _callback_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=CALLBACK_TIMEOUT))
+
+    try:
+        # Checked again at send time: DNS may have changed since the job was submitted
+        await check_callback_url(job["callback_url"])
+    except ValueError as e:
+        logger.warning("Job %s callback not sent: %s", job["id"], e)
+        get_job_store().set_callback_status(job["id"], "rejected:unsafe_url")
+        JOB_CALLBACKS.inc(outcome="rejected")
+        return
+
+    async def post():
+        # Redirects are not followed; they could point at an internal address
+        async with _callback_session.post(job["callback_url"], json=public_view(job), allow_redirects=False) as response:
+            if response.status >= 500:
+                response.raise_for_status()
+            return response.status
+
+    try:
+        status = await retry_async(post, attempts=3, base_delay=1.0, max_delay=10.0)
+        outcome = "ok" if status < 400 else "rejected"
+        get_job_store().set_callback_status(job["id"], f"{outcome}:{status}")
+    except Exception as e:
+        outcome = "failed"
+        get_job_store().set_callback_status(job["id"], f"failed:{type(e).__name__}")
+    JOB_CALLBACKS.inc(outcome=outcome)
+
+
+class JobWorkerPool:
+    """
+    Background workers for one API process. Each job waits for a detection
+    slot on the shared limiter, and starts are spaced 60/RPM seconds apart
+    within the process so slots are used evenly rather than in a burst at
+    the start of each minute.
+    """
+
+    def __init__(self, store, concurrency=JOBS_CONCURRENCY, lease=JOBS_LEASE):
+        self.store = store
+        self.concurrency = concurrency
+        self.lease = lease
+        self.spacing = 60.0 / GEMINI_RPM_DETECTION if GEMINI_RPM_DETECTION > 0 else 0.0
+        self._next_start = 0.0
+        self._pace_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _pace(self):
+        """
+        Wait for this process's next start slot, then for the shared limiter;
+        False if no detection slot came up within JOBS_PACE_WAIT
+        """
+        async with self._pace_lock:
+            delay = self._next_start - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_start = time.monotonic() + self.spacing
+        return await get_limiter("detection").acquire(timeout=JOBS_PACE_WAIT)
+
+    async def _keep_lease(self, job_id):
+        """Renew the lease until cancelled, so a slow wait or run is not mistaken for a crash"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not self.store.renew(job_id, self.lease):
+                return
+
+    async def _worker(self):
+        polls = 0
+        while True:
+            job = self.store.claim(self.lease)
+            JOBS_QUEUE_DEPTH.set(self.store.queue_depth())
+            if job is None:
+                polls += 1
+                if polls % 600 == 0:
+                    self.store.purge(time.time() - JOBS_RETENTION)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOBS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run(job)
+            except asyncio.CancelledError:
+                # Shutting down: hand an unfinished job back instead of waiting for its lease
+                current = self.store.get(job["id"])
+                if current is not None and current["status"] == "running":
+                    self.store.requeue(job["id"])
+                raise
+
+    async def run(self, job):
+        renewal = asyncio.create_task(self._keep_lease(job["id"]))
+        try:
+            if not await self._pace():
+                # No slot this time; another worker (or this one) picks it up again
+                self.store.release(job["id"])
+                return
+            await self._detect(job)
+        finally:
+            renewal.cancel()
+
+    async def _detect(self, job):
+        usage_ledger.set_context("jobs")
+        start = time.perf_counter()
+        trace = get_tracer().start_trace(name="detect_job", metadata={"job_id": job["id"]})
+        try:
+            with Image.open(job["image_path"]) as image:
+                result = await run_detection(image, trace, Deadline(JOBS_DEADLINE), acquire_quota=False)
+        except (QuotaExceededError, DeadlineExceeded) as e:
+            trace.finish(level="ERROR")
+            self._retry_or_fail(job, str(e))
+            return
+        except Exception as e:
+            trace.finish(level="ERROR")
+            logger.exception("Job %s failed", job["id"])
+            self._retry_or_fail(job, f"Error analyzing image: {e}")
+            return
+        finally:
+            trace.finish()
+            JOB_RUN_SECONDS.observe(time.perf_counter() - start)
+
+        if not result["degraded"]:
+            put_cached(cache_key(job["digest"]), result)
+        self.store.finish(job["id"], "done", result=result)
+        JOBS_TOTAL.inc(status="done")
+        self._cleanup(job)
+        if job["callback_url"]:
+            callback_in_background(self.store.get(job["id"]))
+
+    def _retry_or_fail(self, job, error):
+        if job["attempts"] < JOBS_MAX_ATTEMPTS:
+            # Back off: 30 s, 60 s, 120 s, ... quota windows reopen every minute
+            self.store.requeue(job["id"], delay=30.0 * 2 ** (job["attempts"] - 1), error=error)
+            return
+        self.store.finish(job["id"], "failed", error=error)
+        JOBS_TOTAL.inc(status="failed")
+        self._cleanup(job)
+        if job["callback_url"]:
+            callback_in_background(self.store.get(job["id"]))
+
+    @staticmethod
+    def _cleanup(job):
+        if job["image_path"]:
+            try:
+                os.unlink(job["image_path"])
+            except OSError:
+                pass
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Give callbacks already under way a chance to finish before the session closes
+        if _pending_callbacks:
+            _, unfinished = await asyncio.wait(set(_pending_callbacks), timeout=CALLBACK_TIMEOUT)
+            for task in unfinished:
+                task.cancel()
+        if _callback_session is not None:
+            await _callback_session.close()
+
+
+pool = None
+
+
+def start_pool():
+    global pool
+    if pool is None:
+        pool = JobWorkerPool(get_job_store())
+        pool.start()
+    return pool
+
+
+async def stop_pool():
+    global pool
+    if pool is not None:
+        await pool.stop()
+        pool = None
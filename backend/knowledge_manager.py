@@ -1,8 +1,11 @@
 """
 Knowledge Manager for Video Agent
 Loads knowledge base files into memory and provides formatting functions.
+The upgrade procedures in dashboard.md are also parsed into an indexed step
+graph keyed by upgrade_category, which ProcedureCursor walks per session.
 """
 import os
+import re
 from pathlib import Path
 
 
@@ -73,7 +76,15 @@ class KnowledgeManager:
         
         # Load all knowledge files into memory
         self.knowledge_content = self._load_all_knowledge()
-        
+
+        # Step graph: step id -> step, and upgrade_category -> {procedure: [step ids]}
+        self.steps = {}
+        self.procedures = {}
+        self.behavior_rules = ""
+        self._parse_procedures(self.knowledge_content.get("dashboard", ""))
+        self.troubleshooting = self._parse_sections(self.knowledge_content.get("export", ""), "## ", "### Issue:")
+        self.safety = self._parse_safety(self.knowledge_content.get("safety", ""))
+
     def _load_all_knowledge(self):
         """Load all knowledge files into memory"""
         content = {}
@@ -89,10 +100,105 @@ class KnowledgeManager:
                 content[domain] = ""
         return content
     
-    def format_knowledge(self):
+    def _parse_procedures(self, text):
+        """
+        Split dashboard.md into steps. "# RAM REPLACEMENT" style headings pick
+        the category, "## Step-by-step: RAM upgrade (Laptop)" starts a
+        procedure, and "N. **Title**" items with Instruction/Verification
+        bullets are its steps.
+        """
+        category = procedure = None
+        step = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                category, procedure, step = categorize(line[2:]), None, None
+            elif line.startswith("## "):
+                step = None
+                heading = line[3:].strip()
+                if heading.lower().startswith("step-by-step:") and category is not None:
+                    procedure = heading.split(":", 1)[1].strip()
+                    self.procedures.setdefault(category, {})[procedure] = []
+                else:
+                    procedure = None
+                    if heading.lower().startswith("agent behavior"):
+                        category = None
+                        step = {"instruction": ""}  # collect the rules below into behavior_rules
+                        self.behavior_rules = heading
+            elif procedure is not None and re.match(r"\d+\.\s+\*\*", line):
+                number, title = re.match(r"(\d+)\.\s+\*\*(.+?)\*\*", line).groups()
+                ids = self.procedures[category][procedure]
+                step = {
+                    "id": f"{category}/{slug(procedure)}/{number}",
+                    "category": category,
+                    "procedure": procedure,
+                    "number": int(number),
+                    "title": title.strip(),
+                    "instruction": "",
+                    "verification": "",
+                    "next": None,
+                }
+                if ids:
+                    self.steps[ids[-1]]["next"] = step["id"]
+                ids.append(step["id"])
+                self.steps[step["id"]] = step
+            elif category is None and step is not None and line.strip():
+                self.behavior_rules += "\n" + line.rstrip()
+            elif step is not None and procedure is not None:
+                item = line.strip().lstrip("- ")
+                for field in ("instruction", "verification"):
+                    if item.lower().startswith(field + ":"):
+                        step[field] = item.split(":", 1)[1].strip().strip('"')
+
+    @staticmethod
+    def _parse_sections(text, category_prefix, section_prefix):
+        """{upgrade_category: [section text]} for "## RAM UPGRADE ..." / "### Issue: ..." style files"""
+        sections = {}
+        category = None
+        current = None
+        for line in text.splitlines():
+            if line.startswith(category_prefix):
+                category, current = categorize(line[len(category_prefix):]), None
+            elif line.startswith(section_prefix) and category is not None:
+                current = [line[len(section_prefix):].strip()]
+                sections.setdefault(category, []).append(current)
+            elif current is not None and line.strip() != "---":
+                current.append(line)
+        return {category: ["\n".join(lines).strip() for lines in items] for category, items in sections.items()}
+
+    @staticmethod
+    def _parse_safety(text):
+        """{upgrade_category: text} from the "### RAM Safety" sections of safety.md"""
+        safety = {}
+        category = None
+        for line in text.splitlines():
+            if line.startswith("### ") and line.rstrip().lower().endswith(" safety"):
+                category = categorize(line[4:])
+                safety[category] = ""
+            elif line.startswith("#"):
+                category = None
+            elif category is not None and line.strip() != "---":
+                safety[category] += line + "\n"
+        return {category: body.strip() for category, body in safety.items() if category != "OTHER_COMPONENT"}
+
+    def procedure_index(self):
+        """Compact list of the available procedures and their step titles for the system prompt"""
+        lines = ["### UPGRADE PROCEDURES (index)",
+                 "The current and next step of the active procedure are provided with each user turn."]
+        for category, procedures in self.procedures.items():
+            for procedure, ids in procedures.items():
+                titles = "; ".join(f"{self.steps[i]['number']}. {self.steps[i]['title']}" for i in ids)
+                lines.append(f"- {category} / {procedure}: {titles}")
+        if self.behavior_rules:
+            lines.append("")
+            lines.append(self.behavior_rules)
+        return "\n".join(lines)
+
+    def format_knowledge(self, exclude=()):
         """
         Format all knowledge for insertion into a prompt.
-        Returns a formatted string with all knowledge content.
+        Returns a formatted string with all knowledge content. Domains in
+        exclude are left out; leaving out "dashboard" puts the procedure
+        index in its place.
         """
         # Map domain names to readable labels
         domain_labels = {
@@ -107,6 +213,10 @@ class KnowledgeManager:
         # Format each knowledge file with its label and content
         knowledge_sections = []
         for domain, content in self.knowledge_content.items():
+            if domain in exclude:
+                if domain == "dashboard" and self.procedures:
+                    knowledge_sections.append(self.procedure_index())
+                continue
             if content.strip():
                 label = domain_labels.get(domain, domain.upper())
                 formatted_section = f"### {label}\n\n{content}"
@@ -115,3 +225,129 @@ class KnowledgeManager:
         # Combine all sections
         all_knowledge = "\n\n---\n\n".join([PROMPT_HEADER, PROMPT_DESCRIPTION] + knowledge_sections)
         return all_knowledge
+
+
+CATEGORY_KEYWORDS = (
+    ("RAM_UPGRADE", ("ram", "memory")),
+    ("BATTERY_REPLACEMENT", ("battery",)),
+    ("SSD_UPGRADE", ("ssd", "storage", "drive", "nvme", "m.2 ssd")),
+    ("WIFI_CARD_REPLACEMENT", ("wifi", "wi-fi", "wireless", "network card")),
+)
+AFFIRMATIVE = {"yes", "yeah", "yep", "done", "ok", "okay", "next", "finished", "ready", "continue", "got", "did"}
+BACK = {"back", "previous", "undo"}
+PROBLEM = {"not", "won't", "wont", "doesn't", "doesnt", "can't", "cant", "stuck", "problem", "error", "broken", "no"}
+SNIPPET_MAX_CHARS = int(os.getenv("KNOWLEDGE_SNIPPET_CHARS", "700"))
+
+
+def categorize(text):
+    """upgrade_category for a heading or user utterance (same names as component_detector)"""
+    lowered = text.lower()
+    for category, keywords in CATEGORY_KEYWORDS:
+        if any(re.search(r"\b" + re.escape(keyword) + r"\b", lowered) for keyword in keywords):
+            return category
+    return "OTHER_COMPONENT"
+
+
+def slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def words(text):
+    return set(re.findall(r"[a-z0-9'.]+", (text or "").lower()))
+
+
+class ProcedureCursor:
+    """
+    Per-session position in the step graph. update() moves it from what the
+    user just said (a procedure is picked from the upgrade category and
+    device words, a confirmation advances one step, "back" goes back one)
+    and returns the context to inject for this turn.
+    """
+
+    def __init__(self, knowledge):
+        self.knowledge = knowledge
+        self.step_id = None
+        self.suggested = None
+
+    def suggest(self, category):
+        """Category to start if the user agrees without naming one (e.g. from component detection)"""
+        if category in self.knowledge.procedures:
+            self.suggested = category
+
+    @property
+    def step(self):
+        return self.knowledge.steps.get(self.step_id)
+
+    def start(self, category, hint=""):
+        """Begin the procedure for category whose name best matches hint (e.g. "laptop m.2")"""
+        procedures = self.knowledge.procedures.get(category)
+        if not procedures:
+            return False
+        hint_words = words(hint)
+        procedure = max(procedures, key=lambda name: len(words(name) & hint_words))
+        self.step_id = procedures[procedure][0]
+        return True
+
+    def _transition(self, text):
+        """(step id, problem reported) after the user says text; does not move the cursor"""
+        said = words(text)
+        category = categorize(text)
+        step = self.step
+        if category != "OTHER_COMPONENT" and (step is None or step["category"] != category):
+            procedures = self.knowledge.procedures.get(category)
+            if procedures:
+                procedure = max(procedures, key=lambda name: len(words(name) & said))
+                return procedures[procedure][0], False
+        if step is None:
+            procedures = self.knowledge.procedures.get(self.suggested)
+            if procedures and said & AFFIRMATIVE:
+                procedure = max(procedures, key=lambda name: len(words(name) & said))
+                return procedures[procedure][0], False
+            return None, False
+        if said & PROBLEM:
+            return step["id"], True
+        if said & BACK and step["number"] > 1:
+            ids = self.knowledge.procedures[step["category"]][step["procedure"]]
+            return ids[step["number"] - 2], False
+        if said & AFFIRMATIVE and step["next"] is not None:
+            return step["next"], False
+        return step["id"], False
+
+    def update(self, text):
+        self.step_id, problem = self._transition(text)
+        return self.format_context(problem, text)
+
+    def preview(self, text):
+        """Context update() would return for text, without moving the cursor"""
+        saved = self.step_id
+        try:
+            return self.update(text)
+        finally:
+            self.step_id = saved
+
+    def format_context(self, problem=False, text=""):
+        step = self.step
+        if step is None:
+            return None
+        ids = self.knowledge.procedures[step["category"]][step["procedure"]]
+        lines = [
+            f"ACTIVE PROCEDURE: {step['category']} / {step['procedure']}, step {step['number']} of {len(ids)}",
+            f"CURRENT STEP {step['number']}: {step['title']}",
+            f"Instruction: {step['instruction']}",
+            f"Verification: {step['verification']}",
+        ]
+        following = self.knowledge.steps.get(step["next"])
+        if following is not None:
+            lines.append(f"NEXT STEP {following['number']} (after the user confirms): {following['title']}")
+        else:
+            lines.append("This is the last step of the procedure.")
+        safety = self.knowledge.safety.get(step["category"])
+        if safety:
+            lines.append(f"SAFETY: {safety[:SNIPPET_MAX_CHARS]}")
+        if problem:
+            issues = self.knowledge.troubleshooting.get(step["category"], [])
+            said = words(text)
+            if issues:
+                best = max(issues, key=lambda issue: len(words(issue) & said))
+                lines.append(f"TROUBLESHOOTING: {best[:SNIPPET_MAX_CHARS * 2]}")
+        return "\n".join(lines)
@@ -0,0 +1,203 @@
+"""
+Continuous component detection over a WebSocket (/ws/detect)
+Clients send camera frames as binary messages (JPEG/PNG/WebP). Only the
+newest frame is kept: frames arriving while a detection is in flight
+replace each other, and a frame that looks like the last detected one
+(compared on a small grayscale thumbnail, cheap to get from JPEG via
+draft mode) is skipped. Detection runs at most LIVE_MAX_RATE times per
+second per connection, without the detailed analysis or annotated image,
+and only the changes to `detections` and `structured_data` are sent back:
+
+    {"type": "diff", "frame": 42,
+     "detections": {"added": {"RAM#1": {...}}, "changed": {}, "removed": ["SSD#1"]},
+     "structured_data": {"summary": "...", "components": [...]}}
+
+structured_data is a top-level merge patch: changed keys carry their new
+value, removed keys are null.
+"""
+import asyncio
+import io
+import logging
+import os
+import time
+
+from fastapi import WebSocket, WebSocketDisconnect
+from PIL import Image, ImageChops, ImageStat
+
+from component_detector import detector
+from detection_pipeline import get_client, get_limiter
+from metrics import REGISTRY
+from uploads import sniff_image_type, memory_budget, UploadRejected, MAX_IMAGE_PIXELS
+import usage_ledger
+
+logger = logging.getLogger("live-detect")
+
+LIVE_MAX_RATE = float(os.getenv("LIVE_MAX_RATE", "0.5"))
+LIVE_CHANGE_THRESHOLD = float(os.getenv("LIVE_CHANGE_THRESHOLD", "6"))
+LIVE_MAX_FRAME_BYTES = int(os.getenv("LIVE_MAX_FRAME_BYTES", str(4 * 1024 * 1024)))
+LIVE_MAX_CONNECTIONS = int(os.getenv("LIVE_MAX_CONNECTIONS", "20"))
+LIVE_DETECT_TIMEOUT = float(os.getenv("LIVE_DETECT_TIMEOUT", "15"))
+THUMBNAIL_SIZE = (32, 32)
+
+LIVE_CONNECTIONS = REGISTRY.gauge("live_detect_connections", "Open /ws/detect connections")
+LIVE_FRAMES = REGISTRY.counter(
+    "live_detect_frames_total",
+    "Frames received on /ws/detect by outcome (detected, dropped, unchanged, rate_limited, rejected, failed)",
+    ("result",),
+)
+
+_connections = 0
+
+
+def thumbnail(data):
+    """Small grayscale version of a frame; JPEG draft mode decodes at 1/8 scale"""
+    image = Image.open(io.BytesIO(data))
+    image.draft("L", (THUMBNAIL_SIZE[0] * 4, THUMBNAIL_SIZE[1] * 4))
+    return image.convert("L").resize(THUMBNAIL_SIZE)
+
+
+def frame_difference(a, b):
+    """Mean absolute pixel difference (0-255) between two thumbnails"""
+    return ImageStat.Stat(ImageChops.difference(a, b)).mean[0]
+
+
+def keyed_detections(detections):
+    """Stable keys for diffing: class name plus occurrence, e.g. RAM#1, RAM#2"""
+    keyed, seen = {}, {}
+    for det in detections:
+        seen[det["class"]] = seen.get(det["class"], 0) + 1
+        keyed[f"{det['class']}#{seen[det['class']]}"] = det
+    return keyed
+
+
+def diff_detections(old, new):
+    return {
+        "added": {k: v for k, v in new.items() if k not in old},
+        "changed": {k: v for k, v in new.items() if k in old and old[k] != v},
+        "removed": [k for k in old if k not in new],
+    }
+
+
+def merge_patch(old, new):
+    patch = {k: v for k, v in new.items() if old.get(k) != v}
+    patch.update({k: None for k in old if k not in new})
+    return patch
+
+
+class LiveSession:
+    """State of one /ws/detect connection"""
+
+    def __init__(self, websocket, max_rate=LIVE_MAX_RATE, change_threshold=LIVE_CHANGE_THRESHOLD):
+        self.websocket = websocket
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.change_threshold = change_threshold
+        self.latest = None  # (frame number, bytes)
+        self.frame_count = 0
+        self.last_thumbnail = None
+        self.last_run = 0.0
+        self.detections = {}
+        self.structured_data = {}
+        self._frame_ready = asyncio.Event()
+
+    async def receive_frames(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            data = message.get("bytes")
+            if data is None:
+                continue  # text messages are reserved for future control commands
+            self.frame_count += 1
+            if len(data) > LIVE_MAX_FRAME_BYTES or sniff_image_type(data[:16]) is None:
+                LIVE_FRAMES.inc(result="rejected")
+                await self.websocket.send_json({"type": "error", "frame": self.frame_count,
+                                                "detail": "Frames must be JPEG/PNG/WebP images under "
+                                                          f"{LIVE_MAX_FRAME_BYTES // (1024 * 1024)} MB"})
+                continue
+            if self.latest is not None:
+                LIVE_FRAMES.inc(result="dropped")
+            self.latest = (self.frame_count, data)
+            self._frame_ready.set()
+
+    async def process_frames(self):
+        while True:
+            await self._frame_ready.wait()
+            wait = self.last_run + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._frame_ready.clear()
+            frame_number, data = self.latest
+            self.latest = None
+            await self.process(frame_number, data)
+
+    async def process(self, frame_number, data):
+        try:
+            # Image.open only reads the header; check the size before anything is decoded
+            image = Image.open(io.BytesIO(data))
+            if image.width * image.height > MAX_IMAGE_PIXELS:
+                LIVE_FRAMES.inc(result="rejected")
+                return
+            thumb = await asyncio.to_thread(thumbnail, data)
+        except Exception:
+            LIVE_FRAMES.inc(result="rejected")
+            return
+        if self.last_thumbnail is not None and frame_difference(thumb, self.last_thumbnail) < self.change_threshold:
+            LIVE_FRAMES.inc(result="unchanged")
+            return
+        if not get_limiter("detection").try_acquire():
+            LIVE_FRAMES.inc(result="rate_limited")
+            return
+        self.last_run = time.monotonic()
+
+        try:
+            async with memory_budget.reserve(image.width * image.height * len(image.getbands())):
+                result = await detector.detect_components_async(
+                    pil_image=image, client=get_client("detection"), timeout=LIVE_DETECT_TIMEOUT, annotate=False,
+                )
+        except (UploadRejected, asyncio.TimeoutError):
+            LIVE_FRAMES.inc(result="failed")
+            return
+        if result.get("error"):
+            LIVE_FRAMES.inc(result="failed")
+            await self.websocket.send_json({"type": "error", "frame": frame_number, "detail": result["error"]})
+            return
+        LIVE_FRAMES.inc(result="detected")
+        self.last_thumbnail = thumb
+
+        detections = keyed_detections(result["detections"])
+        structured_data = detector.generate_structured_instructions(result["detections"])
+        detection_diff = diff_detections(self.detections, detections)
+        structured_patch = merge_patch(self.structured_data, structured_data)
+        self.detections, self.structured_data = detections, structured_data
+        if any(detection_diff.values()) or structured_patch:
+            await self.websocket.send_json({
+                "type": "diff",
+                "frame": frame_number,
+                "detections": detection_diff,
+                "structured_data": structured_patch,
+            })
+
+
+async def serve(websocket: WebSocket):
+    global _connections
+    if _connections >= LIVE_MAX_CONNECTIONS:
+        await websocket.close(code=1013, reason="Too many live detection sessions")
+        return
+    await websocket.accept()
+    _connections += 1
+    LIVE_CONNECTIONS.set(_connections)
+    session = LiveSession(websocket)
+    usage_ledger.set_context("ws-detect", usage_ledger.client_id(websocket))
+    await websocket.send_json({"type": "ready", "max_rate": LIVE_MAX_RATE})
+    tasks = [asyncio.create_task(session.receive_frames()), asyncio.create_task(session.process_frames())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not isinstance(task.exception(), WebSocketDisconnect):
+                logger.warning("Live detection session ended: %r", task.exception())
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        _connections -= 1
+        LIVE_CONNECTIONS.set(_connections)
@@ -0,0 +1,138 @@
+"""
+Shared helpers for the HTTP benchmarks
+Starts the API under uvicorn in a subprocess, drives it with a fixed number
+of concurrent aiohttp clients and summarises latency samples.
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import aiohttp
+
+from metrics import percentiles
+
+BACKEND_DIR = Path(__file__).parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss_mb(pid):
+    """RSS of a process and its direct children (uvicorn workers), in MB; Linux only"""
+    def rss(p):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return 0.0
+
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids.extend(int(p) for p in f.read().split())
+    except OSError:
+        pass
+    return {p: round(rss(p), 1) for p in pids}
+
+
+class ApiServer:
+    """Run `uvicorn api:app` with extra environment variables until stopped"""
+
+    def __init__(self, env=None, workers=1, ready_path="/metrics", timeout=60.0):
+        self.port = free_port()
+        self.env = {**os.environ, **(env or {})}
+        self.workers = workers
+        self.ready_path = ready_path
+        self.timeout = timeout
+        self.proc = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(self.proc.stderr.read().decode(errors="replace"))
+            try:
+                with urllib.request.urlopen(self.url + self.ready_path, timeout=1):
+                    return self
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError(f"API did not become ready within {self.timeout:.0f}s")
+
+    def rss_mb(self):
+        return process_tree_rss_mb(self.proc.pid)
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+async def drive(send, concurrency, total):
+    """
+    Run `total` requests with `concurrency` workers.
+    send(session, i) must return (status, body_bytes). Returns (samples, elapsed).
+    """
+    samples = []
+    counter = iter(range(total))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as session:
+
+        async def worker():
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    status, nbytes = await send(session, i)
+                except Exception as e:
+                    status, nbytes = type(e).__name__, 0
+                samples.append({"latency": time.perf_counter() - start, "status": status, "bytes": nbytes})
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    """Throughput, latency percentiles (ms) and status breakdown for one run"""
+    ok = [s["latency"] for s in samples if s["status"] == 200]
+    statuses = {}
+    for s in samples:
+        statuses[str(s["status"])] = statuses.get(str(s["status"]), 0) + 1
+    return {
+        "requests": len(samples),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {k: round(v * 1000, 2) for k, v in percentiles(ok, (50, 95, 99)).items()},
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+        "statuses": statuses,
+        "mean_response_bytes": round(sum(s["bytes"] for s in samples) / len(samples)) if samples else 0,
+    }
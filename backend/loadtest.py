@@ -0,0 +1,226 @@
+"""
+Load test for the HTTP API against local Gemini and LiveKit stand-ins
+Starts GeminiStub and LiveKitStub, runs the API under uvicorn pointed at
+them, then drives /api/detect-component and /api/get-token at the given
+concurrency. Prints (or writes) one JSON report with throughput, latency
+percentiles, error rates and peak RSS per worker process, and can diff it
+against a report from an earlier build.
+
+    python loadtest.py --concurrency 20 --requests 200 --gemini-latency 1.5
+    python loadtest.py --images ./photos --workers 4 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import aiohttp
+from PIL import Image, ImageDraw
+
+from loadgen import ApiServer, drive, summarize
+from stub_servers import GeminiStub, LiveKitStub
+
+DEFAULT_SIZES = "1280x720,1920x1080,4032x3024"
+
+
+def generate_corpus(sizes, per_size=2, seed=0):
+    """
+    Synthetic JPEGs at phone-camera resolutions. Noise plus a few board-like
+    rectangles keeps the encoded size close to a real photo's.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for size in sizes:
+        width, height = (int(v) for v in size.split("x"))
+        for _ in range(per_size):
+            noise = [Image.effect_noise((width, height), rng.uniform(20, 50)) for _ in range(3)]
+            image = Image.merge("RGB", noise)
+            draw = ImageDraw.Draw(image)
+            for _ in range(6):
+                x, y = rng.randrange(width // 2), rng.randrange(height // 2)
+                color = tuple(rng.randrange(256) for _ in range(3))
+                draw.rectangle([x, y, x + width // 5, y + height // 6], fill=color, outline=(0, 0, 0), width=4)
+            buf = io.BytesIO()
+            image.save(buf, format="JPEG", quality=90)
+            corpus.append(buf.getvalue())
+    return corpus
+
+
+def load_corpus(directory):
+    paths = sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if not paths:
+        raise SystemExit(f"No .jpg/.png images in {directory}")
+    return [p.read_bytes() for p in paths]
+
+
+class RssSampler:
+    """Polls the RSS of the API process tree and keeps the peak per pid"""
+
+    def __init__(self, server, interval=0.5):
+        self.server = server
+        self.interval = interval
+        self.peak = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        for pid, rss in self.server.rss_mb().items():
+            self.peak[pid] = max(self.peak.get(pid, 0.0), rss)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def make_detect(base_url, corpus, unique, deadline_ms=None):
+    headers = {"X-Deadline-Ms": str(deadline_ms)} if deadline_ms else None
+
+    async def send(session, i):
+        image = corpus[i % len(corpus)]
+        if unique:
+            # Bytes after the JPEG end marker are ignored by decoders but change
+            # the cache key, so every request reaches the Gemini stand-in
+            image = image + os.urandom(16)
+        form = aiohttp.FormData()
+        form.add_field("image", image, filename=f"load-{i}.jpg", content_type="image/jpeg")
+        async with session.post(f"{base_url}/api/detect-component", data=form, headers=headers) as response:
+            body = await response.read()
+            return response.status, len(body)
+    return send
+
+
+def make_token(base_url):
+    async def send(session, i):
+        async with session.get(f"{base_url}/api/get-token", params={"participant": f"load-{i}"}) as response:
+            body = await response.read()
+            return response.status, len(body)
+    return send
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Relative change of throughput and latency percentiles per endpoint"""
+    deltas = {}
+    for endpoint, result in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        pairs = {"throughput_rps": (before["throughput_rps"], result["throughput_rps"]),
+                 "error_rate": (before["error_rate"], result["error_rate"])}
+        for key, value in result["latency_ms"].items():
+            pairs[f"latency_{key}_ms"] = (before["latency_ms"].get(key, 0.0), value)
+        deltas[endpoint] = {
+            key: {"before": old, "after": new, "change": round((new - old) / old, 4) if old else None}
+            for key, (old, new) in pairs.items()
+        }
+    return deltas
+
+
+def run(args, corpus):
+    with GeminiStub(latency=args.gemini_latency, error_rate=args.gemini_429_rate) as gemini, \
+            LiveKitStub(latency=args.livekit_latency) as livekit, \
+            tempfile.TemporaryDirectory() as state_dir:
+        env = {
+            "GOOGLE_API_KEY": "loadtest",
+            "GEMINI_API_ENDPOINT": gemini.url,
+            "LIVEKIT_URL": livekit.url,
+            "LIVEKIT_API_KEY": "loadtest-key",
+            "LIVEKIT_API_SECRET": "loadtest-secret-loadtest-secret-loadtest",
+            "SHARED_STATE_URL": f"sqlite:///{state_dir}/state.db",
+            "GEMINI_RPM_DETECTION": str(args.rpm),
+            "GEMINI_RPM_ANALYSIS": str(args.rpm),
+            "API_EAGER_LOAD": "1",
+        }
+        endpoints = {}
+        with ApiServer(env=env, workers=args.workers) as server, RssSampler(server) as rss:
+            idle_rss = server.rss_mb()
+            senders = {
+                "detect": make_detect(server.url, corpus, not args.allow_cache_hits, args.deadline_ms),
+                "token": make_token(server.url),
+            }
+            for name in args.endpoints.split(","):
+                samples, elapsed = asyncio.run(drive(senders[name], args.concurrency, args.requests))
+                endpoints[name] = summarize(samples, elapsed)
+        return {
+            "git_revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                "workers": args.workers,
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "gemini_latency_s": args.gemini_latency,
+                "gemini_429_rate": args.gemini_429_rate,
+                "livekit_latency_s": args.livekit_latency,
+                "deadline_ms": args.deadline_ms,
+                "images": len(corpus),
+                "mean_image_bytes": round(sum(map(len, corpus)) / len(corpus)),
+            },
+            "endpoints": endpoints,
+            "memory_mb": {
+                "idle": {str(pid): mb for pid, mb in idle_rss.items()},
+                "peak": {str(pid): mb for pid, mb in rss.peak.items()},
+            },
+            "upstream_calls": {"gemini": dict(gemini.calls), "livekit": livekit.requests},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API against local Gemini/LiveKit stand-ins")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--endpoints", default="detect,token", help="comma-separated: detect, token")
+    parser.add_argument("--images", help="directory of .jpg/.png images (default: generated corpus)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="generated image sizes, WxH comma-separated")
+    parser.add_argument("--allow-cache-hits", action="store_true", help="resend identical bytes (tests the cache)")
+    parser.add_argument("--gemini-latency", type=float, default=1.0, help="seconds per generateContent call")
+    parser.add_argument("--gemini-429-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--livekit-latency", type=float, default=0.01, help="seconds per RoomService call")
+    parser.add_argument("--deadline-ms", type=int, help="X-Deadline-Ms sent with each detect request")
+    parser.add_argument("--rpm", type=int, default=0, help="GEMINI_RPM_* for the API (0 = no local limit)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to diff against")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images) if args.images else generate_corpus(args.sizes.split(","))
+    report = run(args, corpus)
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+        print(f"✅ Report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Per-request Gemini model selection
+Detection and analysis each have a default model (GEMINI_DETECTION_MODEL,
+GEMINI_ANALYSIS_MODEL). With MODEL_ROUTING=1 every request starts from that
+default in GEMINI_MODEL_TIERS (most capable first) and moves along the list:
+
+- one tier up for priority=high requests on complex images
+- one tier down for priority=low requests or simple images
+- one tier down while the model's shared RPM limiter is more than
+  ROUTER_QUOTA_PRESSURE used in the current minute
+- further down while the model's recent p90 latency is above
+  ROUTER_LATENCY_SLO (re-tried after ROUTER_LATENCY_WINDOW without answers)
+
+Image complexity is a 0-1 score from resolution and edge density, measured
+on a small grayscale copy. Every decision is counted in
+model_router_decisions_total with the model picked and the main reason.
+"""
+import os
+import time
+
+from PIL import Image, ImageFilter
+
+from metrics import REGISTRY
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "1") == "1"
+TIERS = [m.strip() for m in os.getenv(
+    "GEMINI_MODEL_TIERS", "gemini-2.5-flash,gemini-2.0-flash,gemini-2.0-flash-lite",
+).split(",") if m.strip()]
+DEFAULT_MODELS = {
+    "detection": os.getenv("GEMINI_DETECTION_MODEL", "gemini-2.0-flash"),
+    "analysis": os.getenv("GEMINI_ANALYSIS_MODEL", "gemini-2.5-flash"),
+}
+# Requests per minute per model, shared by every call routed to it (the
+# default models can be overridden with GEMINI_RPM_DETECTION /
+# GEMINI_RPM_ANALYSIS); free-tier figures
+MODEL_RPM = {
+    name.strip(): int(rpm)
+    for name, _, rpm in (item.partition("=") for item in os.getenv(
+        "GEMINI_MODEL_RPM", "gemini-2.5-flash=10,gemini-2.0-flash=15,gemini-2.0-flash-lite=30",
+    ).split(",") if "=" in item)
+}
+QUOTA_PRESSURE = float(os.getenv("ROUTER_QUOTA_PRESSURE", "0.7"))
+LATENCY_SLO = float(os.getenv("ROUTER_LATENCY_SLO", "8"))
+# A model skipped for latency gets no traffic, so its samples stop updating;
+# after this many seconds without an answer it is tried again
+LATENCY_WINDOW = float(os.getenv("ROUTER_LATENCY_WINDOW", "60"))
+COMPLEX_THRESHOLD = float(os.getenv("ROUTER_COMPLEX_THRESHOLD", "0.6"))
+SIMPLE_THRESHOLD = float(os.getenv("ROUTER_SIMPLE_THRESHOLD", "0.2"))
+# Resolution at which the resolution part of the score saturates (a 12 MP phone photo)
+COMPLEX_MEGAPIXELS = 12.0
+# Share of strong edge pixels at which the edge part of the score saturates
+COMPLEX_EDGE_DENSITY = 0.3
+EDGE_THRESHOLD = 32
+PRIORITIES = ("low", "normal", "high")
+
+ROUTER_DECISIONS = REGISTRY.counter(
+    "model_router_decisions_total", "Gemini model picked per call and the main reason", ("call", "model", "reason"),
+)
+
+
+def parse_priority(value):
+    value = (value or "normal").strip().lower()
+    return value if value in PRIORITIES else "normal"
+
+
+def complexity(pil_image):
+    """0-1 score: 40% resolution, 60% share of strong edges on a 256px grayscale copy"""
+    width, height = pil_image.size
+    resolution = min(width * height / 1e6 / COMPLEX_MEGAPIXELS, 1.0)
+    scale = min(1.0, 256 / max(width, height))
+    small = pil_image.resize(
+        (max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR, reducing_gap=2.0,
+    ).convert("L")
+    histogram = small.filter(ImageFilter.FIND_EDGES).histogram()
+    density = sum(histogram[EDGE_THRESHOLD:]) / (small.width * small.height)
+    return round(0.4 * resolution + 0.6 * min(density / COMPLEX_EDGE_DENSITY, 1.0), 3)
+
+
+class ModelRouter:
+    """
+    Picks the model for one call ("detection" or "analysis").
+
+    Args:
+        call: the call this router serves
+        limiter_for: model name -> QuotaLimiter for that model
+        client_for: model name -> existing GeminiClient or None (only read for latency)
+    """
+
+    def __init__(self, call, limiter_for, client_for):
+        self.call = call
+        self.default = DEFAULT_MODELS[call]
+        self.tiers = TIERS if self.default in TIERS else [self.default] + TIERS
+        self._limiter_for = limiter_for
+        self._client_for = client_for
+
+    def quota_used(self, model):
+        limiter = self._limiter_for(model)
+        if limiter.per_minute <= 0:
+            return 0.0
+        try:
+            return limiter.used() / limiter.per_minute
+        except Exception:
+            return 0.0
+
+    def slow(self, model):
+        client = self._client_for(model)
+        if client is None or time.monotonic() - client.last_answer > LATENCY_WINDOW:
+            return False
+        latency = client.latency(90)
+        return latency is not None and latency > LATENCY_SLO
+
+    def route(self, score=None, priority="normal"):
+        """(model, reason) for a request with image complexity score and priority"""
+        if not MODEL_ROUTING:
+            return self.default, "fixed"
+        index, reason = self.tiers.index(self.default), "default"
+        if priority == "high" and score is not None and score >= COMPLEX_THRESHOLD:
+            index, reason = index - 1, "complex_image"
+        elif priority == "low":
+            index, reason = index + 1, "low_priority"
+        elif score is not None and score < SIMPLE_THRESHOLD:
+            index, reason = index + 1, "simple_image"
+        last = len(self.tiers) - 1
+        index = min(max(index, 0), last)
+        if index < last and self.quota_used(self.tiers[index]) >= QUOTA_PRESSURE:
+            index, reason = index + 1, "quota"
+        while index < last and self.slow(self.tiers[index]):
+            index, reason = index + 1, "latency"
+        model = self.tiers[index]
+        ROUTER_DECISIONS.inc(call=self.call, model=model, reason=reason)
+        return model, reason
+
+    def status(self):
+        """Per-model quota use and recent latency, for /api/model-info"""
+        status = {}
+        for model in self.tiers:
+            client = self._client_for(model)
+            limiter = self._limiter_for(model)
+            status[model] = {
+                # Models are created on first use; False until this one has been called
+                "loaded": client is not None,
+                "rpm_limit": limiter.per_minute or None,
+                "quota_used": round(self.quota_used(model), 3),
+                "p90_latency_s": round(client.latency(90), 3) if client is not None and client.latency(90) else None,
+            }
+        return status
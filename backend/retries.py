@@ -0,0 +1,43 @@
+"""
+Retry helper for upstream calls (LiveKit, Gemini)
+Exponential backoff with full jitter: the n-th retry sleeps a random time
+in [0, min(max_delay, base_delay * 2**n)], which spreads retries from many
+concurrent requests instead of synchronising them.
+"""
+import asyncio
+import random
+
+
+async def retry_async(call, attempts=3, base_delay=0.1, max_delay=2.0, timeout=None, retry_on=None):
+    """
+    Await call() until it succeeds or attempts are exhausted.
+
+    Args:
+        call: zero-argument function returning a fresh awaitable per attempt
+        attempts: total number of tries (1 disables retrying)
+        timeout: per-attempt timeout in seconds (None for no limit)
+        retry_on: predicate(exception) -> bool deciding whether to retry;
+            defaults to retrying timeouts and connection errors only
+    """
+    should_retry = retry_on or is_transient_error
+    for attempt in range(attempts):
+        try:
+            if timeout is None:
+                return await call()
+            return await asyncio.wait_for(call(), timeout)
+        except Exception as e:
+            if attempt == attempts - 1 or not should_retry(e):
+                raise
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def is_transient_error(error):
+    """Timeouts, dropped connections and 5xx-style upstream errors"""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status", None) or getattr(error, "code", None)
+    if isinstance(status, int) and (status >= 500 or status == 429):
+        return True
+    name = type(error).__name__
+    return name in ("ClientConnectionError", "ClientConnectorError", "ServerDisconnectedError",
+                    "ClientOSError", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError")
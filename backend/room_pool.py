@@ -0,0 +1,132 @@
+"""
+Pre-provisioned LiveKit room pool
+Keeps rooms created ahead of time so /api/get-token can hand one out
+without waiting on a CreateRoom round-trip. The target depth follows the
+recent token request rate, and rooms close to their empty_timeout (after
+which LiveKit closes a room nobody joined) are retired instead of handed out.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+logger = logging.getLogger("room-pool")
+
+ROOM_POOL_DEPTH = REGISTRY.gauge("room_pool_depth", "Pre-created rooms ready to hand out")
+ROOM_POOL_TARGET = REGISTRY.gauge("room_pool_target", "Current refill target for the room pool")
+ROOM_POOL_HIT_RATIO = REGISTRY.gauge("room_pool_hit_ratio", "Fraction of token requests served from the pool")
+ROOM_POOL_REQUESTS = REGISTRY.counter("room_pool_requests_total", "Token requests by pool outcome", ("result",))
+ROOM_POOL_RETIRED = REGISTRY.counter("room_pool_retired_total", "Pooled rooms dropped before expiry")
+
+
+class RoomPool:
+    """
+    Args:
+        create_room: async fn() -> room name, creating one pooled room
+        min_size / max_size: bounds for the refill target
+        lead_time: seconds of demand to keep in stock (target = rate * lead_time)
+        room_ttl: seconds a pooled room stays usable (its empty_timeout)
+        retire_margin: rooms older than room_ttl - retire_margin are dropped
+        rate_window: seconds of request history used to estimate the rate
+    """
+
+    def __init__(self, create_room, min_size=2, max_size=50, lead_time=30.0,
+                 room_ttl=300.0, retire_margin=60.0, rate_window=60.0, refill_concurrency=4):
+        self.create_room = create_room
+        self.min_size = min_size
+        self.max_size = max_size
+        self.lead_time = lead_time
+        self.room_ttl = room_ttl
+        self.retire_margin = retire_margin
+        self.rate_window = rate_window
+        self.refill_concurrency = refill_concurrency
+
+        self._rooms = deque()  # (room name, created at), oldest first
+        self._requests = deque()
+        self._hits = 0
+        self._misses = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def depth(self):
+        return len(self._rooms)
+
+    def request_rate(self):
+        now = time.monotonic()
+        while self._requests and now - self._requests[0] > self.rate_window:
+            self._requests.popleft()
+        return len(self._requests) / self.rate_window
+
+    def target_size(self):
+        target = math.ceil(self.request_rate() * self.lead_time)
+        return max(self.min_size, min(self.max_size, target))
+
+    def _retire_expiring(self):
+        deadline = time.monotonic() - (self.room_ttl - self.retire_margin)
+        while self._rooms and self._rooms[0][1] < deadline:
+            name, _ = self._rooms.popleft()
+            ROOM_POOL_RETIRED.inc()
+            logger.debug("Retired pooled room %s", name)
+
+    def acquire(self):
+        """Return a pre-created room name, or None when the pool is empty"""
+        self._requests.append(time.monotonic())
+        self._retire_expiring()
+        # Hand out the oldest room first so fewer reach their retirement age
+        name = self._rooms.popleft()[0] if self._rooms else None
+        if name is None:
+            self._misses += 1
+            ROOM_POOL_REQUESTS.inc(result="miss")
+        else:
+            self._hits += 1
+            ROOM_POOL_REQUESTS.inc(result="hit")
+        ROOM_POOL_HIT_RATIO.set(self._hits / (self._hits + self._misses))
+        ROOM_POOL_DEPTH.set(len(self._rooms))
+        self._wakeup.set()
+        return name
+
+    async def _create_one(self):
+        try:
+            name = await self.create_room()
+        except Exception as e:
+            logger.warning("Room pool refill failed: %s", e)
+            return False
+        self._rooms.append((name, time.monotonic()))
+        return True
+
+    async def refill(self):
+        self._retire_expiring()
+        target = self.target_size()
+        ROOM_POOL_TARGET.set(target)
+        while len(self._rooms) < target:
+            batch = min(self.refill_concurrency, target - len(self._rooms))
+            results = await asyncio.gather(*(self._create_one() for _ in range(batch)))
+            if not any(results):
+                break
+        ROOM_POOL_DEPTH.set(len(self._rooms))
+
+    async def _run(self, interval):
+        while True:
+            await self.refill()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, interval=5.0):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
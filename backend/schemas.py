@@ -0,0 +1,96 @@
+"""
+Typed response models for the detection API
+They describe the payloads built in detection_pipeline.py for the OpenAPI
+docs and validate them before encoding. Extra keys are kept so new fields
+can be added to the pipeline before they are added here.
+"""
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class Detection(BaseModel):
+    model_config = ConfigDict(populate_by_name=True, extra="allow")
+
+    class_: str = Field(alias="class")
+    type: str = "Unknown"
+    position: str = "Unknown"
+    size: str = "Medium"
+    details: str = ""
+    confidence: float = 0.0
+    # Pixel [x1, y1, x2, y2] when Gemini returned a box (tiled detection asks for one)
+    bbox: Optional[List[int]] = None
+
+
+class ComponentInfo(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    id: int
+    name: str
+    type: str
+    position: str
+    size: str
+    details: str = ""
+    upgrade_category: str
+
+
+class Recommendation(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    component: str
+    action: str
+    message: str
+    next_steps: List[str] = []
+
+
+class StructuredData(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    summary: str
+    components: List[ComponentInfo] = []
+    recommendations: List[Recommendation] = []
+    total_count: int = 0
+
+
+class DetectionResponse(BaseModel):
+    """
+    Body of /api/detect-component. In MessagePack responses annotated_image
+    carries the raw JPEG bytes instead of a base64 data URL.
+    """
+    model_config = ConfigDict(extra="allow")
+
+    analysis: str
+    detections: List[Detection]
+    annotated_image: Optional[str] = None
+    total_components: int
+    component_detected: bool
+    model_used: str
+    structured_data: StructuredData
+    skipped_stages: List[str] = []
+    # Some stage was skipped or failed; such results are not cached
+    degraded: bool = False
+    # Gemini calls made for detection (tiles plus overview in tiled mode) and NMS merge time
+    tile_count: int = 1
+    merge_ms: Optional[float] = None
+    # Gemini model of the detailed analysis (None if it did not run) and why
+    # model_router picked each model
+    analysis_model: Optional[str] = None
+    routing: Optional[Dict[str, Any]] = None
+
+
+class JobSubmitted(BaseModel):
+    id: str
+    status: str
+    status_url: str
+
+
+class JobResponse(BaseModel):
+    """Body of GET /api/jobs/{id}; result is set once status is "done" """
+    id: str
+    status: str
+    attempts: int
+    created_at: float
+    updated_at: float
+    result: Optional[DetectionResponse] = None
+    error: Optional[str] = None
+    callback_status: Optional[str] = None
@@ -0,0 +1,102 @@
+"""
+Response encoding for detection payloads
+JSON is encoded with orjson when installed (stdlib json otherwise).
+Clients sending `Accept: application/msgpack` get MessagePack instead, with
+the annotated image as raw JPEG bytes rather than a base64 data URL (about
+25% smaller and no base64 work on either side). JSON bodies are compressed
+with brotli or gzip according to Accept-Encoding; MessagePack bodies are
+left as is, since most of their bytes are the already-compressed JPEG.
+"""
+import asyncio
+import base64
+import gzip
+import json
+import os
+
+from fastapi.responses import Response
+
+from metrics import detect_stage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+# Bodies larger than this are compressed on a worker thread instead of the event loop
+COMPRESS_OFFLOAD_BYTES = 64 * 1024
+DATA_URL_PREFIX = "data:image/jpeg;base64,"
+
+
+def dump_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def dump_msgpack(payload):
+    image = payload.get("annotated_image")
+    if image and image.startswith(DATA_URL_PREFIX):
+        payload = {**payload, "annotated_image": base64.b64decode(image[len(DATA_URL_PREFIX):])}
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def wants_msgpack(accept):
+    return msgpack is not None and any(media_type in accept for media_type in MSGPACK_TYPES)
+
+
+def choose_encoding(accept_encoding):
+    """Preferred supported content-coding from an Accept-Encoding header, or None"""
+    offered = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        offered.add(coding.strip())
+    if "br" in offered and brotli is not None:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+async def render(request, payload, model=None, status_code=200):
+    """
+    Encode payload for the client: validated against model (a pydantic
+    class) if given, then MessagePack or JSON by Accept, compressed by
+    Accept-Encoding.
+    """
+    with detect_stage("serialize"):
+        if model is not None:
+            payload = model.model_validate(payload).model_dump(by_alias=True)
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        if wants_msgpack(request.headers.get("accept", "")):
+            return Response(dump_msgpack(payload), status_code, headers=headers, media_type="application/msgpack")
+        body = dump_json(payload)
+
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        with detect_stage("compress"):
+            if len(body) >= COMPRESS_OFFLOAD_BYTES:
+                body = await asyncio.to_thread(compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(body, status_code, headers=headers, media_type="application/json")
@@ -0,0 +1,210 @@
+"""
+State shared between API worker processes
+Detection results, rate-limit counters and in-flight markers live in a
+small key/value store that every uvicorn worker on the host opens:
+SQLite in WAL mode by default (no extra service), or Redis when
+SHARED_STATE_URL starts with redis://.
+
+    SHARED_STATE_URL=sqlite:///path/to/state.db   (default: backend/.shared_state.db)
+    SHARED_STATE_URL=redis://localhost:6379/0
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class SQLiteStore:
+    """Key/value store with per-key expiry on a WAL-mode SQLite file"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _expiry(ttl):
+        return time.time() + ttl if ttl else None
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, value, self._expiry(ttl)),
+        )
+
+    def add(self, key, value, ttl=None):
+        """Set key only if it is absent or expired; returns True if this call set it"""
+        cursor = self._conn().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?",
+            (key, value, self._expiry(ttl), time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None, limit=None):
+        """
+        Atomically add to an integer counter; ttl applies when the counter is
+        created. With limit, the counter is left unchanged if it would exceed
+        limit; returns the new value, or None when refused.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                value, expires_at = amount, self._expiry(ttl)
+            else:
+                value, expires_at = int(row[0]) + amount, row[1]
+            if limit is not None and value > limit:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def scan(self, prefix):
+        """All live keys starting with prefix, as a dict"""
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)",
+            (prefix, prefix + "\uffff", time.time()),
+        ).fetchall()
+        return dict(rows)
+
+    def purge_expired(self):
+        self._conn().execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+
+class RedisStore:
+    """Same interface backed by Redis (requires the optional redis package)"""
+
+    # INCRBY unless the result would pass the limit (ARGV[3]); -1 means refused
+    _INCR_WITHIN = """
+    local value = tonumber(redis.call('GET', KEYS[1]) or '0') + tonumber(ARGV[1])
+    if value > tonumber(ARGV[3]) then return -1 end
+    value = redis.call('INCRBY', KEYS[1], ARGV[1])
+    if tonumber(ARGV[2]) > 0 and value == tonumber(ARGV[1]) then redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+    return value
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._incr_within = self._redis.register_script(self._INCR_WITHIN)
+
+    def get(self, key):
+        return self._redis.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self._redis.set(key, value, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+    def incr(self, key, amount=1, ttl=None, limit=None):
+        if limit is not None:
+            value = int(self._incr_within(keys=[key], args=[amount, int(ttl or 0), limit]))
+            return None if value < 0 else value
+        value = int(self._redis.incrby(key, amount))
+        if ttl and value == amount:
+            self._redis.expire(key, int(ttl))
+        return value
+
+    def scan(self, prefix):
+        keys = list(self._redis.scan_iter(match=prefix.replace("*", r"\*") + "*"))
+        values = self._redis.mget(keys) if keys else []
+        return {k.decode(): v for k, v in zip(keys, values) if v is not None}
+
+    def purge_expired(self):
+        pass  # Redis expires keys itself
+
+
+def open_store(url=None):
+    url = url or os.getenv("SHARED_STATE_URL") or f"sqlite:///{Path(__file__).parent / '.shared_state.db'}"
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide store handle, opened on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = open_store()
+    return _store
+
+
+class QuotaLimiter:
+    """
+    Requests-per-minute limit shared by every worker using the same store.
+    Uses fixed one-minute windows, matching how upstream RPM quotas are counted.
+    """
+
+    def __init__(self, store, name, per_minute):
+        self.store = store
+        self.name = name
+        self.per_minute = per_minute
+
+    def try_acquire(self, cost=1):
+        if self.per_minute <= 0:
+            return True
+        window = int(time.time() // 60)
+        # Refused requests leave the counter alone, so they do not use up the window
+        return self.store.incr(f"rate:{self.name}:{window}", cost, ttl=120, limit=self.per_minute) is not None
+
+    async def acquire(self, cost=1, timeout=30.0):
+        """Wait for capacity in the current or a later window; False on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.try_acquire(cost):
+                return True
+            # Sleep until the next window opens (with jitter so workers don't stampede)
+            wait = 60 - time.time() % 60 + random.uniform(0, 0.25)
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    def used(self):
+        window = int(time.time() // 60)
+        value = self.store.get(f"rate:{self.name}:{window}")
+        return int(value) if value is not None else 0
@@ -0,0 +1,243 @@
+"""
+Speculative LLM generation on interim transcripts
+Without it llm_node only starts once the turn detector has decided the user
+is done, so the whole time-to-first-token is added after end of speech.
+With AGENT_SPECULATIVE_LLM=1 the agent starts generating as soon as the
+transcript has been stable for SPECULATIVE_STABLE_MS (or a final transcript
+arrives), buffering the streamed chunks. When llm_node runs for the turn:
+
+- hit:  the final transcript matches the speculated one closely enough
+        (word-level similarity >= SPECULATIVE_MATCH_RATIO), so the buffered
+        and still-streaming chunks are replayed instead of a new request
+- miss: the speculation is cancelled and llm_node generates normally
+
+A speculation whose transcript changes before the turn ends is cancelled and
+restarted, at most SPECULATIVE_MAX_PER_TURN times per turn. Tokens produced
+by discarded runs are counted in speculative_llm_wasted_tokens_total and
+passed to record_usage, since the provider bills them all the same.
+Realtime models never run llm_node, so this only applies to pipeline LLMs.
+"""
+import asyncio
+import difflib
+import logging
+import os
+import re
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger("speculative-llm")
+
+SPECULATIVE_LLM = os.getenv("AGENT_SPECULATIVE_LLM", "0") == "1"
+STABLE_MS = float(os.getenv("SPECULATIVE_STABLE_MS", "300"))
+MATCH_RATIO = float(os.getenv("SPECULATIVE_MATCH_RATIO", "0.9"))
+MIN_WORDS = int(os.getenv("SPECULATIVE_MIN_WORDS", "3"))
+MAX_PER_TURN = int(os.getenv("SPECULATIVE_MAX_PER_TURN", "3"))
+
+SPECULATIONS = REGISTRY.counter(
+    "speculative_llm_total", "Speculative LLM generations by outcome (hit, miss, restarted, cancelled)", ("result",),
+)
+WASTED_TOKENS = REGISTRY.counter(
+    "speculative_llm_wasted_tokens_total", "Completion tokens generated by discarded speculative runs",
+)
+HEAD_START_SECONDS = REGISTRY.histogram(
+    "speculative_llm_head_start_seconds", "How long a used speculation had been running when llm_node started",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0),
+)
+
+
+def normalize(text):
+    return re.findall(r"[\w']+", (text or "").lower())
+
+
+def similarity(a, b):
+    return difflib.SequenceMatcher(None, normalize(a), normalize(b)).ratio()
+
+
+class Speculation:
+    """One LLM stream started ahead of the turn, buffered for later replay"""
+
+    def __init__(self, text, stream, chat_ctx, frames, frame_count, frame_stats=None):
+        self.text = text
+        self.chat_ctx = chat_ctx
+        self.frames = frames
+        self.frame_stats = frame_stats or {"image_tokens": 0, "baseline_tokens": 0, "roi": None}
+        self.frame_count = frame_count  # agent.frames consumed if this speculation is used
+        self.started = time.monotonic()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._chars = 0
+        # Last usage reported by the provider (usually only on the final chunk)
+        self.usage = None
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(stream))
+
+    async def _run(self, stream):
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                if chunk.delta and chunk.delta.content:
+                    self._chars += len(chunk.delta.content)
+                if getattr(chunk, "usage", None) is not None:
+                    self.usage = chunk.usage
+                self._changed.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._changed.set()
+
+    @property
+    def tokens(self):
+        """Completion tokens so far: provider usage if reported, else ~4 chars per token"""
+        if self.usage is not None and getattr(self.usage, "completion_tokens", None):
+            return self.usage.completion_tokens
+        return (self._chars + 3) // 4
+
+    def cancel(self):
+        self._task.cancel()
+
+    async def stream(self):
+        """Replay buffered chunks, then follow the live stream until it ends"""
+        sent = 0
+        try:
+            while True:
+                while sent < len(self.chunks):
+                    yield self.chunks[sent]
+                    sent += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                self._changed.clear()
+                await self._changed.wait()
+        finally:
+            if not self.done:
+                self.cancel()
+
+
+class SpeculativeGenerator:
+    """
+    Follows one session's transcripts and keeps at most one speculation
+    running. start_fn(text) is a coroutine that builds the context and
+    returns a Speculation; record_usage(speculation) is called for every
+    discarded one.
+    """
+
+    def __init__(self, start_fn, record_usage=None):
+        self._start_fn = start_fn
+        self._record_usage = record_usage
+        self._finals = []
+        self._interim = ""
+        self._timer = None
+        self._started_this_turn = 0
+        self._starting = None  # (text, task) while start_fn is building a speculation
+        self.current = None
+        self.hits = 0
+        self.misses = 0
+        self.wasted_tokens = 0
+
+    def transcript(self):
+        return " ".join(self._finals + [self._interim]).strip()
+
+    def on_interim(self, text):
+        self._interim = text
+        self._arm(STABLE_MS / 1000)
+
+    def on_final(self, text):
+        self._finals.append(text)
+        self._interim = ""
+        self._arm(0)
+
+    def _arm(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._maybe_start)
+
+    def _maybe_start(self):
+        self._timer = None
+        text = self.transcript()
+        if len(normalize(text)) < MIN_WORDS:
+            return
+        if self._starting is not None:
+            if normalize(self._starting[0]) == normalize(text):
+                return
+            self._cancel_start()
+        if self.current is not None:
+            if normalize(self.current.text) == normalize(text):
+                return
+            self._discard("restarted")
+        if self._started_this_turn >= MAX_PER_TURN:
+            return
+        self._started_this_turn += 1
+        self._starting = (text, asyncio.create_task(self._start(text)))
+
+    async def _start(self, text):
+        try:
+            self.current = await self._start_fn(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Failed to start speculative generation: {e}")
+        finally:
+            if self._starting is not None and self._starting[1] is asyncio.current_task():
+                self._starting = None
+
+    def _cancel_start(self):
+        """Drop a speculation still being built; its LLM stream has not started yet"""
+        if self._starting is not None:
+            self._starting[1].cancel()
+            self._starting = None
+
+    def _discard(self, result):
+        speculation, self.current = self.current, None
+        speculation.cancel()
+        self.wasted_tokens += speculation.tokens
+        WASTED_TOKENS.inc(speculation.tokens)
+        SPECULATIONS.inc(result=result)
+        if self._record_usage is not None:
+            try:
+                self._record_usage(speculation)
+            except Exception as e:
+                logger.warning(f"Failed to record speculative usage: {e}")
+
+    def _reset_turn(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._cancel_start()
+        self._finals = []
+        self._interim = ""
+        self._started_this_turn = 0
+
+    def take(self, final_text):
+        """The speculation to use for a turn whose user message is final_text, or None"""
+        self._reset_turn()
+        if self.current is None:
+            return None
+        if self.current.error is None and similarity(self.current.text, final_text) >= MATCH_RATIO:
+            speculation, self.current = self.current, None
+            self.hits += 1
+            SPECULATIONS.inc(result="hit")
+            HEAD_START_SECONDS.observe(time.monotonic() - speculation.started)
+            logger.info(f"Speculative generation hit ({len(speculation.chunks)} chunks buffered)")
+            return speculation
+        self.misses += 1
+        logger.info(f"Speculative generation miss: {self.current.text[:50]!r} vs {final_text[:50]!r}")
+        self._discard("miss")
+        return None
+
+    def close(self):
+        self._reset_turn()
+        if self.current is not None:
+            self._discard("cancelled")
+
+    def summary(self):
+        used = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / used, 3) if used else None,
+            "wasted_tokens": self.wasted_tokens,
+        }
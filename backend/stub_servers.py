@@ -0,0 +1,273 @@
+"""
+Local stand-in servers for exercising the backend without real upstreams
+Each stub runs a ThreadingHTTPServer on a background thread so it can be
+started from a benchmark script or run standalone:
+
+    python stub_servers.py collector --port 3100
+    python stub_servers.py livekit --port 7880 --latency 0.05
+    python stub_servers.py gemini --port 8100 --latency 1.5 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from uuid import uuid4
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """Base class: owns the HTTP server thread and a request counter"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def handle(self, handler, body):
+        """Return (status, headers, payload bytes) for a POST request"""
+        raise NotImplementedError
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with stub._lock:
+                    stub.requests += 1
+                status, headers, payload = stub.handle(self, body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class TraceCollector(StubServer):
+    """
+    Stand-in for the Langfuse ingestion endpoint (POST {"batch": [...]}).
+    Set latency to emulate a slow backend, error_rate for flaky responses and
+    fail=True to emulate an outage.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, fail=False):
+        super().__init__(host, port)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fail = fail
+        self.events = []
+
+    def handle(self, handler, body):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail or (self.error_rate and random.random() < self.error_rate):
+            return 503, {"Content-Type": "application/json"}, b'{"error": "unavailable"}'
+        batch = json.loads(body or b"{}").get("batch", [])
+        with self._lock:
+            self.events.extend(batch)
+        return 207, {"Content-Type": "application/json"}, json.dumps({"successes": [], "errors": []}).encode()
+
+    def traces(self):
+        with self._lock:
+            return [e["body"] for e in self.events if e.get("type") == "trace-create"]
+
+
+class LiveKitStub(StubServer):
+    """
+    Stand-in for the LiveKit RoomService Twirp API used by the backend
+    (CreateRoom, DeleteRoom, ListRooms, SendData). Speaks protobuf like the
+    real server, so it needs livekit-protocol (installed with livekit-api).
+    """
+
+    PROTOBUF = {"Content-Type": "application/protobuf"}
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0):
+        super().__init__(host, port)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rooms = {}
+        self.data_messages = []
+
+    def _error(self, status, code, msg):
+        return status, {"Content-Type": "application/json"}, json.dumps({"code": code, "msg": msg}).encode()
+
+    def handle(self, handler, body):
+        from livekit.protocol import room as proto_room
+
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return self._error(503, "unavailable", "stub injected failure")
+
+        method = handler.path.rstrip("/").rsplit("/", 1)[-1]
+        if method == "CreateRoom":
+            request = proto_room.CreateRoomRequest.FromString(body)
+            with self._lock:
+                room = self.rooms.get(request.name)
+                if room is None:
+                    room = self.rooms[request.name] = proto_room.Room(
+                        sid=f"RM_{uuid4().hex[:12]}",
+                        name=request.name,
+                        empty_timeout=request.empty_timeout,
+                        departure_timeout=request.departure_timeout,
+                        creation_time=int(time.time()),
+                    )
+            return 200, self.PROTOBUF, room.SerializeToString()
+        if method == "DeleteRoom":
+            request = proto_room.DeleteRoomRequest.FromString(body)
+            with self._lock:
+                self.rooms.pop(request.room, None)
+            return 200, self.PROTOBUF, proto_room.DeleteRoomResponse().SerializeToString()
+        if method == "ListRooms":
+            with self._lock:
+                rooms = list(self.rooms.values())
+            return 200, self.PROTOBUF, proto_room.ListRoomsResponse(rooms=rooms).SerializeToString()
+        if method == "SendData":
+            request = proto_room.SendDataRequest.FromString(body)
+            with self._lock:
+                self.data_messages.append(request)
+            return 200, self.PROTOBUF, proto_room.SendDataResponse().SerializeToString()
+        return self._error(404, "bad_route", f"unknown method {method}")
+
+
+class GeminiStub(StubServer):
+    """
+    Stand-in for the Gemini REST API (POST /v1beta/models/{model}:generateContent).
+    Answers with canned COMPONENT/TYPE/POSITION blocks in the format the
+    detector parses. error_rate is the share of calls answered with a
+    429 RESOURCE_EXHAUSTED, like an exhausted free-tier quota.
+    Point the backend at it with GEMINI_API_ENDPOINT=<stub url>.
+    """
+
+    COMPONENTS = [
+        ("RAM", "DDR4 SO-DIMM 8GB 3200MHz", "center-left", "Medium"),
+        ("SSD", "M.2 2280 NVMe PCIe Gen3", "bottom-right", "Small"),
+        ("Battery", "Li-ion 4-cell 54Wh", "bottom", "Large"),
+        ("WiFi Card", "M.2 2230 Intel AX201", "top-right", "Small"),
+        ("Fan", "Blower 5V", "top-left", "Medium"),
+        ("Heatsink", "Copper heat pipe", "top-center", "Medium"),
+    ]
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, components=3):
+        super().__init__(host, port)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.components = components
+        self.calls = {}
+
+    def response_text(self):
+        blocks = []
+        for name, kind, position, size in random.sample(self.COMPONENTS, min(self.components, len(self.COMPONENTS))):
+            ymin, xmin = random.randint(0, 800), random.randint(0, 800)
+            blocks.append(
+                f"COMPONENT: {name}\nTYPE: {kind}\nPOSITION: {position}\nSIZE: {size}\n"
+                f"BOX: [{ymin}, {xmin}, {ymin + random.randint(50, 200)}, {xmin + random.randint(50, 200)}]\n"
+                f"DETAILS: Stub response, no real analysis"
+            )
+        return "\n---\n".join(blocks)
+
+    def handle(self, handler, body):
+        if self.latency:
+            time.sleep(self.latency)
+        path = handler.path.split("?", 1)[0]
+        model, _, method = path.rsplit("/", 1)[-1].partition(":")
+        with self._lock:
+            self.calls[model] = self.calls.get(model, 0) + 1
+        if method != "generateContent":
+            return 404, {"Content-Type": "application/json"}, json.dumps(
+                {"error": {"code": 404, "message": f"unknown method {method}", "status": "NOT_FOUND"}}
+            ).encode()
+        if self.error_rate and random.random() < self.error_rate:
+            return 429, {"Content-Type": "application/json"}, json.dumps({"error": {
+                "code": 429,
+                "message": "Resource has been exhausted (e.g. check quota).",
+                "status": "RESOURCE_EXHAUSTED",
+            }}).encode()
+        text = self.response_text()
+        payload = {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            # One image (258 tokens) plus a short prompt
+            "usageMetadata": {
+                "promptTokenCount": 300,
+                "candidatesTokenCount": len(text) // 4,
+                "totalTokenCount": 300 + len(text) // 4,
+                "promptTokensDetails": [
+                    {"modality": "IMAGE", "tokenCount": 258},
+                    {"modality": "TEXT", "tokenCount": 42},
+                ],
+            },
+            "modelVersion": model,
+        }
+        return 200, {"Content-Type": "application/json"}, json.dumps(payload).encode()
+
+
+STUBS = {
+    "collector": TraceCollector,
+    "livekit": LiveKitStub,
+    "gemini": GeminiStub,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in server")
+    parser.add_argument("kind", choices=sorted(STUBS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with an error")
+    args = parser.parse_args()
+
+    stub = STUBS[args.kind](args.host, args.port, latency=args.latency, error_rate=args.error_rate)
+    stub.start()
+    print(f"✅ {args.kind} stub listening on {stub.url}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"   {stub.requests} requests")
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
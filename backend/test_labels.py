@@ -1,6 +1,7 @@
 """
-Test script to verify YOLO model label mapping
-Upload test images and see what the model predicts
+Test script to check the component labels Gemini assigns
+Run detection on test images and see what the model predicts
+For timings without network calls see bench_hotpaths.py
 """
 from component_detector import detector
 from pathlib import Path
@@ -21,7 +22,7 @@ def test_single_image(image_path):
         image_data = f.read()
     
     # Run detection
-    result = detector.detect_components(image_data, conf_threshold=0.15)
+    result = detector.detect_components(image_data)
     
     if result.get('error'):
         print(f"❌ Error: {result['error']}")
@@ -30,14 +31,12 @@ def test_single_image(image_path):
     # Display results
     detections = result.get('detections', [])
     print(f"\n✅ Found {len(detections)} components:")
-    print(f"\nClass Mapping Used:")
-    for idx, name in detector.class_mapping.items():
-        print(f"  Model ID {idx} → {name}")
-    
-    print(f"\nDetections:")
     for i, det in enumerate(detections, 1):
-        print(f"  {i}. {det['class']} - {det['confidence']*100:.1f}% confidence")
-        print(f"     Bbox: {det['bbox']}")
+        print(f"  {i}. {det['class']} ({det.get('type', 'Unknown')}) - {det['confidence']*100:.1f}% confidence")
+        print(f"     Position: {det.get('position', 'Unknown')}")
+        if det.get('bbox'):
+            print(f"     Bbox: {det['bbox']}")
+    print(f"\nCategories: {[detector._categorize_component(det['class']) for det in detections]}")
     
     # Save annotated image
     if result.get('annotated_image'):
@@ -70,16 +69,12 @@ def test_sample_images():
         test_single_image(str(img_path))
 
 if __name__ == "__main__":
-    print("\n🔍 YOLO Label Verification Tool")
-    print("================================\n")
+    print("\n🔍 Component Label Verification Tool")
+    print("=====================================\n")
     
     print("Current Model Configuration:")
-    print(f"  Model loaded: {detector.model is not None}")
-    print(f"  Model path: {detector.model_path}")
-    print(f"\nDefault class names: {detector.default_class_names}")
-    print(f"Current class mapping:")
-    for idx, name in detector.class_mapping.items():
-        print(f"  {idx}: {name}")
+    print(f"  Gemini loaded: {detector.gemini_model is not None}")
+    print(f"  YOLO loaded: {detector.yolo_model is not None}")
     
     if len(sys.argv) > 1:
         # Test specific image provided as argument
@@ -92,21 +87,13 @@ if __name__ == "__main__":
         test_sample_images()
     
     print("\n" + "="*60)
-    print("🎯 Instructions to Fix Label Mapping:")
+    print("🎯 If a component is labeled wrongly:")
     print("="*60)
     print("""
 1. Look at the annotated images saved above
-2. Identify which components are correctly labeled
-3. Update component_detector.py class_mapping dictionary:
-   
-   Example:
-   If model shows "Battery" but it's actually RAM:
-   self.class_mapping = {
-       0: 'RAM',      # Model ID 0 → actually RAM
-       3: 'Battery',  # Model ID 3 → actually Battery
-       ...
-   }
-
+2. Check how the label maps to an upgrade category in
+   component_detector.py (_categorize_component)
+3. Adjust DETECTION_PROMPT or the category keywords
 4. Restart the API server (python api.py)
 5. Test again with your images
 """)
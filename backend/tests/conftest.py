@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The backend modules are flat files imported by name, as the servers do
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,78 @@
+import pytest
+
+# jobs imports the detection pipeline, which needs the API's dependencies
+pytest.importorskip("aiohttp")
+pytest.importorskip("PIL")
+
+from jobs import JobStore  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(tmp_path / "jobs.db")
+
+
+def test_claim_runs_each_job_once(store):
+    ids = {store.create(f"{n}.img", f"digest-{n}") for n in range(2)}
+    claimed = [store.claim(lease=60), store.claim(lease=60)]
+    assert {job["id"] for job in claimed} == ids
+    assert all(job["attempts"] == 1 for job in claimed)
+    assert all(store.get(job_id)["status"] == "running" for job_id in ids)
+    assert store.claim(lease=60) is None
+
+
+def test_expired_lease_is_claimed_again(store):
+    job_id = store.create("a.img", "digest")
+    assert store.claim(lease=-1)["id"] == job_id
+    again = store.claim(lease=60)
+    assert again["id"] == job_id
+    assert again["attempts"] == 2
+
+
+def test_renewed_lease_is_not_claimed(store):
+    job_id = store.create("a.img", "digest")
+    store.claim(lease=-1)
+    assert store.renew(job_id, lease=60)
+    assert store.claim(lease=60) is None
+
+
+def test_renew_fails_once_the_job_is_finished(store):
+    job_id = store.create("a.img", "digest")
+    store.claim(lease=60)
+    store.finish(job_id, "done", result={"ok": True})
+    assert not store.renew(job_id, lease=60)
+    assert store.get(job_id)["lease_expires"] is None
+
+
+def test_release_returns_the_job_without_counting_the_attempt(store):
+    job_id = store.create("a.img", "digest")
+    store.claim(lease=60)
+    store.release(job_id)
+    job = store.get(job_id)
+    assert (job["status"], job["attempts"]) == ("queued", 0)
+    assert store.claim(lease=60)["attempts"] == 1
+
+
+def test_release_leaves_finished_jobs_alone(store):
+    job_id = store.create("a.img", "digest")
+    store.claim(lease=60)
+    store.finish(job_id, "done", result={})
+    store.release(job_id)
+    assert store.get(job_id)["status"] == "done"
+
+
+def test_requeued_job_waits_for_its_backoff(store):
+    job_id = store.create("a.img", "digest")
+    store.claim(lease=60)
+    store.requeue(job_id, delay=60, error="quota")
+    assert store.claim(lease=60) is None
+    store.requeue(job_id, delay=0)
+    assert store.claim(lease=60)["id"] == job_id
+
+
+def test_purge_keeps_unfinished_jobs(store):
+    queued = store.create("a.img", "digest")
+    done = store.create(None, "digest", status="done", result={})
+    store.purge(older_than=float("inf"))
+    assert store.get(queued) is not None
+    assert store.get(done) is None
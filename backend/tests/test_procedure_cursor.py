@@ -0,0 +1,132 @@
+import pytest
+
+from knowledge_manager import KnowledgeManager, ProcedureCursor
+
+DASHBOARD = """# RAM REPLACEMENT
+
+## Step-by-step: RAM upgrade (Laptop)
+1. **Power off**
+   - Instruction: "Shut down and unplug the charger."
+   - Verification: "Screen is dark."
+2. **Open the bottom panel**
+   - Instruction: "Remove the ten screws on the bottom."
+   - Verification: "Panel lifts freely."
+3. **Swap the module**
+   - Instruction: "Press the side clips OUTWARD."
+   - Verification: "Module pops up at 30 degrees."
+
+## Step-by-step: RAM upgrade (Desktop PC)
+1. **Unplug the PC**
+   - Instruction: "Switch off the PSU."
+   - Verification: "No LEDs are lit."
+2. **Seat the DIMM**
+   - Instruction: "Push until both latches click."
+   - Verification: "Latches are closed."
+
+# BATTERY REPLACEMENT
+
+## Step-by-step: Battery replacement (Internal battery)
+1. **Disconnect the battery**
+   - Instruction: "Pull the connector straight out."
+   - Verification: "Connector is free."
+
+## Agent behavior
+- Present one step at a time.
+"""
+
+EXPORT = """## RAM UPGRADE ISSUES
+
+### Issue: Clips will not release
+Push both clips outward at the same time.
+
+### Issue: Laptop does not boot after upgrade
+Reseat the module firmly.
+"""
+
+SAFETY = """### RAM Safety
+Touch a grounded metal surface first.
+"""
+
+
+@pytest.fixture
+def knowledge(tmp_path):
+    (tmp_path / "dashboard.md").write_text(DASHBOARD, encoding="utf-8")
+    (tmp_path / "export.md").write_text(EXPORT, encoding="utf-8")
+    (tmp_path / "safety.md").write_text(SAFETY, encoding="utf-8")
+    return KnowledgeManager(tmp_path)
+
+
+def test_dashboard_is_indexed_as_linked_steps(knowledge):
+    laptop = knowledge.procedures["RAM_UPGRADE"]["RAM upgrade (Laptop)"]
+    assert laptop == ["RAM_UPGRADE/ram-upgrade-laptop/1", "RAM_UPGRADE/ram-upgrade-laptop/2", "RAM_UPGRADE/ram-upgrade-laptop/3"]
+    assert [knowledge.steps[i]["next"] for i in laptop] == laptop[1:] + [None]
+    assert knowledge.steps[laptop[0]]["instruction"] == "Shut down and unplug the charger."
+    assert knowledge.steps[laptop[0]]["verification"] == "Screen is dark."
+    assert "Present one step at a time." in knowledge.behavior_rules
+
+
+def test_no_context_until_a_procedure_starts(knowledge):
+    cursor = ProcedureCursor(knowledge)
+    assert cursor.update("hello there") is None
+    assert cursor.step is None
+
+
+def test_mentioning_a_component_picks_the_best_matching_procedure(knowledge):
+    cursor = ProcedureCursor(knowledge)
+    context = cursor.update("I want to add memory to my desktop pc")
+    assert cursor.step_id == "RAM_UPGRADE/ram-upgrade-desktop-pc/1"
+    assert "step 1 of 2" in context
+    assert "NEXT STEP 2 (after the user confirms): Seat the DIMM" in context
+
+
+def test_confirmation_advances_and_back_returns(knowledge):
+    cursor = ProcedureCursor(knowledge)
+    assert cursor.start("RAM_UPGRADE", "laptop")
+    cursor.update("done")
+    assert cursor.step["number"] == 2
+    cursor.update("go back please")
+    assert cursor.step["number"] == 1
+    cursor.update("go back")
+    assert cursor.step["number"] == 1
+
+
+def test_last_step_stays_put_and_says_so(knowledge):
+    cursor = ProcedureCursor(knowledge)
+    cursor.start("RAM_UPGRADE", "laptop")
+    cursor.update("yes")
+    context = cursor.update("yes")
+    assert cursor.step["number"] == 3
+    assert "This is the last step of the procedure." in context
+    cursor.update("finished")
+    assert cursor.step["number"] == 3
+
+
+def test_problem_stays_on_the_step_and_adds_troubleshooting(knowledge):
+    cursor = ProcedureCursor(knowledge)
+    cursor.start("RAM_UPGRADE", "laptop")
+    context = cursor.update("the clips will not release, I'm stuck")
+    assert cursor.step["number"] == 1
+    assert "TROUBLESHOOTING: Clips will not release" in context
+    assert "SAFETY: Touch a grounded metal surface first." in context
+
+
+def test_suggested_category_starts_on_agreement(knowledge):
+    cursor = ProcedureCursor(knowledge)
+    cursor.suggest("BATTERY_REPLACEMENT")
+    cursor.suggest("NOT_A_CATEGORY")
+    assert cursor.update("ok let's do it") is not None
+    assert cursor.step_id == "BATTERY_REPLACEMENT/battery-replacement-internal-battery/1"
+
+
+def test_switching_component_switches_procedure(knowledge):
+    cursor = ProcedureCursor(knowledge)
+    cursor.start("RAM_UPGRADE", "laptop")
+    cursor.update("actually the battery first")
+    assert cursor.step["category"] == "BATTERY_REPLACEMENT"
+
+
+def test_preview_does_not_move_the_cursor(knowledge):
+    cursor = ProcedureCursor(knowledge)
+    cursor.start("RAM_UPGRADE", "laptop")
+    assert "CURRENT STEP 2" in cursor.preview("done")
+    assert cursor.step["number"] == 1
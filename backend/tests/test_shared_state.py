@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+from shared_state import SQLiteStore, QuotaLimiter
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStore(tmp_path / "state.db")
+
+
+def test_incr_creates_and_adds(store):
+    assert store.incr("counter", 2, ttl=60) == 2
+    assert store.incr("counter", 3, ttl=60) == 5
+
+
+def test_incr_with_limit_refuses_without_changing_the_counter(store):
+    store.incr("counter", 8, ttl=60)
+    assert store.incr("counter", 3, ttl=60, limit=10) is None
+    assert int(store.get("counter")) == 8
+    assert store.incr("counter", 2, ttl=60, limit=10) == 10
+
+
+def test_limiter_admits_up_to_the_limit(store):
+    limiter = QuotaLimiter(store, "test", per_minute=3)
+    assert [limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert limiter.used() == 3
+
+
+def test_rejected_acquire_does_not_consume_quota(store):
+    limiter = QuotaLimiter(store, "test", per_minute=15)
+    assert limiter.try_acquire(cost=10)
+    # A tiled request that does not fit is refused without using up the window
+    assert not limiter.try_acquire(cost=9)
+    assert limiter.used() == 10
+    assert all(limiter.try_acquire() for _ in range(5))
+    assert not limiter.try_acquire()
+    assert limiter.used() == 15
+
+
+def test_limiter_without_limit_always_admits(store):
+    limiter = QuotaLimiter(store, "test", per_minute=0)
+    assert all(limiter.try_acquire(cost=100) for _ in range(3))
+    assert limiter.used() == 0
+
+
+def test_acquire_gives_up_when_the_next_window_is_past_the_timeout(store, monkeypatch):
+    limiter = QuotaLimiter(store, "test", per_minute=1)
+    # Early in a window, so waiting for the next one takes longer than the timeout
+    monkeypatch.setattr(time, "time", lambda: 6000.0 * 60 + 1)
+    assert asyncio.run(limiter.acquire(timeout=1.0))
+    assert not asyncio.run(limiter.acquire(timeout=1.0))
+    assert limiter.used() == 1
@@ -0,0 +1,137 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import tiling
+from tiling import make_tiles, call_count, to_pixels, position_label, merge, detect_tiled
+
+
+def detection(name, bbox=None, confidence=0.9):
+    d = {"class": name, "confidence": confidence, "position": ""}
+    if bbox is not None:
+        d["bbox"] = bbox
+    return d
+
+
+def test_small_image_is_one_tile():
+    assert make_tiles(800, 600, tile_size=1024) == [(0, 0, 800, 600)]
+
+
+def test_tiles_cover_the_image_and_overlap():
+    tiles = make_tiles(4032, 3024, tile_size=1024, overlap=0.2, max_tiles=64)
+    assert min(t[0] for t in tiles) == 0 and min(t[1] for t in tiles) == 0
+    assert max(t[2] for t in tiles) == 4032 and max(t[3] for t in tiles) == 3024
+    first_row = sorted(t for t in tiles if t[1] == 0)
+    for left, right in zip(first_row, first_row[1:]):
+        assert right[0] < left[2]
+
+
+def test_tiles_grow_to_respect_max_tiles():
+    tiles = make_tiles(4032, 3024, tile_size=1024, overlap=0.2, max_tiles=8)
+    assert len(tiles) <= 8
+    assert max(t[2] for t in tiles) == 4032 and max(t[3] for t in tiles) == 3024
+
+
+def test_call_count_includes_the_overview():
+    assert call_count(1000, 800) == 1
+    assert call_count(4032, 3024) == len(make_tiles(4032, 3024)) + 1
+
+
+def test_to_pixels_maps_tile_box_to_image_coordinates():
+    d = to_pixels({"class": "Screw", "box": [0, 0, 500, 1000]}, (1000, 2000, 2000, 3000))
+    assert "box" not in d
+    assert d["bbox"] == [1000, 2000, 2000, 2500]
+
+
+def test_to_pixels_clamps_and_orders_corners():
+    d = to_pixels({"class": "Screw", "box": [1200, 600, -50, 400]}, (0, 0, 1000, 1000))
+    assert d["bbox"] == [400, 0, 600, 1000]
+
+
+def test_to_pixels_leaves_unboxed_detections():
+    assert to_pixels({"class": "RAM"}, (0, 0, 10, 10)) == {"class": "RAM"}
+
+
+@pytest.mark.parametrize("bbox, expected", [
+    ([0, 0, 100, 100], "top-left"),
+    ([450, 450, 550, 550], "center"),
+    ([900, 450, 1000, 550], "right"),
+    ([450, 900, 550, 1000], "bottom"),
+])
+def test_position_label(bbox, expected):
+    assert position_label(bbox, 1000, 1000) == expected
+
+
+def test_merge_removes_duplicates_from_overlapping_tiles():
+    pytest.importorskip("numpy")
+    merged = merge([
+        detection("Screw", [100, 100, 140, 140], confidence=0.8),
+        detection("Screw", [102, 101, 141, 141], confidence=0.9),
+        detection("screw ", [800, 800, 840, 840]),
+    ], 1000, 1000)
+    assert sorted(d["bbox"] for d in merged) == [[102, 101, 141, 141], [800, 800, 840, 840]]
+    assert {d["position"] for d in merged} == {"top-left", "bottom-right"}
+
+
+def test_merge_keeps_overlapping_boxes_of_different_classes():
+    pytest.importorskip("numpy")
+    merged = merge([detection("Screw", [100, 100, 140, 140]), detection("Connector", [100, 100, 140, 140])], 1000, 1000)
+    assert len(merged) == 2
+
+
+def test_merge_keeps_unboxed_detection_once_per_unseen_class():
+    pytest.importorskip("numpy")
+    merged = merge([
+        detection("RAM"), detection("ram"), detection("Screw", [0, 0, 10, 10]), detection("Screw"),
+    ], 1000, 1000)
+    assert [d["class"] for d in merged] == ["Screw", "RAM"]
+
+
+class FakeImage:
+    size = (4032, 3024)
+
+    def crop(self, region):
+        return region
+
+
+class FakeClient:
+    """Answers each region with one screw in its middle; fails the tiles listed in failing"""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = 0
+
+    async def generate(self, contents, timeout=None):
+        self.calls += 1
+        region = contents[1]
+        if region in self.failing:
+            raise RuntimeError("tile failed")
+        return SimpleNamespace(text="COMPONENT: Screw\nBOX: [450, 450, 550, 550]")
+
+
+class FakeDetector:
+    @staticmethod
+    def _parse_detailed_response(text):
+        return [{"class": "Screw", "confidence": 0.9, "position": "", "box": [450, 450, 550, 550]}]
+
+
+def test_detect_tiled_skips_failed_tiles():
+    pytest.importorskip("numpy")
+    tiles = make_tiles(*FakeImage.size)
+    client = FakeClient(failing={tiles[0]})
+    result = asyncio.run(detect_tiled(FakeDetector(), FakeImage(), client))
+    assert client.calls == result["tile_count"] == call_count(*FakeImage.size)
+    assert result["tiles_failed"] == 1
+    assert result["detections"]
+
+
+def test_detect_tiled_raises_when_every_call_fails(monkeypatch):
+    monkeypatch.setattr(tiling, "make_tiles", lambda width, height: [])
+
+    class Failing(FakeClient):
+        async def generate(self, contents, timeout=None):
+            raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(detect_tiled(FakeDetector(), FakeImage(), Failing()))
@@ -0,0 +1,40 @@
+from tracing import Tracer
+
+
+def queued(tracer):
+    return [events[0] for events, _ in tracer._queue]
+
+
+def test_drop_oldest_evicts_ordinary_traces_first():
+    tracer = Tracer(max_queue=2)
+    tracer._enqueue(["error"], priority=True)
+    tracer._enqueue(["ordinary"])
+    tracer._enqueue(["new"])
+    assert queued(tracer) == ["error", "new"]
+    assert tracer.stats["dropped"] == 1
+
+
+def test_ordinary_trace_never_evicts_a_priority_trace():
+    tracer = Tracer(max_queue=2)
+    tracer._enqueue(["error"], priority=True)
+    tracer._enqueue(["slow"], priority=True)
+    tracer._enqueue(["ordinary"])
+    assert queued(tracer) == ["error", "slow"]
+    assert tracer.stats["dropped"] == 1
+
+
+def test_priority_trace_replaces_the_oldest_when_all_are_priority():
+    tracer = Tracer(max_queue=2)
+    tracer._enqueue(["error-1"], priority=True)
+    tracer._enqueue(["error-2"], priority=True)
+    tracer._enqueue(["error-3"], priority=True)
+    assert queued(tracer) == ["error-2", "error-3"]
+
+
+def test_drop_newest_rejects_the_incoming_ordinary_trace():
+    tracer = Tracer(max_queue=1, drop_policy="drop_newest")
+    tracer._enqueue(["first"])
+    tracer._enqueue(["second"])
+    tracer._enqueue(["error"], priority=True)
+    assert queued(tracer) == ["error"]
+    assert tracer.stats["dropped"] == 2
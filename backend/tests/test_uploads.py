@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("starlette.formparsers")
+pytest.importorskip("multipart")
+from starlette.datastructures import Headers
+
+import uploads
+from uploads import UploadRejected, MemoryBudget, receive_image
+
+BOUNDARY = "testboundary"
+
+
+class FakeRequest:
+    """Just what receive_image reads: headers and a chunked body stream"""
+
+    def __init__(self, body, content_type=f"multipart/form-data; boundary={BOUNDARY}", content_length=True):
+        raw = {"content-type": content_type}
+        if content_length:
+            raw["content-length"] = str(len(body))
+        self.headers = Headers(raw)
+        self.body = body
+
+    async def stream(self):
+        for start in range(0, len(self.body), 64 * 1024):
+            yield self.body[start:start + 64 * 1024]
+
+
+def multipart(data, field="image", filename="board.png"):
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def png(width=64, height=48):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "green").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def rejection(request):
+    with pytest.raises(UploadRejected) as info:
+        asyncio.run(receive_image(request))
+    return info.value.status_code, info.value.reason
+
+
+def test_accepts_png_and_hashes_it():
+    data = png()
+
+    async def receive():
+        upload = await receive_image(FakeRequest(multipart(data)))
+        try:
+            return upload.mime, upload.size, upload.digest, upload.image.size
+        finally:
+            await upload.close()
+
+    assert asyncio.run(receive()) == ("image/png", len(data), hashlib.sha256(data).hexdigest(), (64, 48))
+
+
+def test_non_multipart_is_415():
+    assert rejection(FakeRequest(png(), content_type="image/png")) == (415, "content_type")
+
+
+def test_declared_length_over_limit_is_413(monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(uploads, "MULTIPART_OVERHEAD", 256)
+    assert rejection(FakeRequest(multipart(b"\x00" * 4096))) == (413, "too_large")
+
+
+def test_streamed_body_over_limit_is_413_without_content_length(monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(uploads, "MULTIPART_OVERHEAD", 256)
+    assert rejection(FakeRequest(multipart(b"\x00" * 200_000), content_length=False)) == (413, "too_large")
+
+
+def test_missing_field_is_422():
+    assert rejection(FakeRequest(multipart(png(), field="photo"))) == (422, "missing")
+
+
+def test_non_image_bytes_are_415():
+    assert rejection(FakeRequest(multipart(b"%PDF-1.7 not an image"))) == (415, "file_type")
+
+
+def test_truncated_image_with_valid_signature_is_415():
+    assert rejection(FakeRequest(multipart(b"\x89PNG\r\n\x1a\n" + b"\x00" * 32))) == (415, "file_type")
+
+
+def test_too_many_pixels_is_413(monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_IMAGE_PIXELS", 1000)
+    assert rejection(FakeRequest(multipart(png(64, 48)))) == (413, "pixels")
+
+
+def test_decompression_bomb_is_413(monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100)
+    assert rejection(FakeRequest(multipart(png(64, 48)))) == (413, "pixels")
+
+
+def test_memory_budget_is_503_when_full():
+    budget = MemoryBudget(100)
+
+    async def overcommit():
+        async with budget.reserve(80):
+            async with budget.reserve(40, timeout=0.01):
+                pass
+
+    with pytest.raises(UploadRejected) as info:
+        asyncio.run(overcommit())
+    assert info.value.status_code == 503
+    assert info.value.headers == {"Retry-After": "5"}
+    assert budget.in_use == 0
+
+
+def test_memory_budget_runs_an_oversized_image_alone():
+    budget = MemoryBudget(100)
+
+    async def reserve():
+        async with budget.reserve(500):
+            return budget.in_use
+
+    assert asyncio.run(reserve()) == 100
@@ -0,0 +1,182 @@
+"""
+Tiled detection for high-resolution board photos
+One Gemini call on a full 12 MP board photo sees it downscaled, so small
+parts (M.2 screws, antenna connectors, CMOS batteries) are missed or placed
+wrongly. In tiled mode the image is split into overlapping TILE_SIZE tiles,
+each tile (plus one overview of the whole image, for parts larger than a
+tile) is sent to Gemini concurrently, at most TILE_CONCURRENCY at a time,
+and every answer includes a BOX per component. Boxes are mapped from tile
+to image coordinates and duplicates from overlapping tiles are removed with
+class-aware non-maximum suppression, vectorized with numpy.
+
+Only images whose longer side exceeds TILE_MIN_SIDE are tiled. Each tile
+is one more Gemini call against the detection quota; call_count() says how
+many a given image costs.
+"""
+import asyncio
+import math
+import os
+import time
+
+from metrics import REGISTRY, detect_stage
+
+TILE_SIZE = int(os.getenv("TILE_SIZE", "1024"))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+TILE_MIN_SIDE = int(os.getenv("TILE_MIN_SIDE", "2048"))
+TILE_MAX_TILES = int(os.getenv("TILE_MAX_TILES", "8"))
+TILE_CONCURRENCY = int(os.getenv("TILE_CONCURRENCY", "4"))
+NMS_IOU = float(os.getenv("TILE_NMS_IOU", "0.5"))
+
+TILED_DETECTION_PROMPT = """List all hardware components visible, including small parts such as screws, connectors and coin-cell batteries. For each:
+COMPONENT: [name]
+TYPE: [details]
+POSITION: [location]
+BOX: [ymin, xmin, ymax, xmax] bounding box scaled to 0-1000
+Separate components with a line containing only ---"""
+
+DETECT_TILES = REGISTRY.histogram(
+    "detect_tiles", "Gemini calls (tiles plus overview) per tiled detection", buckets=(1, 2, 4, 6, 9, 12, 16, 25),
+)
+
+
+def should_tile(width, height):
+    return max(width, height) > TILE_MIN_SIDE
+
+
+def _starts(length, tile, step):
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - tile) / step) + 1
+    # Spread the tiles evenly so the last one ends exactly at the edge
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def make_tiles(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=TILE_MAX_TILES):
+    """Overlapping (left, top, right, bottom) tiles covering the image, at most max_tiles"""
+    while True:
+        step = max(1, int(tile_size * (1 - overlap)))
+        xs, ys = _starts(width, tile_size, step), _starts(height, tile_size, step)
+        if len(xs) * len(ys) <= max_tiles:
+            break
+        tile_size = int(tile_size * 1.25)
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height)) for y in ys for x in xs]
+
+
+def call_count(width, height):
+    """Gemini calls a tiled detection of this image makes (tiles plus the overview)"""
+    return len(make_tiles(width, height)) + 1 if should_tile(width, height) else 1
+
+
+def to_pixels(detection, region):
+    """Replace a 0-1000 [ymin, xmin, ymax, xmax] box with a pixel bbox [x1, y1, x2, y2] in image coordinates"""
+    box = detection.pop("box", None)
+    if box is None:
+        return detection
+    left, top, right, bottom = region
+    ymin, xmin, ymax, xmax = (min(max(v, 0.0), 1000.0) / 1000 for v in box)
+    width, height = right - left, bottom - top
+    detection["bbox"] = [
+        int(left + min(xmin, xmax) * width), int(top + min(ymin, ymax) * height),
+        int(left + max(xmin, xmax) * width), int(top + max(ymin, ymax) * height),
+    ]
+    return detection
+
+
+def position_label(bbox, width, height):
+    """Coarse position such as "top-left" or "center" for a pixel bbox"""
+    cx, cy = (bbox[0] + bbox[2]) / 2 / width, (bbox[1] + bbox[3]) / 2 / height
+    row = "top" if cy < 1 / 3 else "bottom" if cy > 2 / 3 else ""
+    col = "left" if cx < 1 / 3 else "right" if cx > 2 / 3 else ""
+    return "-".join(part for part in (row, col) if part) or "center"
+
+
+def nms(boxes, scores, classes, iou_threshold=NMS_IOU):
+    """
+    Indices kept by class-aware non-maximum suppression. boxes is (N, 4)
+    x1, y1, x2, y2; each box is offset by its class so boxes of different
+    classes never overlap, and IoU against all remaining boxes is computed
+    in one vectorized step per kept box.
+    """
+    if len(boxes) == 0:
+        return []
+    # Imported here so importing this module (and the API) stays fast
+    import numpy as np
+
+    boxes = np.asarray(boxes, dtype=np.float64)
+    offset = (boxes.max() + 1) * np.asarray(classes, dtype=np.float64)[:, None]
+    shifted = boxes + offset
+    areas = (shifted[:, 2] - shifted[:, 0]) * (shifted[:, 3] - shifted[:, 1])
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(int(i))
+        rest = order[1:]
+        x1 = np.maximum(shifted[i, 0], shifted[rest, 0])
+        y1 = np.maximum(shifted[i, 1], shifted[rest, 1])
+        x2 = np.minimum(shifted[i, 2], shifted[rest, 2])
+        y2 = np.minimum(shifted[i, 3], shifted[rest, 3])
+        intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        iou = intersection / np.maximum(areas[i] + areas[rest] - intersection, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return keep
+
+
+def merge(detections, width, height):
+    """Deduplicate detections from all tiles; unboxed ones are kept once per class"""
+    boxed = [d for d in detections if "bbox" in d]
+    class_ids = {}
+    classes = [class_ids.setdefault(d["class"].strip().lower(), len(class_ids)) for d in boxed]
+    # Prefer confident detections, then larger boxes (a part cut by a tile edge gets a smaller box)
+    scores = [d["confidence"] + 1e-6 * (d["bbox"][2] - d["bbox"][0]) * (d["bbox"][3] - d["bbox"][1]) for d in boxed]
+    merged = [boxed[i] for i in sorted(nms([d["bbox"] for d in boxed], scores, classes))]
+    for detection in merged:
+        detection["position"] = position_label(detection["bbox"], width, height)
+    seen = set(class_ids)
+    for detection in detections:
+        name = detection["class"].strip().lower()
+        if "bbox" not in detection and name not in seen:
+            seen.add(name)
+            merged.append(detection)
+    return merged
+
+
+async def detect_tiled(detector, pil_image, client, deadline=None, concurrency=TILE_CONCURRENCY):
+    """
+    Run detection on overlapping tiles plus an overview of pil_image and
+    merge the results. Returns the detections, how many Gemini calls were
+    made (tile_count) and merge time in ms. Raises asyncio.TimeoutError if
+    no call finished in time; other per-tile failures are skipped.
+
+    All tiles share deadline: each call gets the time left when it takes a
+    concurrency slot, and tiles still waiting when it runs out are skipped.
+    """
+    width, height = pil_image.size
+    regions = [(0, 0, width, height)] + make_tiles(width, height)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def detect_region(region):
+        async with semaphore:
+            timeout = deadline.remaining() if deadline is not None else None
+            if timeout == 0:
+                raise asyncio.TimeoutError()
+            image = pil_image if region == (0, 0, width, height) else pil_image.crop(region)
+            response = await client.generate([TILED_DETECTION_PROMPT, image], timeout=timeout)
+        return [to_pixels(d, region) for d in detector._parse_detailed_response(response.text)]
+
+    with detect_stage("gemini_detection"):
+        results = await asyncio.gather(*(detect_region(region) for region in regions), return_exceptions=True)
+    DETECT_TILES.observe(len(regions))
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if len(failures) == len(results):
+        raise failures[0]
+
+    start = time.perf_counter()
+    with detect_stage("tile_merge"):
+        detections = merge([d for r in results if not isinstance(r, BaseException) for d in r], width, height)
+    return {
+        "detections": detections,
+        "tile_count": len(regions),
+        "tiles_failed": len(failures),
+        "merge_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
@@ -0,0 +1,445 @@
+"""
+Tracing layer for the video agent and detection API
+Spans are collected in memory, whole traces are sampled (head + tail) and
+exported in batches from a background thread so a slow or unreachable
+tracing backend never blocks a voice session or an HTTP request.
+Batches that cannot be delivered are spooled to disk and replayed later.
+"""
+import atexit
+import base64
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import uuid4
+
+logger = logging.getLogger("tracing")
+
+
+def _iso(ts):
+    """Convert a unix timestamp to the ISO-8601 format expected by Langfuse"""
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+class Span:
+    """A single timed operation inside a trace (span or LLM generation)"""
+
+    def __init__(self, trace, name, kind="span", metadata=None, model=None, input=None):
+        self.trace = trace
+        self.id = uuid4().hex
+        self.name = name
+        self.kind = kind
+        self.metadata = dict(metadata or {})
+        self.model = model
+        self.input = input
+        self.output = None
+        self.level = "DEFAULT"
+        self.start_time = time.time()
+        self.end_time = None
+        self.completion_start_time = None
+
+    @property
+    def duration(self):
+        end = self.end_time if self.end_time is not None else time.time()
+        return end - self.start_time
+
+    def update(self, level=None, completion_start_time=None, output=None, metadata=None, **kwargs):
+        if level is not None:
+            self.level = level
+            if level == "ERROR":
+                self.trace.has_error = True
+        if completion_start_time is not None:
+            if isinstance(completion_start_time, datetime):
+                completion_start_time = completion_start_time.timestamp()
+            self.completion_start_time = completion_start_time
+        if output is not None:
+            self.output = output
+        if metadata:
+            self.metadata.update(metadata)
+
+    def end(self, output=None, **kwargs):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if output is not None:
+            self.output = output
+        self.trace._span_ended(self)
+
+    def to_event(self):
+        body = {
+            "id": self.id,
+            "traceId": self.trace.trace_id,
+            "name": self.name,
+            "startTime": _iso(self.start_time),
+            "endTime": _iso(self.end_time),
+            "metadata": self.metadata,
+            "level": self.level,
+        }
+        if self.input is not None:
+            body["input"] = self.input
+        if self.output is not None:
+            body["output"] = self.output
+        if self.kind == "generation":
+            body["model"] = self.model
+            body["completionStartTime"] = _iso(self.completion_start_time)
+        return {
+            "id": uuid4().hex,
+            "type": f"{self.kind}-create",
+            "timestamp": _iso(time.time()),
+            "body": body,
+        }
+
+
+class Trace:
+    """A group of spans exported (or dropped) together"""
+
+    def __init__(self, tracer, name, metadata=None, sampled=True):
+        self.tracer = tracer
+        self.trace_id = uuid4().hex
+        self.name = name
+        self.metadata = dict(metadata or {})
+        self.sampled = sampled
+        self.has_error = False
+        self.start_time = time.time()
+        self.end_time = None
+        self.kept = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self):
+        end = self.end_time if self.end_time is not None else time.time()
+        return end - self.start_time
+
+    def span(self, name, metadata=None):
+        span = Span(self, name, metadata=metadata)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def generation(self, name, model=None, input=None):
+        span = Span(self, name, kind="generation", model=model, input=input)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def finish(self, level=None):
+        """Close the trace and hand it to the tracer for sampling and export"""
+        with self._lock:
+            if self.end_time is not None:
+                return
+            self.end_time = time.time()
+            if level == "ERROR":
+                self.has_error = True
+        self.tracer._submit(self)
+
+    def _span_ended(self, span):
+        # Spans that outlive their trace (e.g. the long-running STT stream)
+        # are exported on their own once the trace has been kept.
+        if self.kept:
+            self.tracer._enqueue([span.to_event()], priority=span.level == "ERROR")
+
+    def to_events(self):
+        events = [{
+            "id": uuid4().hex,
+            "type": "trace-create",
+            "timestamp": _iso(self.start_time),
+            "body": {
+                "id": self.trace_id,
+                "name": self.name,
+                "timestamp": _iso(self.start_time),
+                "metadata": dict(self.metadata, duration_ms=round(self.duration * 1000, 1)),
+                "sessionId": self.metadata.get("session_id"),
+            },
+        }]
+        with self._lock:
+            spans = list(self.spans)
+        events.extend(span.to_event() for span in spans if span.end_time is not None)
+        return events
+
+
+class _NoopSpan:
+    def update(self, *args, **kwargs): return None
+    def end(self, *args, **kwargs): return None
+
+
+class _NoopTrace:
+    trace_id = None
+    def span(self, *args, **kwargs): return _NoopSpan()
+    def generation(self, *args, **kwargs): return _NoopSpan()
+    def finish(self, *args, **kwargs): return None
+
+
+class HttpExporter:
+    """POST batches of ingestion events as JSON to a collector endpoint"""
+
+    def __init__(self, url, headers=None, timeout=5.0):
+        self.url = url
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+        self.timeout = timeout
+
+    def export(self, events):
+        data = json.dumps({"batch": events}, default=str).encode("utf-8")
+        request = urllib.request.Request(self.url, data=data, headers=self.headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"collector returned HTTP {response.status}")
+
+
+class DiskSpool:
+    """Directory of undelivered batches, replayed oldest-first"""
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def _files(self):
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob("*.json"))
+
+    def write(self, events):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{time.time_ns()}-{os.getpid()}-{uuid4().hex[:6]}.json"
+        tmp_path = self.directory / (name + ".tmp")
+        tmp_path.write_text(json.dumps(events, default=str), encoding="utf-8")
+        tmp_path.replace(self.directory / name)
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        files = self._files()
+        total = sum(f.stat().st_size for f in files)
+        while files and total > self.max_bytes:
+            oldest = files.pop(0)
+            total -= oldest.stat().st_size
+            oldest.unlink(missing_ok=True)
+            logger.warning("Trace spool over budget, discarded %s", oldest.name)
+
+    def replay(self, exporter, max_files=10):
+        """Re-send spooled batches; stops at the first failure. Returns files sent."""
+        sent = 0
+        for path in self._files()[:max_files]:
+            try:
+                events = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                path.unlink(missing_ok=True)
+                continue
+            exporter.export(events)
+            path.unlink(missing_ok=True)
+            sent += 1
+        return sent
+
+    def pending(self):
+        return len(self._files())
+
+
+class Tracer:
+    """
+    Bounded, non-blocking trace pipeline.
+
+    Sampling: a head decision is taken when the trace starts (sample_rate);
+    at finish the tail rule keeps every trace with an error or slower than
+    slow_threshold regardless of the head decision.
+    Overload: the queue holds at most max_queue traces; drop_policy is
+    "drop_oldest" or "drop_newest". Error and slow traces are never the
+    ones rejected while something else can be evicted; a new ordinary
+    trace is dropped rather than evict one of them.
+    """
+
+    def __init__(self, exporter=None, sample_rate=1.0, slow_threshold=3.0,
+                 max_queue=1000, batch_size=50, flush_interval=2.0,
+                 drop_policy="drop_oldest", spool=None, retry_backoff=30.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.spool = spool
+        self.retry_backoff = retry_backoff
+
+        self.stats = {"exported": 0, "dropped": 0, "sampled_out": 0, "spooled": 0, "replayed": 0, "failures": 0}
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._backend_down_until = 0.0
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def start_trace(self, name, metadata=None):
+        if not self.enabled:
+            return _NoopTrace()
+        self._ensure_started()
+        return Trace(self, name, metadata=metadata, sampled=random.random() < self.sample_rate)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+
+    def _count(self, stat, amount=1):
+        # stats is updated from request threads and the exporter thread
+        with self._cond:
+            self.stats[stat] += amount
+
+    def _submit(self, trace):
+        slow = trace.duration >= self.slow_threshold
+        trace.kept = trace.sampled or trace.has_error or slow
+        if not trace.kept:
+            self._count("sampled_out")
+            return
+        self._enqueue(trace.to_events(), priority=trace.has_error or slow)
+
+    def _enqueue(self, events, priority=False):
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                if self.drop_policy == "drop_newest" and not priority:
+                    self._count("dropped")
+                    return
+                victim = next((i for i, (_, p) in enumerate(self._queue) if not p), None)
+                if victim is None:
+                    if not priority:
+                        self._count("dropped")
+                        return
+                    victim = 0  # only priority traces queued: the oldest one goes
+                del self._queue[victim]
+                self._count("dropped")
+            self._queue.append((events, priority))
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _take_batch(self):
+        with self._cond:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.extend(self._queue.popleft()[0])
+            return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self._export_pending()
+            if stopping:
+                return
+
+    def _export_pending(self):
+        while True:
+            events = self._take_batch()
+            if not events:
+                break
+            self._export(events)
+        if self.spool and time.monotonic() >= self._backend_down_until:
+            try:
+                self._count("replayed", self.spool.replay(self.exporter))
+            except Exception as e:
+                self._mark_backend_down(e)
+
+    def _export(self, events):
+        if time.monotonic() < self._backend_down_until:
+            self._spool(events)
+            return
+        try:
+            self.exporter.export(events)
+            self._count("exported", len(events))
+        except Exception as e:
+            self._mark_backend_down(e)
+            self._spool(events)
+
+    def _mark_backend_down(self, error):
+        self._count("failures")
+        self._backend_down_until = time.monotonic() + self.retry_backoff
+        logger.warning("Trace export failed, backing off %.0fs: %s", self.retry_backoff, error)
+
+    def _spool(self, events):
+        if self.spool is None:
+            self._count("dropped")
+            return
+        try:
+            self.spool.write(events)
+            self._count("spooled")
+        except OSError as e:
+            self._count("dropped")
+            logger.warning("Failed to spool traces: %s", e)
+
+    def flush(self):
+        """Wake the exporter thread without waiting for it"""
+        with self._cond:
+            self._cond.notify()
+
+    def shutdown(self, timeout=2.0):
+        """Stop the exporter; whatever is not delivered within timeout is spooled"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        while True:
+            events = self._take_batch()
+            if not events:
+                break
+            self._spool(events)
+
+
+def _default_exporter():
+    url = os.getenv("TRACE_EXPORT_URL")
+    if url:
+        return HttpExporter(url, timeout=float(os.getenv("TRACE_EXPORT_TIMEOUT", "5")))
+    public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
+    secret_key = os.getenv("LANGFUSE_SECRET_KEY")
+    if public_key and secret_key:
+        host = os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com").rstrip("/")
+        auth = base64.b64encode(f"{public_key}:{secret_key}".encode()).decode()
+        return HttpExporter(
+            f"{host}/api/public/ingestion",
+            headers={"Authorization": f"Basic {auth}"},
+            timeout=float(os.getenv("TRACE_EXPORT_TIMEOUT", "5")),
+        )
+    return None
+
+
+def create_tracer_from_env():
+    """Build a Tracer from TRACE_* / LANGFUSE_* environment variables"""
+    spool_dir = os.getenv("TRACE_SPOOL_DIR", str(Path(__file__).parent / ".trace_spool"))
+    return Tracer(
+        exporter=_default_exporter(),
+        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "1.0")),
+        slow_threshold=float(os.getenv("TRACE_SLOW_THRESHOLD_MS", "3000")) / 1000,
+        max_queue=int(os.getenv("TRACE_QUEUE_SIZE", "1000")),
+        batch_size=int(os.getenv("TRACE_BATCH_SIZE", "50")),
+        flush_interval=float(os.getenv("TRACE_FLUSH_INTERVAL", "2")),
+        drop_policy=os.getenv("TRACE_DROP_POLICY", "drop_oldest"),
+        spool=DiskSpool(spool_dir, max_bytes=int(float(os.getenv("TRACE_SPOOL_MAX_MB", "50")) * 1024 * 1024)),
+    )
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """Process-wide tracer, created on first use"""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = create_tracer_from_env()
+                atexit.register(_tracer.shutdown, float(os.getenv("TRACE_SHUTDOWN_TIMEOUT", "2")))
+    return _tracer
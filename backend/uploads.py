@@ -0,0 +1,175 @@
+"""
+Bounded image uploads for /api/detect-component
+The multipart body is streamed into a spooled temporary file (memory up to
+1 MB, disk beyond) with a hard byte limit, instead of being read into memory
+whole. Oversized or non-image uploads are rejected before any decode:
+Content-Length first, then magic bytes, then the pixel count read from the
+image header. Decoding is gated by a process-wide memory budget, so a burst
+of large photos waits (or gets a 503) instead of exhausting worker RAM.
+"""
+import asyncio
+import hashlib
+import os
+from contextlib import asynccontextmanager
+
+from PIL import Image
+from starlette.formparsers import MultiPartParser, MultiPartException
+
+from metrics import REGISTRY
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+UPLOAD_MEMORY_BUDGET = int(os.getenv("UPLOAD_MEMORY_BUDGET", str(512 * 1024 * 1024)))
+UPLOAD_BUDGET_WAIT = float(os.getenv("UPLOAD_BUDGET_WAIT", "10"))
+# Room for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+UPLOAD_REJECTIONS = REGISTRY.counter("upload_rejections_total", "Rejected image uploads by reason", ("reason",))
+UPLOAD_BUDGET_IN_USE = REGISTRY.gauge("upload_memory_budget_bytes", "Decoded-image bytes currently reserved")
+
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+}
+
+
+class UploadRejected(Exception):
+    """Upload refused before detection; status_code/detail become the HTTP response"""
+
+    def __init__(self, status_code, detail, reason, headers=None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.reason = reason
+        self.headers = headers
+
+
+def sniff_image_type(head):
+    for signature, mime in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+async def _limited(stream, limit):
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > limit:
+            raise UploadRejected(413, f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit", "too_large")
+        yield chunk
+
+
+class ImageUpload:
+    """A validated upload: spooled file, its sha256 and the header-only PIL image"""
+
+    def __init__(self, upload, size, digest, image, mime):
+        self.upload = upload
+        self.filename = upload.filename
+        self.size = size
+        self.digest = digest
+        self.image = image
+        self.mime = mime
+
+    @property
+    def decoded_bytes(self):
+        # Decoded pixels plus the annotated copy drawn from them
+        return self.image.width * self.image.height * len(self.image.getbands()) * 2
+
+    async def close(self):
+        self.image.close()
+        await self.upload.close()
+
+
+async def receive_image(request, field="image"):
+    """Stream the multipart body and validate the image part; raises UploadRejected"""
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise UploadRejected(415, "Expected multipart/form-data with an image field", "content_type")
+    limit = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise UploadRejected(413, f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit", "too_large")
+
+    parser = MultiPartParser(request.headers, _limited(request.stream(), limit), max_files=1, max_fields=10)
+    try:
+        form = await parser.parse()
+    except MultiPartException as e:
+        raise UploadRejected(400, str(e), "malformed")
+    upload = form.get(field)
+    if upload is None or isinstance(upload, str):
+        raise UploadRejected(422, f"Missing file field '{field}'", "missing")
+
+    try:
+        head = await upload.read(16)
+        mime = sniff_image_type(head)
+        if mime is None:
+            raise UploadRejected(415, "Unsupported file type; upload a JPEG, PNG or WebP image", "file_type")
+
+        # Hash in chunks from the spool instead of holding the whole file
+        digest = hashlib.sha256(head)
+        size = len(head)
+        while chunk := await upload.read(1024 * 1024):
+            digest.update(chunk)
+            size += len(chunk)
+        await upload.seek(0)
+
+        # Image.open only parses the header; pixels are decoded on load()
+        try:
+            image = Image.open(upload.file)
+        except Image.DecompressionBombError as e:
+            # Pillow refuses headers far above its own pixel limit before we can check them
+            raise UploadRejected(413, f"Image has too many pixels; the limit is {MAX_IMAGE_PIXELS:,} pixels", "pixels") from e
+        except Exception:
+            raise UploadRejected(415, "File is not a readable image", "file_type")
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            image.close()
+            raise UploadRejected(
+                413, f"Image is {image.width}x{image.height}; the limit is {MAX_IMAGE_PIXELS:,} pixels", "pixels",
+            )
+    except UploadRejected:
+        await upload.close()
+        raise
+    return ImageUpload(upload, size, digest.hexdigest(), image, mime)
+
+
+class MemoryBudget:
+    """Byte budget shared by every request in this process"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes, timeout=UPLOAD_BUDGET_WAIT):
+        # A single image larger than the whole budget runs alone
+        nbytes = min(nbytes, self.limit)
+
+        def fits():
+            return self.in_use + nbytes <= self.limit
+
+        async with self._cond:
+            try:
+                # Checked first: wait_for with a zero timeout (deadline used up) fails even when there is room
+                if not fits():
+                    await asyncio.wait_for(self._cond.wait_for(fits), timeout)
+            except asyncio.TimeoutError:
+                raise UploadRejected(
+                    503, "Server is busy processing other images. Please retry shortly.", "busy",
+                    headers={"Retry-After": "5"},
+                )
+            self.in_use += nbytes
+            UPLOAD_BUDGET_IN_USE.set(self.in_use)
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.in_use -= nbytes
+                UPLOAD_BUDGET_IN_USE.set(self.in_use)
+                self._cond.notify_all()
+
+
+memory_budget = MemoryBudget(UPLOAD_MEMORY_BUDGET)
@@ -0,0 +1,232 @@
+"""
+Token usage ledger and daily quota forecast
+Every Gemini generate_content call (detection, analysis, tiles, hedges) and
+every agent LLM turn appends one line to a per-day JSONL file in
+USAGE_LEDGER_DIR:
+
+    {"ts":1760000000.1,"m":"gemini-2.0-flash","e":"detect-component","c":"10.0.0.7","in":1290,"img":1032,"out":212,"usd":0.000214}
+
+m is the model, e the endpoint, c the client (X-Client-Id header, client
+address or agent room), in/out the input/output tokens, img the image
+tokens within in, usd the cost from USAGE_PRICES. Lines are written with a
+single O_APPEND write, so API workers and agent processes can share a file.
+Days follow the quota reset time zone (USAGE_RESET_TZ, Gemini resets at
+midnight Pacific).
+
+rollup() sums a day per model, endpoint and client; forecast() projects the
+rate over the last USAGE_FORECAST_WINDOW seconds to say when today's
+USAGE_DAILY_TOKEN_BUDGET and per-model USAGE_DAILY_REQUESTS budgets run out.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from metrics import REGISTRY
+
+
+def _pairs(value, convert):
+    """"a=1,b=2" -> {"a": convert("1"), "b": convert("2")}"""
+    return {
+        name.strip(): convert(setting.strip())
+        for name, _, setting in (item.partition("=") for item in value.split(",") if "=" in item)
+    }
+
+
+def _price(value):
+    input_price, _, output_price = value.partition(":")
+    return float(input_price), float(output_price or input_price)
+
+
+USAGE_LEDGER = os.getenv("USAGE_LEDGER", "1") == "1"
+LEDGER_DIR = Path(os.getenv("USAGE_LEDGER_DIR", Path(__file__).parent / ".usage"))
+RETENTION_DAYS = int(os.getenv("USAGE_LEDGER_RETENTION_DAYS", "30"))
+RESET_TZ = ZoneInfo(os.getenv("USAGE_RESET_TZ", "America/Los_Angeles"))
+FORECAST_WINDOW = float(os.getenv("USAGE_FORECAST_WINDOW", "3600"))
+# 0 = no token budget; request budgets are per model, in requests per day
+DAILY_TOKEN_BUDGET = int(os.getenv("USAGE_DAILY_TOKEN_BUDGET", "0"))
+DAILY_REQUESTS = _pairs(os.getenv(
+    "USAGE_DAILY_REQUESTS", "gemini-2.0-flash=200,gemini-2.5-flash=250,gemini-2.0-flash-lite=1000",
+), int)
+# USD per million input:output tokens
+PRICES = _pairs(os.getenv(
+    "USAGE_PRICES", "gemini-2.0-flash=0.10:0.40,gemini-2.5-flash=0.30:2.50,gemini-2.0-flash-lite=0.075:0.30",
+), _price)
+
+USAGE_TOKENS = REGISTRY.counter(
+    "usage_tokens_total", "LLM tokens recorded in the usage ledger", ("model", "endpoint", "kind"),
+)
+
+# (endpoint, client) of the request being served; set once per request or session
+_context = contextvars.ContextVar("usage_context", default=("other", None))
+_lock = threading.Lock()
+_file = {"day": None, "fd": None}
+
+
+def set_context(endpoint, client=None):
+    """Attribute usage recorded from the current task (and tasks it starts) to endpoint and client"""
+    _context.set((endpoint, client))
+
+
+def client_id(connection):
+    """X-Client-Id header, else the peer address, of a FastAPI Request or WebSocket"""
+    return connection.headers.get("x-client-id") or (connection.client.host if connection.client else None)
+
+
+def quota_day(ts=None):
+    return datetime.fromtimestamp(ts if ts is not None else time.time(), RESET_TZ).date()
+
+
+def ledger_path(day):
+    return LEDGER_DIR / f"usage-{day.isoformat()}.jsonl"
+
+
+def _prune(today):
+    cutoff = ledger_path(today - timedelta(days=RETENTION_DAYS)).name
+    for path in LEDGER_DIR.glob("usage-*.jsonl"):
+        if path.name < cutoff:
+            path.unlink(missing_ok=True)
+
+
+def _append(line, day):
+    with _lock:
+        if _file["day"] != day:
+            if _file["fd"] is not None:
+                os.close(_file["fd"])
+            LEDGER_DIR.mkdir(parents=True, exist_ok=True)
+            _file["fd"] = os.open(ledger_path(day), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _file["day"] = day
+            _prune(day)
+        os.write(_file["fd"], line)
+
+
+def cost(model, input_tokens, output_tokens):
+    input_price, output_price = PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def record(model, input_tokens, output_tokens, image_tokens=0, endpoint=None, client=None):
+    """Append one call's usage; endpoint and client default to the current set_context()"""
+    if not USAGE_LEDGER:
+        return
+    context_endpoint, context_client = _context.get()
+    endpoint = endpoint or context_endpoint
+    client = client if client is not None else context_client
+    ts = time.time()
+    entry = {
+        "ts": round(ts, 3), "m": model, "e": endpoint, "c": client,
+        "in": input_tokens, "img": image_tokens, "out": output_tokens,
+        "usd": round(cost(model, input_tokens, output_tokens), 6),
+    }
+    USAGE_TOKENS.inc(input_tokens, model=model, endpoint=endpoint, kind="input")
+    USAGE_TOKENS.inc(output_tokens, model=model, endpoint=endpoint, kind="output")
+    if image_tokens:
+        USAGE_TOKENS.inc(image_tokens, model=model, endpoint=endpoint, kind="image")
+    try:
+        _append((json.dumps(entry, separators=(",", ":")) + "\n").encode(), quota_day(ts))
+    except OSError as e:
+        print(f"⚠️ Failed to write usage ledger: {e}")
+
+
+def record_gemini(model, response):
+    """Record a google.generativeai response from its usage_metadata (no-op when absent)"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    image_tokens = sum(
+        detail.token_count for detail in (getattr(usage, "prompt_tokens_details", None) or [])
+        if "IMAGE" in str(getattr(detail, "modality", ""))
+    )
+    # Thinking tokens (2.5 models) are billed as output
+    output_tokens = (getattr(usage, "candidates_token_count", 0) or 0) + (getattr(usage, "thoughts_token_count", 0) or 0)
+    record(model, getattr(usage, "prompt_token_count", 0) or 0, output_tokens, image_tokens)
+
+
+def read(day=None):
+    """Entries for a quota day (today by default); unreadable lines are skipped"""
+    path = ledger_path(day or quota_day())
+    if not path.exists():
+        return []
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue  # a line cut short by a crash
+    return entries
+
+
+def _totals():
+    return {"requests": 0, "input_tokens": 0, "image_tokens": 0, "output_tokens": 0, "usd": 0.0}
+
+
+def _add(totals, entry):
+    totals["requests"] += 1
+    totals["input_tokens"] += entry["in"]
+    totals["image_tokens"] += entry["img"]
+    totals["output_tokens"] += entry["out"]
+    totals["usd"] += entry["usd"]
+
+
+def rollup(day=None):
+    """Totals for a quota day, overall and per model, endpoint and client"""
+    day = day or quota_day()
+    result = {"day": day.isoformat(), "totals": _totals(), "by_model": {}, "by_endpoint": {}, "by_client": {}}
+    for entry in read(day):
+        _add(result["totals"], entry)
+        for group, key in (("by_model", "m"), ("by_endpoint", "e"), ("by_client", "c")):
+            _add(result[group].setdefault(entry[key] or "unknown", _totals()), entry)
+    for totals in [result["totals"]] + [t for g in ("by_model", "by_endpoint", "by_client") for t in result[g].values()]:
+        totals["usd"] = round(totals["usd"], 6)
+    return result
+
+
+def _project(used, recent, budget, window, now, reset_at):
+    """Remaining budget and when it runs out if the last window's rate continues"""
+    rate = recent / window if window > 0 else 0.0
+    remaining = budget - used
+    projection = {"budget": budget, "used": used, "remaining": max(remaining, 0), "rate_per_hour": round(rate * 3600, 1)}
+    if remaining <= 0:
+        exhausted_at = now
+    elif rate > 0:
+        exhausted_at = now + remaining / rate
+    else:
+        exhausted_at = None
+    projection["exhausted_at"] = datetime.fromtimestamp(exhausted_at, RESET_TZ).isoformat(timespec="seconds") if exhausted_at else None
+    projection["exhausted_before_reset"] = exhausted_at is not None and exhausted_at < reset_at
+    return projection
+
+
+def forecast(now=None):
+    """When today's token and per-model request budgets run out at the current rate"""
+    now = now if now is not None else time.time()
+    today = quota_day(now)
+    start_of_day = datetime.combine(today, datetime.min.time(), RESET_TZ).timestamp()
+    reset_at = datetime.combine(today + timedelta(days=1), datetime.min.time(), RESET_TZ).timestamp()
+    window = min(FORECAST_WINDOW, now - start_of_day)
+    entries = read(today)
+    recent = [e for e in entries if e["ts"] >= now - window]
+
+    result = {
+        "day": today.isoformat(),
+        "resets_at": datetime.fromtimestamp(reset_at, RESET_TZ).isoformat(timespec="seconds"),
+        "window_seconds": round(window),
+        "tokens": None,
+        "requests": {},
+    }
+    if DAILY_TOKEN_BUDGET:
+        result["tokens"] = _project(
+            sum(e["in"] + e["out"] for e in entries), sum(e["in"] + e["out"] for e in recent),
+            DAILY_TOKEN_BUDGET, window, now, reset_at,
+        )
+    for model in sorted(DAILY_REQUESTS):
+        result["requests"][model] = _project(
+            sum(1 for e in entries if e["m"] == model), sum(1 for e in recent if e["m"] == model),
+            DAILY_REQUESTS[model], window, now, reset_at,
+        )
+    return result
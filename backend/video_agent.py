@@ -1,17 +1,15 @@
 import asyncio
+import functools
 import logging
 import time
 import io
+import json
 import os
 from datetime import datetime, timezone
-from typing import Union, AsyncIterable, Optional, List, TYPE_CHECKING
+from typing import Union, AsyncIterable, Optional, List
 from uuid import uuid4
 
 from dotenv import load_dotenv
-from langfuse import Langfuse
-
-if TYPE_CHECKING:
-    from langfuse.client import StatefulClient
 
 from livekit import rtc
 from livekit.agents import (
@@ -20,6 +18,7 @@ from livekit.agents import (
     ChatContext,
     ChatMessage,
     JobContext,
+    JobProcess,
     FunctionTool,
     ModelSettings,
     RoomInputOptions,
@@ -30,9 +29,9 @@ from livekit.agents import (
     stt,
     llm,
 )
-from livekit.agents.llm import ImageContent, AudioContent
-from livekit.plugins import cartesia, deepgram, silero
-from google.genai import types
+from livekit.agents.llm import LLM
+from livekit.agents.metrics import RealtimeModelMetrics
+from livekit.plugins import deepgram, silero
 # Choose LLM plugin dynamically: prefer Google (Gemini) when available,
 # otherwise fall back to OpenAI plugin. Importing a missing plugin would
 # raise at module import time, so do this in a try/except to keep the
@@ -59,14 +58,20 @@ try:
 except Exception:
     EnglishModel = None
 
-from knowledge_manager import KnowledgeManager
+from knowledge_manager import KnowledgeManager, ProcedureCursor
+from tracing import get_tracer, Trace
+from metrics import write_textfile
+from voice_metrics import TurnLatencyTracker, process_summary, JOIN_TO_FIRST_AUDIO_SECONDS
+import worker_load
+from frame_prep import FramePreparer
+from agent_bridge import DETECTION_TOPIC
+from speculative import SpeculativeGenerator, Speculation, SPECULATIVE_LLM
+import usage_ledger
 
 logger = logging.getLogger("openai-video-agent")
 logger.setLevel(logging.INFO)
 
 load_dotenv()
-_langfuse = Langfuse()
-knowledge_manager = KnowledgeManager()
 
 # Optional: allow disabling inference runners (useful on Windows when IPC
 # pipes/sockets are unstable or you don't need inference features).
@@ -79,7 +84,7 @@ if os.getenv("LIVEKIT_DISABLE_INFERENCE", "0") == "1":
     except Exception as _e:
         logger.warning("Failed to disable inference runners: %s", _e)
 
-INSTRUCTIONS = f"""
+BASE_INSTRUCTIONS = """
 You are a helpful hardware upgrade assistant AI who can guide users through laptop and desktop computer hardware upgrades when they share images or their screen.
 
 IMPORTANT: Respond in plain text only. Do not use any markdown formatting including bold, italics, bullet points, numbered lists, or other markdown syntax. Your responses will be read aloud by text-to-speech.
@@ -104,12 +109,77 @@ When structured data is available from the image analysis, reference the specifi
 Always prioritize safety. Remind users to power off devices, unplug power sources, and use anti-static precautions.
 
 Guide users through procedures one step at a time. Do not rush ahead. Wait for confirmation before proceeding to the next step.
-
-{knowledge_manager.format_knowledge()}
 """
 
+
+# The knowledge base is read and the full prompt assembled on first use
+# (normally in prewarm), not at import time.
+# With the step engine on, the procedures and troubleshooting guide are left
+# out of the prompt and the relevant step is injected per turn instead. That
+# injection only reaches pipeline LLMs, so realtime models keep the full prompt.
+STEP_ENGINE = os.getenv("AGENT_STEP_ENGINE", "1") == "1"
+# Pooled rooms live this long unused; an agent dispatched to one waits at most as long
+ROOM_POOL_EMPTY_TIMEOUT = float(os.getenv("ROOM_POOL_EMPTY_TIMEOUT", "300"))
+
+
+@functools.lru_cache(maxsize=1)
+def get_knowledge_manager() -> KnowledgeManager:
+    return KnowledgeManager()
+
+
+@functools.lru_cache(maxsize=2)
+def build_instructions(step_engine: bool = False) -> str:
+    exclude = ("dashboard", "export") if step_engine else ()
+    return f"{BASE_INSTRUCTIONS}\n{get_knowledge_manager().format_knowledge(exclude=exclude)}\n"
+
+
+def load_turn_detector():
+    if EnglishModel is not None and os.getenv('LIVEKIT_ENABLE_TURN_DETECTOR', '0') == '1':
+        return EnglishModel()
+    return None
+
+
+def create_realtime_model(instructions: str):
+    """Gemini Realtime model for live voice; None if the plugin cannot build one"""
+    try:
+        from livekit.plugins import google
+        return google.realtime.RealtimeModel(
+            model=os.getenv("GEMINI_MODEL", "gemini-live-2.5-flash-preview"),
+            voice="Puck",
+            temperature=0.8,
+            instructions=instructions,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to load Gemini Realtime model: {e}")
+        # Fallback to Realtime API with same model
+        try:
+            from livekit.plugins import google
+            return google.realtime.RealtimeModel(
+                model="gemini-live-2.5-flash-preview",
+                voice="Puck",
+                temperature=0.8,
+                instructions=instructions,
+            )
+        except Exception:
+            return None
+
+
 class VideoAgent(Agent):
-    def __init__(self, instructions: str, room: rtc.Room, llm=None) -> None:
+    # Provider-backed node implementations wrapped by the overrides below.
+    # bench_agent_replay.py swaps in scripted STT/LLM/TTS here.
+    upstream_nodes = Agent.default
+
+    def __init__(
+        self,
+        instructions: str,
+        room: rtc.Room,
+        llm=None,
+        stt=None,
+        vad=None,
+        turn_detection=None,
+        join_time: Optional[float] = None,
+        prewarmed: bool = False,
+    ) -> None:
         # Determine LLM instance to use for this agent. Prefer an explicit
         # llm passed in; otherwise use the plugin selected at module import
         # time (llm_plugin). If no plugin was loaded, leave llm as None so
@@ -130,26 +200,45 @@ class VideoAgent(Agent):
         super().__init__(
             instructions=instructions,
             llm=selected_llm,
-            stt=deepgram.STT(),
+            stt=stt if stt is not None else deepgram.STT(),
             tts=None,  # Gemini Realtime API has native audio, no separate TTS needed
-            vad=silero.VAD.load(),
-            turn_detection=(EnglishModel() if (EnglishModel is not None and os.getenv('LIVEKIT_ENABLE_TURN_DETECTOR', '0') == '1') else None),
+            # Prewarmed workers pass the process-level models in; load on demand otherwise
+            vad=vad if vad is not None else silero.VAD.load(),
+            turn_detection=turn_detection if turn_detection is not None else load_turn_detector(),
         )
         self.room = room
         self.session_id = str(uuid4())
+        self.latency = TurnLatencyTracker(self.session_id)
+        self.join_time = join_time
+        self.prewarmed = prewarmed
         self.current_trace = None
         self.frames: List[rtc.VideoFrame] = []
         self.last_frame_time: float = 0
         self.video_stream: Optional[rtc.VideoStream] = None
+        self.active_llm_streams = 0
+        # Detection updates being applied; referenced until done so they are not garbage collected
+        self._pending_detections: set = set()
+        self.previous_frame: Optional[rtc.VideoFrame] = None
+        self.frame_prep = FramePreparer(provider_format)
+        self.procedure = (
+            ProcedureCursor(get_knowledge_manager())
+            if STEP_ENGINE and isinstance(selected_llm, LLM) else None
+        )
+        # Realtime models never run llm_node, so there is nothing to speculate for them
+        self.speculative = (
+            SpeculativeGenerator(self.start_speculation, self.record_discarded_speculation)
+            if SPECULATIVE_LLM and isinstance(selected_llm, LLM) else None
+        )
 
     async def close(self) -> None:
         await self.close_video_stream()
-        if self.current_trace:
-            self.current_trace = None
-        try:
-            _langfuse.flush()
-        except Exception:
-            pass
+        self.frames = []
+        if self.speculative is not None:
+            self.speculative.close()
+        worker_load.unregister(self)
+        # Finishing only enqueues the trace; export happens on the tracer's
+        # background thread so teardown never waits on the backend.
+        self.finish_current_trace()
 
     async def close_video_stream(self) -> None:
         if self.video_stream:
@@ -157,75 +246,99 @@ class VideoAgent(Agent):
             self.video_stream = None
 
     async def on_enter(self) -> None:
+        worker_load.register(self)
         self.session.generate_reply(instructions="introduce yourself very briefly")
         self.session.on("user_state_changed", self.on_user_state_change)
+        self.session.on("agent_state_changed", self.on_agent_state_change)
+        self.session.on("metrics_collected", self.on_metrics_collected)
         self.room.on("track_subscribed", self.on_track_subscribed)
+        self.room.on("data_received", self.on_data_received)
 
     async def on_exit(self) -> None:
         await self.session.generate_reply(
             instructions="tell the user a friendly goodbye before you exit",
         )
+        self.export_latency_summary()
         await self.close()
 
-    def get_current_trace(self) -> "StatefulClient":
-        class _NoopSpan:
-            def update(self, *args, **kwargs): return None
-            def end(self, *args, **kwargs): return None
-
-        class _NoopTrace:
-            trace_id = None
-            def span(self, *args, **kwargs): return _NoopSpan()
-            def generation(self, *args, **kwargs): return _NoopSpan()
-
-        if self.current_trace:
-            return self.current_trace
-
-        try:
-            if hasattr(_langfuse, "start_span"):
-                root = _langfuse.start_span(name="video_agent", metadata={"session_id": self.session_id})
-
-                class _LFTrace:
-                    def __init__(self, client, root_span):
-                        self._client = client
-                        self._root = root_span
-
-                    @property
-                    def trace_id(self):
-                        return getattr(self._root, "trace_id", None)
-
-                    def span(self, name: str, metadata: dict | None = None):
-                        return _langfuse.start_span(name=name, metadata=metadata)
-
-                    def generation(self, name: str, model: str | None = None, input: object | None = None):
-                        return _langfuse.start_span(name=name, metadata={"model": model, "input": input})
-
-                self.current_trace = _LFTrace(_langfuse, root)
-                return self.current_trace
-        except Exception:
-            pass
-
-        self.current_trace = _NoopTrace()
+    def export_latency_summary(self) -> None:
+        self.latency.finish_turn()
+        logger.info("Session latency summary: %s", json.dumps(self.latency.summary()))
+        if self.speculative is not None:
+            logger.info("Speculative generation summary: %s", json.dumps(self.speculative.summary()))
+        logger.info("Process latency percentiles: %s", json.dumps(process_summary()))
+        metrics_dir = os.getenv("AGENT_METRICS_DIR")
+        if metrics_dir:
+            try:
+                write_textfile(os.path.join(metrics_dir, f"video_agent_{os.getpid()}.prom"))
+            except OSError as e:
+                logger.warning(f"Failed to write metrics textfile: {e}")
+
+    def get_current_trace(self) -> Trace:
+        if self.current_trace is None:
+            self.current_trace = get_tracer().start_trace(
+                name="video_agent", metadata={"session_id": self.session_id},
+            )
         return self.current_trace
 
+    def finish_current_trace(self) -> None:
+        if self.current_trace is not None:
+            self.current_trace.finish()
+            self.current_trace = None
+
     def on_user_state_change(self, event: UserStateChangedEvent) -> None:
         logger.info(f"User state changed: {event.old_state} -> {event.new_state}")
+        if event.old_state == "speaking" and event.new_state != "speaking":
+            self.latency.end_of_speech(getattr(event, "created_at", None))
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.llm, "model", None) or type(self.llm).__name__
+
+    def on_metrics_collected(self, event) -> None:
+        # Pipeline LLM turns are recorded in llm_node; realtime models never run it
+        if isinstance(event.metrics, RealtimeModelMetrics):
+            details = getattr(event.metrics, "input_token_details", None)
+            usage_ledger.record(
+                self.model_name, event.metrics.input_tokens, event.metrics.output_tokens,
+                image_tokens=getattr(details, "image_tokens", 0) or 0, endpoint="agent", client=self.room.name,
+            )
+
+    def on_agent_state_change(self, event) -> None:
+        if event.new_state == "speaking":
+            spoke_at = getattr(event, "created_at", None) or time.time()
+            if self.join_time is not None:
+                join_to_audio = spoke_at - self.join_time
+                self.join_time = None
+                JOIN_TO_FIRST_AUDIO_SECONDS.observe(join_to_audio, prewarmed=str(self.prewarmed).lower())
+                logger.info(f"Join to first audio: {join_to_audio * 1000:.0f} ms (prewarmed={self.prewarmed})")
+            self.latency.first_audio(spoke_at)
 
     async def on_user_turn_completed(
         self, turn_ctx: ChatContext, new_message: ChatMessage,
     ) -> None:
-        if self.current_trace:
-            self.current_trace = None
+        self.finish_current_trace()
         self.current_trace = self.get_current_trace()
         logger.info(f"User turn completed {self.current_trace.trace_id}")
+        if self.procedure is not None:
+            step_context = self.procedure.update(new_message.text_content or "")
+            if step_context:
+                turn_ctx.add_message(role="assistant", content=step_context)
+                logger.info(f"Injected procedure step {self.procedure.step_id}")
 
     async def stt_node(
         self, audio: AsyncIterable[rtc.AudioFrame], model_settings: ModelSettings
     ) -> Optional[AsyncIterable[stt.SpeechEvent]]:
         span = self.get_current_trace().span(name="stt_node", metadata={"model": "deepgram"})
         try:
-            async for event in Agent.default.stt_node(self, audio, model_settings):
+            async for event in self.upstream_nodes.stt_node(self, audio, model_settings):
                 if event.type == stt.SpeechEventType.FINAL_TRANSCRIPT:
+                    self.latency.final_transcript()
                     logger.info(f"Speech recognized: {event.alternatives[0].text[:50]}...")
+                    if self.speculative is not None:
+                        self.speculative.on_final(event.alternatives[0].text)
+                elif event.type == stt.SpeechEventType.INTERIM_TRANSCRIPT and self.speculative is not None:
+                    self.speculative.on_interim(event.alternatives[0].text)
                 yield event
         except Exception as e:
             span.update(level="ERROR")
@@ -241,82 +354,141 @@ class VideoAgent(Agent):
         model_settings: ModelSettings
     ) -> AsyncIterable[llm.ChatChunk]:
 
-        copied_ctx = chat_ctx.copy()
-        frames_to_use = self.current_frames()
+        self.latency.llm_started()
+        self.active_llm_streams += 1
+        # Everything after the increment sits in this try, so a failure while
+        # preparing the turn cannot leave the stream counted as active
+        try:
+            speculation = None
+            if self.speculative is not None:
+                speculation = self.speculative.take(last_user_text(chat_ctx))
+            if speculation is not None:
+                # The frames were attached when the speculation started; drop them like current_frames() would
+                del self.frames[:speculation.frame_count]
+                copied_ctx, frames_to_use, frame_stats = speculation.chat_ctx, speculation.frames, speculation.frame_stats
+                source = speculation.stream()
+            else:
+                frames_to_use = self.current_frames()
+                copied_ctx, frame_stats = await self.add_frames(chat_ctx.copy(), frames_to_use)
+                source = self.upstream_nodes.llm_node(self, copied_ctx, tools, model_settings)
+            if frames_to_use:
+                self.latency.frames_attached(
+                    len(frames_to_use), sum(len(frame.data) for _, frame in frames_to_use),
+                    image_tokens=frame_stats["image_tokens"], baseline_tokens=frame_stats["baseline_tokens"],
+                )
 
-        if frames_to_use:
-            for position, frame in frames_to_use:
-                image_content = ImageContent(image=frame, inference_detail="high")
-                copied_ctx.add_message(
+            try:
+                messages, _ = copied_ctx.to_provider_format(format=getattr(self, "provider_format", PROVIDER_FORMAT if 'PROVIDER_FORMAT' in globals() else "openai"))
+            except Exception:
+                try:
+                    # If the selected llm exposes a helper utils.to_chat_ctx, use it
+                    utils = getattr(self.llm, "utils", None) if getattr(self, "llm", None) is not None else None
+                    if utils and hasattr(utils, "to_chat_ctx"):
+                        messages = utils.to_chat_ctx(copied_ctx, cache_key=self.llm)
+                    else:
+                        messages = None
+                except Exception:
+                    messages = None
+
+            generation = self.get_current_trace().generation(
+                name="llm_generation",
+                model="Gemini 2.0 Flash Live",
+                input=messages,
+            )
+            output = ""
+            usage = None
+            set_completion_start_time = False
+            try:
+                async for chunk in source:
+                    if not set_completion_start_time:
+                        self.latency.llm_first_chunk()
+                        generation.update(
+                            completion_start_time=datetime.now(timezone.utc),
+                        )
+                        set_completion_start_time = True
+                    if chunk.delta and chunk.delta.content:
+                        output += chunk.delta.content
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    yield chunk
+            except Exception as e:
+                generation.update(level="ERROR")
+                logger.error(f"LLM error: {e}")
+                raise
+            finally:
+                generation.end(output=output)
+                if usage is not None:
+                    # Image tokens are frame_prep's estimate; providers only report the input total
+                    usage_ledger.record(
+                        self.model_name, usage.prompt_tokens, usage.completion_tokens,
+                        image_tokens=frame_stats["image_tokens"], endpoint="agent", client=self.room.name,
+                    )
+        finally:
+            self.latency.llm_finished()
+            self.active_llm_streams -= 1
+
+    async def add_frames(self, chat_ctx: llm.ChatContext, frames) -> tuple:
+        """Attach frames prepared by frame_prep (ROI crop, per-frame detail); returns (chat_ctx, stats)"""
+        # RGBA conversion and cropping of a 4K share take tens of ms; keep them off the audio loop
+        prepared, stats = await asyncio.to_thread(self.frame_prep.prepare, frames, previous=self.previous_frame)
+        if prepared:
+            for position, image_content in prepared:
+                chat_ctx.add_message(
                     role="user",
                     content=[f"{position.title()} view of user during speech:", image_content]
                 )
                 logger.info(f"Added {position} frame to chat context")
+            logger.info(
+                f"Image tokens this turn: ~{stats['image_tokens']} (whole frames: ~{stats['baseline_tokens']}), "
+                f"roi={stats['roi']}"
+            )
         else:
-            copied_ctx.add_message(
+            chat_ctx.add_message(
                 role="system",
                 content="The user is not currently sharing their screen. Let them know they need to share their screen for you to provide visual assistance."
             )
             logger.warning("No captured frames available for this conversation")
-
-        try:
-            messages, _ = copied_ctx.to_provider_format(format=getattr(self, "provider_format", PROVIDER_FORMAT if 'PROVIDER_FORMAT' in globals() else "openai"))
-        except Exception:
-            try:
-                # If the selected llm exposes a helper utils.to_chat_ctx, use it
-                utils = getattr(self.llm, "utils", None) if getattr(self, "llm", None) is not None else None
-                if utils and hasattr(utils, "to_chat_ctx"):
-                    messages = utils.to_chat_ctx(copied_ctx, cache_key=self.llm)
-                else:
-                    messages = None
-            except Exception:
-                messages = None
-        
-        generation = self.get_current_trace().generation(
-            name="llm_generation",
-            model="Gemini 2.0 Flash Live",
-            input=messages,
-        )
-        output = ""
-        set_completion_start_time = False
-        try:
-            async for chunk in Agent.default.llm_node(self, copied_ctx, tools, model_settings):
-                if not set_completion_start_time:
-                    generation.update(
-                        completion_start_time=datetime.now(timezone.utc),
-                    )
-                    set_completion_start_time = True
-                if chunk.delta and chunk.delta.content:
-                    output += chunk.delta.content
-                yield chunk
-        except Exception as e:
-            generation.update(level="ERROR")
-            logger.error(f"LLM error: {e}")
-            raise
-        finally:
-            # Different langfuse clients/wrappers may expect different
-            # signatures for end(). Be permissive: try common kwarg first,
-            # then try positional, then call without args.
-            try:
-                generation.end(output=output)
-            except TypeError:
-                try:
-                    generation.end(output)
-                except TypeError:
-                    try:
-                        generation.end()
-                    except Exception:
-                        # swallow; we don't want tracing failures to break
-                        # the agent flow
-                        logger.debug("Failed to end generation trace", exc_info=True)
+        return chat_ctx, stats
+
+    async def start_speculation(self, text: str) -> Speculation:
+        """Start llm_node's upstream generation for an interim transcript, keeping the frames for the turn"""
+        frame_count = len(self.frames)
+        frames = self.current_frames(consume=False)
+        chat_ctx = self.chat_ctx.copy()
+        chat_ctx.add_message(role="user", content=text)
+        step_context = self.procedure.preview(text) if self.procedure is not None else None
+        if step_context:
+            chat_ctx.add_message(role="assistant", content=step_context)
+        chat_ctx, frame_stats = await self.add_frames(chat_ctx, frames)
+        stream = self.upstream_nodes.llm_node(self, chat_ctx, self.tools, ModelSettings())
+        logger.info(f"Speculative generation started for: {text[:50]}...")
+        return Speculation(text, stream, chat_ctx, frames, frame_count, frame_stats)
+
+    def record_discarded_speculation(self, speculation: Speculation) -> None:
+        """Ledger entry for a speculative run that was thrown away; its tokens are billed all the same"""
+        if speculation.usage is not None:
+            input_tokens, output_tokens = speculation.usage.prompt_tokens, speculation.usage.completion_tokens
+        else:
+            # Cancelled before the provider reported usage: the frames and the output so far are estimates
+            input_tokens, output_tokens = speculation.frame_stats["image_tokens"], speculation.tokens
+        if input_tokens or output_tokens:
+            usage_ledger.record(
+                self.model_name, input_tokens, output_tokens,
+                image_tokens=speculation.frame_stats["image_tokens"], endpoint="agent", client=self.room.name,
+            )
 
     async def tts_node(
         self, text: AsyncIterable[str], model_settings: ModelSettings
     ) -> AsyncIterable[rtc.AudioFrame]:
         span = self.get_current_trace().span(name="tts_node", metadata={"model": "cartesia"})
         logger.debug("tts_node: starting TTS node")
+        self.latency.tts_started()
+        first_audio = True
         try:
-            async for event in Agent.default.tts_node(self, text, model_settings):
+            async for event in self.upstream_nodes.tts_node(self, text, model_settings):
+                if first_audio:
+                    self.latency.first_audio()
+                    first_audio = False
                 try:
                     size = None
                     if hasattr(event, "data"):
@@ -334,6 +506,41 @@ class VideoAgent(Agent):
         finally:
             span.end()
 
+    def on_data_received(self, packet: rtc.DataPacket) -> None:
+        if packet.topic != DETECTION_TOPIC:
+            return
+        if packet.participant is not None:
+            # Only the API server publishes detections (SendData has no sender
+            # participant); anything from a room member could inject context
+            logger.warning(f"Ignoring detection message from participant {packet.participant.identity}")
+            return
+        try:
+            payload = json.loads(packet.data)
+        except ValueError as e:
+            logger.warning(f"Ignoring malformed detection message: {e}")
+            return
+        task = asyncio.create_task(self.apply_detection(payload))
+        self._pending_detections.add(task)
+        task.add_done_callback(self._pending_detections.discard)
+
+    async def apply_detection(self, payload: dict) -> None:
+        """Add detection results sent by the API (agent_bridge.py) to the conversation"""
+        components = payload.get("components", [])
+        logger.info(f"Received detection results for {len(components)} components")
+        self.frame_prep.set_detections(components)
+        if self.procedure is not None:
+            categories = {c.get("upgrade_category") for c in components} - {"FASTENER", "OTHER_COMPONENT"}
+            if len(categories) == 1:
+                self.procedure.suggest(categories.pop())
+        compact = {key: payload.get(key) for key in ("summary", "components", "recommendations")}
+        chat_ctx = self.chat_ctx.copy()
+        chat_ctx.add_message(
+            role="assistant",
+            content="Structured data from component detection on the image the user just uploaded "
+                    "(use it instead of re-analyzing the image): " + json.dumps(compact, separators=(",", ":")),
+        )
+        await self.update_chat_ctx(chat_ctx)
+
     def on_track_subscribed(
         self,
         track: rtc.RemoteTrack,
@@ -354,13 +561,15 @@ class VideoAgent(Agent):
             current_time = time.time()
             if current_time - self.last_frame_time >= 1.0:
                 frame = event.frame
+                if self.frames:
+                    self.previous_frame = self.frames[-1]
                 self.frames.append(frame)
                 self.last_frame_time = current_time
                 frame_count += 1
                 logger.info(f"Captured frame #{frame_count}: {frame.width}x{frame.height}")
         logger.info(f"Video frame capture ended - captured {frame_count} frames")
 
-    def current_frames(self) -> List[rtc.VideoFrame]:
+    def current_frames(self, consume: bool = True) -> List[rtc.VideoFrame]:
         current_frames = []
         if len(self.frames) > 0:
             current_frames.append(("most recent", self.frames[-1]))
@@ -370,50 +579,80 @@ class VideoAgent(Agent):
                     mid_idx = len(self.frames) // 2
                     current_frames.append(("middle", self.frames[mid_idx]))
         logger.info(f"Adding {len(current_frames)} frames to conversation (from {len(self.frames)} available)")
-        self.frames = []
+        if consume:
+            self.frames = []
         return list(reversed(current_frames))
 
 
+def last_user_text(chat_ctx: llm.ChatContext) -> str:
+    for item in reversed(chat_ctx.items):
+        if getattr(item, "type", None) == "message" and item.role == "user":
+            return item.text_content or ""
+    return ""
+
+
+def prewarm(proc: JobProcess) -> None:
+    """Load models, the knowledge prompt and the LLM once per worker process"""
+    if os.getenv("AGENT_PREWARM", "1") != "1":
+        logger.info("AGENT_PREWARM=0 -> models load per session")
+        return
+    start = time.perf_counter()
+    proc.userdata["vad"] = silero.VAD.load()
+    proc.userdata["turn_detection"] = load_turn_detector()
+    proc.userdata["instructions"] = build_instructions()
+    proc.userdata["llm"] = create_realtime_model(proc.userdata["instructions"])
+    if STEP_ENGINE:
+        build_instructions(step_engine=True)  # for sessions that fall back to a pipeline LLM
+    logger.info(f"Worker process prewarmed in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
 async def entrypoint(ctx: JobContext) -> None:
+    join_time = time.time()
     await ctx.connect()
     logger.info(f"Connected to room: {ctx.room.name}")
     logger.info(f"Local participant: {ctx.room.local_participant.identity}")
 
     if len(ctx.room.remote_participants) == 0:
-        logger.info("No remote participants in room, exiting")
-        return
+        # Pooled rooms are created ahead of time and dispatched while still empty;
+        # wait for the user the room is handed to (the job ends if the room closes first)
+        logger.info("No remote participants yet, waiting for one to join")
+        try:
+            with worker_load.waiting():
+                participant = await asyncio.wait_for(ctx.wait_for_participant(), ROOM_POOL_EMPTY_TIMEOUT)
+        except asyncio.TimeoutError:
+            # The room was never handed out; leave so LiveKit can close it
+            logger.info(f"No participant joined within {ROOM_POOL_EMPTY_TIMEOUT:.0f}s, shutting down")
+            ctx.shutdown(reason="no participant joined")
+            return
+        logger.info(f"Participant joined: {participant.identity}")
+        join_time = time.time()
 
     logger.info(f"Found {len(ctx.room.remote_participants)} remote participants")
 
+    # Models loaded by prewarm() are shared by every session in this process
+    shared = ctx.proc.userdata
+    prewarmed = "vad" in shared
+    instructions = shared.get("instructions") or build_instructions()
+
     # Use Gemini Realtime API for live voice interaction
-    default_llm = None
-    try:
-        from livekit.plugins import google
-        default_llm = google.realtime.RealtimeModel(
-            model=os.getenv("GEMINI_MODEL", "gemini-live-2.5-flash-preview"),
-            voice="Puck",
-            temperature=0.8,
-            instructions=INSTRUCTIONS,
-        )
-    except Exception as e:
-        logger.warning(f"Failed to load Gemini Realtime model: {e}")
-        # Fallback to Realtime API with same model
-        try:
-            from livekit.plugins import google
-            default_llm = google.realtime.RealtimeModel(
-                model="gemini-live-2.5-flash-preview",
-                voice="Puck",
-                temperature=0.8,
-                instructions=INSTRUCTIONS,
-            )
-        except Exception:
-            default_llm = None
+    default_llm = shared.get("llm") or create_realtime_model(instructions)
+    if default_llm is None and STEP_ENGINE:
+        # VideoAgent falls back to a pipeline LLM, which gets the step engine
+        instructions = build_instructions(step_engine=True)
 
     # Create AgentSession with the Realtime LLM
     session = AgentSession(llm=default_llm)
 
     # Configure agent with same LLM
-    agent = VideoAgent(instructions=INSTRUCTIONS, room=ctx.room, llm=default_llm)
+    agent = VideoAgent(
+        instructions=instructions,
+        room=ctx.room,
+        llm=default_llm,
+        vad=shared.get("vad"),
+        turn_detection=shared.get("turn_detection"),
+        join_time=join_time,
+        prewarmed=prewarmed,
+    )
 
     room_input = RoomInputOptions(video_enabled=True, audio_enabled=True)
     room_output = RoomOutputOptions(audio_enabled=True, transcription_enabled=True)
@@ -427,5 +666,12 @@ async def entrypoint(ctx: JobContext) -> None:
 
 
 if __name__ == "__main__":
-    opts = WorkerOptions(entrypoint_fnc=entrypoint, initialize_process_timeout=60.0)
+    opts = WorkerOptions(
+        entrypoint_fnc=entrypoint,
+        prewarm_fnc=prewarm,
+        initialize_process_timeout=60.0,
+        # Stop taking rooms once sessions, frame memory, LLM streams or CPU near their limits
+        load_fnc=worker_load.LoadCalculator(),
+        load_threshold=worker_load.AGENT_LOAD_THRESHOLD,
+    )
     cli.run_app(opts)
@@ -0,0 +1,166 @@
+"""
+Per-turn voice latency tracking for the video agent
+Measures the gap users actually feel: from the moment they stop talking to
+the moment they hear the agent, broken down by pipeline stage. Samples go
+into process-wide histograms (metrics.REGISTRY) and are also kept per
+session so a percentile summary can be logged when the session ends.
+"""
+import time
+from collections import deque
+
+from metrics import REGISTRY, percentiles
+
+VOICE_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+VOICE_STAGE_SECONDS = REGISTRY.histogram(
+    "voice_turn_stage_seconds", "Per-turn voice pipeline latency by stage", ("stage",), buckets=VOICE_BUCKETS,
+)
+VOICE_TURN_FRAMES = REGISTRY.histogram(
+    "voice_turn_frames", "Video frames attached to the LLM context per turn", buckets=(0, 1, 2, 3, 5, 10),
+)
+VOICE_TURN_FRAME_BYTES = REGISTRY.histogram(
+    "voice_turn_frame_bytes", "Raw bytes of video frames attached per turn",
+    buckets=(0, 256e3, 1e6, 4e6, 8e6, 16e6, 32e6, 64e6),
+)
+VOICE_TURN_IMAGE_TOKENS = REGISTRY.histogram(
+    "voice_turn_image_tokens", "Estimated image tokens per turn: as sent, and as whole high-detail frames (baseline)",
+    ("kind",), buckets=(0, 258, 516, 1032, 2064, 4128, 8256, 16512),
+)
+VOICE_TURNS = REGISTRY.counter("voice_turns_total", "Completed voice turns")
+JOIN_TO_FIRST_AUDIO_SECONDS = REGISTRY.histogram(
+    "agent_join_to_first_audio_seconds", "Job start to the agent's first spoken audio (greeting)",
+    ("prewarmed",), buckets=VOICE_BUCKETS + (15.0, 30.0),
+)
+
+# stt_final:       end of speech -> final transcript
+# llm_first_chunk: llm_node start -> first streamed chunk
+# llm_total:       llm_node start -> stream finished
+# tts_first_audio: tts_node start -> first audio frame
+# end_to_end:      end of speech -> first agent audio
+STAGES = ("stt_final", "llm_first_chunk", "llm_total", "tts_first_audio", "end_to_end")
+
+# Recent samples for process-level percentiles (histograms only give buckets)
+_process_samples = {stage: deque(maxlen=2048) for stage in STAGES}
+
+
+class TurnLatencyTracker:
+    """Collects timestamps for the current turn and folds them into stats when it completes"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.samples = {stage: [] for stage in STAGES}
+        self.frames = []
+        self.frame_bytes = []
+        self.image_tokens = []
+        self.baseline_tokens = []
+        self.turns = 0
+        self._turn = None
+
+    def _current(self):
+        if self._turn is None:
+            self._turn = {}
+        return self._turn
+
+    def _mark(self, name, ts=None, only_first=True):
+        turn = self._current()
+        if only_first and name in turn:
+            return
+        turn[name] = ts if ts is not None else time.time()
+
+    def end_of_speech(self, ts=None):
+        """User stopped talking: closes the previous turn and starts a new one"""
+        self.finish_turn()
+        self._mark("end_of_speech", ts)
+
+    def final_transcript(self, ts=None):
+        self._mark("final_transcript", ts)
+
+    def llm_started(self):
+        self._mark("llm_start")
+
+    def llm_first_chunk(self):
+        self._mark("llm_first_chunk")
+
+    def llm_finished(self):
+        self._mark("llm_end")
+        if "first_audio" in self._turn:
+            self.finish_turn()
+
+    def tts_started(self):
+        self._mark("tts_start")
+
+    def first_audio(self, ts=None):
+        self._mark("first_audio", ts)
+        # Realtime models never run llm_node, so there is nothing left to wait for
+        if "llm_end" in self._turn or "llm_start" not in self._turn:
+            self.finish_turn()
+
+    def frames_attached(self, count, nbytes, image_tokens=None, baseline_tokens=None):
+        turn = self._current()
+        turn["frames"] = turn.get("frames", 0) + count
+        turn["frame_bytes"] = turn.get("frame_bytes", 0) + nbytes
+        if image_tokens is not None:
+            turn["image_tokens"] = turn.get("image_tokens", 0) + image_tokens
+            turn["baseline_tokens"] = turn.get("baseline_tokens", 0) + (baseline_tokens or 0)
+
+    def finish_turn(self):
+        turn, self._turn = self._turn, None
+        if not turn:
+            return
+
+        def delta(start, end):
+            if start in turn and end in turn and turn[end] >= turn[start]:
+                return turn[end] - turn[start]
+            return None
+
+        durations = {
+            "stt_final": delta("end_of_speech", "final_transcript"),
+            "llm_first_chunk": delta("llm_start", "llm_first_chunk"),
+            "llm_total": delta("llm_start", "llm_end"),
+            "tts_first_audio": delta("tts_start", "first_audio"),
+            "end_to_end": delta("end_of_speech", "first_audio"),
+        }
+        if all(value is None for value in durations.values()) and "frames" not in turn:
+            return
+        for stage, value in durations.items():
+            if value is None:
+                continue
+            self.samples[stage].append(value)
+            _process_samples[stage].append(value)
+            VOICE_STAGE_SECONDS.observe(value, stage=stage)
+
+        if "frames" in turn:
+            self.frames.append(turn["frames"])
+            self.frame_bytes.append(turn["frame_bytes"])
+            VOICE_TURN_FRAMES.observe(turn["frames"])
+            VOICE_TURN_FRAME_BYTES.observe(turn["frame_bytes"])
+        if "image_tokens" in turn:
+            self.image_tokens.append(turn["image_tokens"])
+            self.baseline_tokens.append(turn["baseline_tokens"])
+            VOICE_TURN_IMAGE_TOKENS.observe(turn["image_tokens"], kind="sent")
+            VOICE_TURN_IMAGE_TOKENS.observe(turn["baseline_tokens"], kind="baseline")
+        self.turns += 1
+        VOICE_TURNS.inc()
+
+    def summary(self):
+        """Per-session percentiles in milliseconds"""
+        return {
+            "session_id": self.session_id,
+            "turns": self.turns,
+            "latency_ms": {
+                stage: {k: round(v * 1000, 1) for k, v in percentiles(values).items()}
+                for stage, values in self.samples.items() if values
+            },
+            "frames_per_turn": percentiles(self.frames),
+            "frame_bytes_per_turn": percentiles(self.frame_bytes),
+            "image_tokens_per_turn": percentiles(self.image_tokens),
+            "baseline_image_tokens_per_turn": percentiles(self.baseline_tokens),
+        }
+
+
+def process_summary():
+    """Percentiles (ms) over the most recent turns handled by this process"""
+    return {
+        stage: {k: round(v * 1000, 1) for k, v in percentiles(list(values)).items()}
+        for stage, values in _process_samples.items() if values
+    }
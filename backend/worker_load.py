@@ -0,0 +1,159 @@
+"""
+Load reporting for the agent worker
+LiveKit dispatches rooms to the worker with the lowest reported load and
+stops sending jobs once a worker reports more than its load_threshold. The
+default load is CPU only, which lags far behind what actually hurts voice
+latency here: the number of live sessions, the video frames they buffer and
+the LLM streams in flight.
+
+Sessions run in separate job processes, so each process publishes a
+heartbeat of its sessions to shared_state, and the worker's load function
+adds them up together with host CPU:
+
+    load = max(sessions / AGENT_MAX_SESSIONS,
+               frame_bytes / AGENT_MAX_FRAME_MB,
+               llm_streams / AGENT_MAX_LLM_STREAMS,
+               cpu_percent / 100)
+
+Whichever resource is closest to its limit decides, so one hot dimension is
+enough to stop taking rooms before the existing sessions slow down.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import weakref
+from collections import deque
+from contextlib import contextmanager
+
+from shared_state import get_store
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger("worker-load")
+
+AGENT_MAX_SESSIONS = int(os.getenv("AGENT_MAX_SESSIONS", "8"))
+AGENT_MAX_FRAME_MB = float(os.getenv("AGENT_MAX_FRAME_MB", "256"))
+AGENT_MAX_LLM_STREAMS = int(os.getenv("AGENT_MAX_LLM_STREAMS", "8"))
+AGENT_LOAD_THRESHOLD = float(os.getenv("AGENT_LOAD_THRESHOLD", "0.75"))
+HEARTBEAT_INTERVAL = float(os.getenv("AGENT_LOAD_HEARTBEAT", "2.0"))
+# CPU samples averaged so one busy tick does not flip the worker to full
+CPU_WINDOW = 5
+
+HOST = socket.gethostname()
+KEY_PREFIX = f"agent-load:{HOST}:"
+
+_agents = weakref.WeakSet()
+# Jobs still waiting for a participant (pooled rooms) hold a process too
+_waiting = 0
+_heartbeat_task = None
+
+
+def register(agent):
+    """Count agent (a VideoAgent) in this process's heartbeat until it closes"""
+    _agents.add(agent)
+    start_heartbeat()
+
+
+def unregister(agent):
+    _agents.discard(agent)
+    publish()
+
+
+@contextmanager
+def waiting():
+    """Count a job that has no session yet as a session while the block runs"""
+    global _waiting
+    _waiting += 1
+    start_heartbeat()
+    try:
+        yield
+    finally:
+        _waiting -= 1
+        publish()
+
+
+def process_stats():
+    """Sessions, buffered frame bytes and in-flight LLM streams in this process"""
+    agents = list(_agents)
+    return {
+        "sessions": len(agents) + _waiting,
+        "frame_bytes": sum(len(frame.data) for agent in agents for frame in agent.frames),
+        "llm_streams": sum(agent.active_llm_streams for agent in agents),
+    }
+
+
+def publish():
+    try:
+        get_store().set(KEY_PREFIX + str(os.getpid()), json.dumps(process_stats()), ttl=HEARTBEAT_INTERVAL * 3)
+    except Exception as e:
+        logger.warning(f"Failed to publish worker load: {e}")
+
+
+async def _heartbeat():
+    while True:
+        publish()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def start_heartbeat():
+    global _heartbeat_task
+    if _heartbeat_task is None or _heartbeat_task.done():
+        _heartbeat_task = asyncio.get_running_loop().create_task(_heartbeat())
+
+
+def host_stats():
+    """Totals over every job process on this host with a live heartbeat"""
+    totals = {"sessions": 0, "frame_bytes": 0, "llm_streams": 0}
+    for value in get_store().scan(KEY_PREFIX).values():
+        stats = json.loads(value)
+        for key in totals:
+            totals[key] += stats.get(key, 0)
+    return totals
+
+
+class LoadCalculator:
+    """load_fnc for WorkerOptions; called periodically in the main worker process"""
+
+    def __init__(self):
+        self._cpu = deque(maxlen=CPU_WINDOW)
+        self._overloaded = False
+        if psutil is not None:
+            psutil.cpu_percent(interval=None)  # first call only sets the baseline
+
+    def cpu_percent(self):
+        if psutil is not None:
+            self._cpu.append(psutil.cpu_percent(interval=None))
+        else:
+            self._cpu.append(min(os.getloadavg()[0] / (os.cpu_count() or 1), 1.0) * 100)
+        return sum(self._cpu) / len(self._cpu)
+
+    def components(self):
+        try:
+            stats = host_stats()
+        except Exception as e:
+            logger.warning(f"Failed to read worker load: {e}")
+            stats = {"sessions": 0, "frame_bytes": 0, "llm_streams": 0}
+        return {
+            "sessions": stats["sessions"] / AGENT_MAX_SESSIONS,
+            "frame_memory": stats["frame_bytes"] / (AGENT_MAX_FRAME_MB * 1024 * 1024),
+            "llm_streams": stats["llm_streams"] / AGENT_MAX_LLM_STREAMS,
+            "cpu": self.cpu_percent() / 100,
+        }
+
+    def __call__(self, worker=None) -> float:
+        components = self.components()
+        load = min(max(components.values()), 1.0)
+        overloaded = load >= AGENT_LOAD_THRESHOLD
+        if overloaded != self._overloaded:
+            self._overloaded = overloaded
+            breakdown = ", ".join(f"{name}={value:.2f}" for name, value in components.items())
+            if overloaded:
+                logger.warning(f"Worker load {load:.2f} >= {AGENT_LOAD_THRESHOLD}; not accepting jobs ({breakdown})")
+            else:
+                logger.info(f"Worker load {load:.2f} below threshold; accepting jobs ({breakdown})")
+        return load
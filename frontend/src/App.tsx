@@ -6,6 +6,7 @@ import './App.css';
 function App() {
   const [token, setToken] = useState<string>('');
   const [url, setUrl] = useState<string>('');
+  const [roomName, setRoomName] = useState<string>('');
   const [participantName, setParticipantName] = useState<string>('');
   const [connected, setConnected] = useState(false);
   const [selectedImage, setSelectedImage] = useState<File | null>(null);
@@ -88,6 +89,7 @@ function App() {
       const data = await response.json();
       setToken(data.token);
       setUrl(data.url);
+      setRoomName(data.room || '');
       setConnected(true);
     } catch (e) {
       console.error(e);
@@ -103,6 +105,7 @@ function App() {
   const onDisconnected = () => {
     setConnected(false);
     setToken('');
+    setRoomName('');
     console.log('Disconnected from room');
   };
 
@@ -140,7 +143,9 @@ function App() {
       const formData = new FormData();
       formData.append('image', selectedImage);
 
-      const response = await fetch('http://localhost:8000/api/detect-component', {
+      // With a room, the backend also hands the results to this room's agent
+      const roomParam = connected && roomName ? `?room=${encodeURIComponent(roomName)}` : '';
+      const response = await fetch(`http://localhost:8000/api/detect-component${roomParam}`, {
         method: 'POST',
         body: formData,
       });